@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Inference Backends for Fracture Detection
+Common predict() interface over Keras, TFLite and ONNX Runtime model artifacts
+"""
+
+import numpy as np
+
+# Default artifact for each backend, relative to the models directory
+BACKEND_ARTIFACTS = {
+    'keras': 'fracture_detection_model.h5',
+    'tflite-fp16': 'fracture_detection_model_fp16.tflite',
+    'tflite-int8': 'fracture_detection_model_int8.tflite',
+    'onnx': 'fracture_detection_model.onnx',
+}
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path=None, model=None, jit_compile=False):
+        import tensorflow as tf
+        from tensorflow import keras
+
+        if model is None:
+            model = keras.models.load_model(str(model_path))
+        self.model = model
+
+        # One fixed signature with a dynamic batch dimension: traced once, reused for every batch size
+        input_shape = [None, *model.input_shape[1:]]
+        self._forward = tf.function(
+            lambda images: self.model(images, training=False),
+            input_signature=[tf.TensorSpec(input_shape, tf.float32)],
+            jit_compile=jit_compile
+        )
+
+    def predict(self, images):
+        """Class probabilities for a float32 batch of shape (N, H, W, 3)"""
+        return self._forward(np.asarray(images, dtype=np.float32)).numpy()
+
+class TFLiteBackend:
+    def __init__(self, model_path, num_threads=None, name='tflite'):
+        try:
+            # The slim runtime is preferred on inference-only hosts
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.name = name
+        self.interpreter = Interpreter(model_path=str(model_path), num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_detail['shape'][0])
+
+    def _resize(self, batch_size):
+        """Resize the interpreter's input tensor when the batch size changes"""
+        if batch_size == self._batch_size:
+            return
+        shape = list(self.input_detail['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_detail['index'], shape)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, images):
+        """Class probabilities for a float32 batch, quantizing I/O if required"""
+        self._resize(len(images))
+
+        input_dtype = self.input_detail['dtype']
+        if input_dtype in (np.int8, np.uint8):
+            scale, zero_point = self.input_detail['quantization']
+            info = np.iinfo(input_dtype)
+            images = np.clip(np.round(images / scale + zero_point), info.min, info.max)
+        self.interpreter.set_tensor(self.input_detail['index'], images.astype(input_dtype))
+        self.interpreter.invoke()
+
+        outputs = self.interpreter.get_tensor(self.output_detail['index'])
+        if self.output_detail['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self.output_detail['quantization']
+            outputs = (outputs.astype(np.float32) - zero_point) * scale
+        return outputs
+
+class ONNXBackend:
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, images):
+        """Class probabilities for a float32 batch"""
+        return self.session.run(None, {self.input_name: images.astype(np.float32)})[0]
+
+def load_backend(name, model_path, num_threads=None, jit_compile=False):
+    """Instantiate the backend registered under name for model_path"""
+    if name == 'keras':
+        return KerasBackend(model_path, jit_compile=jit_compile)
+    if name in ('tflite-fp16', 'tflite-int8'):
+        return TFLiteBackend(model_path, num_threads=num_threads, name=name)
+    if name == 'onnx':
+        return ONNXBackend(model_path, num_threads=num_threads)
+    raise ValueError(f"Unknown backend '{name}'. Choose from: {', '.join(BACKEND_ARTIFACTS)}")
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Offline Batch Fracture Prediction
+Back-scores directories, globs or CSV manifests of X-rays with the same
+FracturePredictionService used online, streaming results to JSONL or Parquet
+"""
+
+import sys
+import glob
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pandas as pd
+from tqdm import tqdm
+
+from backends import BACKEND_ARTIFACTS
+from dicom_io import DICOM_EXTENSIONS, WINDOW_MODES, is_dicom
+from model_registry import DEFAULT_REGISTRY, ModelRegistry
+from predict_fracture import FracturePredictionService
+from preprocessing import allocate_batch
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'} | DICOM_EXTENSIONS
+
+def is_image_file(path):
+    """Image file by extension, or a DICOM file recognised by its preamble (often extensionless)"""
+    path = Path(path)
+    return path.is_file() and (path.suffix.lower() in IMAGE_EXTENSIONS or is_dicom(path))
+
+def collect_inputs(source, base_dir=None):
+    """Resolve a directory, glob pattern or CSV manifest to image paths"""
+    source_path = Path(source)
+
+    if source_path.suffix.lower() == '.csv':
+        df = pd.read_csv(source_path)
+        if 'image_path' not in df.columns:
+            raise ValueError(f"{source} has no image_path column")
+        # Manifest paths are relative to the CSV, like data/train.csv
+        root = Path(base_dir) if base_dir else source_path.parent
+        return [
+            str(path if path.is_absolute() else root / path)
+            for path in map(Path, df['image_path'].dropna().astype(str))
+        ]
+
+    if source_path.is_dir():
+        return sorted(str(path) for path in source_path.rglob('*') if is_image_file(path))
+
+    if any(char in source for char in '*?['):
+        return sorted(path for path in glob.glob(source, recursive=True) if is_image_file(path))
+
+    if source_path.is_file():
+        return [str(source_path)]
+
+    raise FileNotFoundError(f"No images found for {source}")
+
+class JSONLResultWriter:
+    """Appends one JSON result per line, flushing after every batch.
+
+    Resuming keeps successful rows and drops failed ones, so those inputs are
+    retried without leaving duplicate rows; otherwise the file starts empty.
+    """
+    def __init__(self, output_path, resume=True):
+        self.output_path = Path(output_path)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        if resume:
+            self._repair_partial_line()
+            self._drop_failed_rows()
+        self._file = open(self.output_path, 'a' if resume else 'w')
+
+    def _repair_partial_line(self):
+        """Drop a half-written final line left by an interrupted run"""
+        if not self.output_path.exists() or self.output_path.stat().st_size == 0:
+            return
+        with open(self.output_path, 'rb+') as f:
+            data = f.read()
+            if data.endswith(b'\n'):
+                return
+            f.truncate(data.rfind(b'\n') + 1)
+
+    @staticmethod
+    def _succeeded(line):
+        try:
+            return json.loads(line).get('success', False) is True
+        except (json.JSONDecodeError, AttributeError):
+            return False
+
+    def _drop_failed_rows(self):
+        """Rewrite the output without failed rows, atomically, if it has any"""
+        if not self.output_path.exists():
+            return
+        with open(self.output_path) as f:
+            lines = f.readlines()
+        kept = [line for line in lines if self._succeeded(line)]
+        if len(kept) == len(lines):
+            return
+        tmp_path = self.output_path.with_name(f".{self.output_path.name}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.writelines(kept)
+        tmp_path.replace(self.output_path)
+
+    def completed_inputs(self):
+        """Image paths already scored successfully"""
+        completed = set()
+        if not self.output_path.exists():
+            return completed
+        with open(self.output_path) as f:
+            for line in f:
+                if self._succeeded(line):
+                    completed.add(json.loads(line)['image_path'])
+        return completed
+
+    def write(self, rows):
+        for row in rows:
+            self._file.write(json.dumps(row) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ParquetResultWriter:
+    """Writes results as numbered Parquet part files inside a directory.
+
+    Each part is complete on disk once written, so an interrupted run never
+    leaves a file without its footer. Resuming rewrites parts that hold failed
+    rows without them, so those inputs are retried without duplicates;
+    otherwise existing parts are removed. Every part shares one explicit
+    schema, whichever optional fields its rows happen to carry.
+    """
+    def __init__(self, output_dir, class_names, rows_per_part=1024, resume=True):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.class_names = class_names
+        self.schema = self.result_schema(class_names)
+        self.rows_per_part = rows_per_part
+        self._pending = []
+        for part in self._parts():
+            if resume:
+                self._drop_failed_rows(part)
+            else:
+                part.unlink()
+        existing = [int(part.stem.split('-')[1]) for part in self._parts()]
+        self._next_part = max(existing, default=-1) + 1
+
+    @staticmethod
+    def result_schema(class_names):
+        """Columns of every part: fields absent from a row are written as nulls"""
+        import pyarrow as pa
+        return pa.schema([
+            ('image_path', pa.string()),
+            ('success', pa.bool_()),
+            ('error', pa.string()),
+            ('predicted_class', pa.string()),
+            ('confidence', pa.float64()),
+            ('model_version', pa.string()),
+            ('decided_by', pa.string()),
+            *((f"prob_{class_name}", pa.float64()) for class_name in class_names)
+        ])
+
+    def _write_part(self, rows, part_path):
+        """Write rows to part_path atomically, with the shared schema"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        tmp_path = part_path.with_suffix('.parquet.tmp')
+        pq.write_table(pa.Table.from_pylist(rows, schema=self.schema), tmp_path)
+        tmp_path.replace(part_path)
+
+    def _parts(self):
+        return sorted(self.output_dir.glob('part-*.parquet'))
+
+    def _drop_failed_rows(self, part):
+        """Rewrite a part without its failed rows, or remove it if none succeeded"""
+        df = pd.read_parquet(part)
+        succeeded = df['success'].fillna(False).astype(bool)
+        if succeeded.all():
+            return
+        if not succeeded.any():
+            part.unlink()
+            return
+        kept = df[succeeded]
+        self._write_part(kept.astype(object).where(kept.notna(), None).to_dict('records'), part)
+
+    def completed_inputs(self):
+        """Image paths already scored successfully"""
+        completed = set()
+        for part in self._parts():
+            df = pd.read_parquet(part, columns=['image_path', 'success'])
+            completed.update(df.loc[df['success'].fillna(False).astype(bool), 'image_path'])
+        return completed
+
+    def _flatten(self, row):
+        """Spread class probabilities into one column per class"""
+        flat = {key: value for key, value in row.items() if key != 'probabilities'}
+        probabilities = row.get('probabilities') or {}
+        for class_name in self.class_names:
+            flat[f"prob_{class_name}"] = probabilities.get(class_name)
+        return flat
+
+    def write(self, rows):
+        self._pending.extend(self._flatten(row) for row in rows)
+        if len(self._pending) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self._write_part(self._pending, self.output_dir / f"part-{self._next_part:05d}.parquet")
+        self._next_part += 1
+        self._pending = []
+
+    def close(self):
+        self._flush()
+
+class BatchPredictor:
+    def __init__(self, predictor, batch_size=64, preprocess_workers=4, prefetch_batches=2):
+        self.predictor = predictor
+        self.batch_size = batch_size
+        self.preprocess_workers = preprocess_workers
+        self.prefetch_batches = max(1, prefetch_batches)
+
+    def _load(self, image_path, out):
+        """Preprocess one image into its batch slot, capturing failures instead of raising"""
+        try:
+            self.predictor.preprocess_image(image_path, out=out)
+            return None
+        except Exception as e:
+            return str(e)
+
+    def _score(self, image_paths, buffer, errors):
+        """Run one forward pass over the successfully preprocessed images"""
+        ok = [i for i, error in enumerate(errors) if error is None]
+        if len(ok) == len(image_paths):
+            images = buffer[:len(image_paths)]
+        else:
+            images = buffer[ok]
+        outputs = self.predictor.run_batch(images) if ok else []
+        by_index = dict(zip(ok, outputs))
+
+        rows = []
+        for i, image_path in enumerate(image_paths):
+            if i in by_index:
+                probabilities, stage = by_index[i]
+                result = self.predictor.build_result(probabilities, image_path, stage)
+                rows.append({'image_path': image_path, 'success': True, **result})
+            else:
+                rows.append({'image_path': image_path, 'success': False, 'error': errors[i]})
+        return rows
+
+    def run(self, image_paths, writer):
+        """Score image_paths, streaming each finished batch to writer"""
+        batches = [
+            image_paths[start:start + self.batch_size]
+            for start in range(0, len(image_paths), self.batch_size)
+        ]
+        failures = 0
+
+        # One buffer per batch being preprocessed ahead, plus the one in the model
+        free_buffers = deque(
+            allocate_batch(self.batch_size, self.predictor.img_size)
+            for _ in range(self.prefetch_batches + 1)
+        )
+
+        with ThreadPoolExecutor(max_workers=self.preprocess_workers) as pool, \
+                tqdm(total=len(image_paths), desc="Scoring images") as progress:
+            # Keep a few batches preprocessing ahead of the model
+            in_flight = deque()
+            batch_iter = iter(batches)
+
+            def schedule():
+                batch = next(batch_iter, None)
+                if batch is not None:
+                    buffer = free_buffers.popleft()
+                    futures = [pool.submit(self._load, path, buffer[i]) for i, path in enumerate(batch)]
+                    in_flight.append((batch, buffer, futures))
+
+            for _ in range(self.prefetch_batches):
+                schedule()
+
+            while in_flight:
+                batch, buffer, futures = in_flight.popleft()
+                schedule()
+                rows = self._score(batch, buffer, [future.result() for future in futures])
+                free_buffers.append(buffer)
+                writer.write(rows)
+                failures += sum(1 for row in rows if not row['success'])
+                progress.update(len(batch))
+
+        return failures
+
+def parse_args(argv=None):
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Batch fracture prediction over image archives')
+    parser.add_argument('source', help='Image directory, glob pattern or CSV with an image_path column')
+    parser.add_argument('output', help='JSONL file, or a directory of part files for --format parquet')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl',
+                        help='Output format')
+    parser.add_argument('--backend', choices=list(BACKEND_ARTIFACTS), default='keras',
+                        help='Model format to load (see export_models.py)')
+    parser.add_argument('--model-path', help='Model artifact to load instead of the backend default')
+    parser.add_argument('--registry', default=str(DEFAULT_REGISTRY),
+                        help="Model registry; its active version is used when --model-path is not given")
+    parser.add_argument('--cascade', action='store_true',
+                        help='Let the screening model answer confident Normal cases (see train_with_real_data.py)')
+    parser.add_argument('--cascade-threshold', type=float,
+                        help='P(abnormal) below which the screening model decides (default: tuned value)')
+    parser.add_argument('--dicom-window', choices=WINDOW_MODES, default='auto',
+                        help="DICOM intensity windowing: the file's VOI window, percentiles or min/max")
+    parser.add_argument('--base-dir', help='Directory CSV image paths are relative to (default: the CSV folder)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Images per forward pass')
+    parser.add_argument('--workers', type=int, default=4, help='Parallel preprocessing threads')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Score every input, replacing any existing output')
+    return parser.parse_args(argv)
+
+def main():
+    """Main function for command-line usage"""
+    args = parse_args()
+
+    image_paths = collect_inputs(args.source, args.base_dir)
+    print(f"Found {len(image_paths)} images", file=sys.stderr)
+
+    predictor = FracturePredictionService(model_path=args.model_path, backend=args.backend,
+                                          dicom_window=args.dicom_window,
+                                          registry=ModelRegistry(args.registry))
+    if args.cascade:
+        predictor.enable_cascade(args.cascade_threshold)
+
+    if args.format == 'parquet':
+        writer = ParquetResultWriter(args.output, predictor.class_names, resume=not args.no_resume)
+    else:
+        writer = JSONLResultWriter(args.output, resume=not args.no_resume)
+
+    if not args.no_resume:
+        completed = writer.completed_inputs()
+        if completed:
+            image_paths = [path for path in image_paths if path not in completed]
+            print(f"Resuming: skipping {len(completed)} already scored images", file=sys.stderr)
+
+    try:
+        failures = BatchPredictor(
+            predictor,
+            batch_size=args.batch_size,
+            preprocess_workers=args.workers
+        ).run(image_paths, writer)
+    finally:
+        writer.close()
+
+    print(f"✓ Scored {len(image_paths)} images ({failures} failed) -> {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Dynamic Micro-Batching Scheduler
+Groups concurrent single-image requests into one model forward pass
+"""
+
+import time
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+import numpy as np
+
+_STOP = object()
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10.0, max_queue_size=0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        # A bounded queue (max_queue_size > 0) blocks submitters while the model is behind
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._metrics_lock = threading.Lock()
+        self.batch_size_counts = Counter()
+        self.total_batches = 0
+        self.total_requests = 0
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """Queue one preprocessed image and return a Future for its model output.
+
+        Blocks while a bounded queue is full. The finished Future carries a
+        ``timings`` dict with the request's queue_wait and model times in ms.
+        """
+        if self.closed:
+            raise RuntimeError("Batcher is closed")
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        """Finish queued work and stop the scheduler thread"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first):
+        """Gather requests until the batch is full or the wait window closes"""
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Drain anything already waiting even when the window has closed
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+
+        return batch, stop
+
+    def _run(self):
+        """Scheduler loop: one forward pass per collected batch"""
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            batch, stop = self._collect(first)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        """Run the model on a batch and hand each caller its own row"""
+        started = time.perf_counter()
+        images, futures = [], []
+        for image, future, enqueued in batch:
+            # Skip requests whose callers cancelled while queued
+            if future.set_running_or_notify_cancel():
+                future.timings = {'queue_wait': (started - enqueued) * 1000}
+                images.append(image)
+                futures.append(future)
+        if not futures:
+            return
+
+        try:
+            outputs = self.predict_fn(np.stack(images))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        model_ms = (time.perf_counter() - started) * 1000
+        for future, output in zip(futures, outputs):
+            future.timings['model'] = model_ms
+            future.set_result(output)
+
+        with self._metrics_lock:
+            self.total_batches += 1
+            self.total_requests += len(futures)
+            self.batch_size_counts[len(futures)] += 1
+
+    def get_metrics(self):
+        """Batching configuration and observed batch sizes"""
+        with self._metrics_lock:
+            mean_batch_size = self.total_requests / self.total_batches if self.total_batches else 0.0
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batches': self.total_batches,
+                'requests': self.total_requests,
+                'mean_batch_size': mean_batch_size,
+                'queue_depth': self._queue.qsize(),
+                'batch_size_histogram': {
+                    str(size): count for size, count in sorted(self.batch_size_counts.items())
+                }
+            }
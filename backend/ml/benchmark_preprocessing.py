@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Preprocessing Benchmark
+Compares the original per-call colour pipeline with the shared grayscale fast
+path and checks that both produce bit-identical model inputs
+"""
+
+import glob
+import time
+import argparse
+import numpy as np
+import cv2
+
+from preprocessing import IMG_SIZE, decode_image, preprocess_batch, allocate_batch
+
+def legacy_preprocess(data, img_size=IMG_SIZE):
+    """The pipeline previously duplicated across the prediction and training scripts"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, img_size)
+    lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    lab[:,:,0] = clahe.apply(lab[:,:,0])
+    img = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+    return img.astype(np.float32) / 255.0
+
+def synthetic_xrays(count, size, seed=42):
+    """Smooth grayscale noise encoded as PNG, standing in for detector images"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        noise = rng.integers(0, 256, (size, size), dtype=np.uint8)
+        img = cv2.GaussianBlur(noise, (0, 0), 3)
+        img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX)
+        images.append(cv2.imencode('.png', img)[1].tobytes())
+    return images
+
+def time_call(fn, repeats):
+    """Best wall time over repeats, in seconds"""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark X-ray preprocessing')
+    parser.add_argument('--images', help='Glob of real images to use instead of synthetic ones')
+    parser.add_argument('--count', type=int, default=64, help='Synthetic images to generate')
+    parser.add_argument('--size', type=int, default=1024, help='Synthetic image side length')
+    parser.add_argument('--repeats', type=int, default=5, help='Timing repeats (best is reported)')
+    args = parser.parse_args()
+
+    if args.images:
+        encoded = [open(path, 'rb').read() for path in sorted(glob.glob(args.images, recursive=True))]
+    else:
+        encoded = synthetic_xrays(args.count, args.size)
+    if not encoded:
+        print("❌ No images to benchmark")
+        return
+
+    print(f"=== Preprocessing Benchmark ({len(encoded)} images) ===")
+
+    # Bit-identical output check
+    reference = np.stack([legacy_preprocess(data) for data in encoded])
+    shared = preprocess_batch([decode_image(data) for data in encoded])
+    if not np.array_equal(reference, shared):
+        mismatched = int(np.sum(np.any(reference != shared, axis=(1, 2, 3))))
+        print(f"❌ Output differs from the reference pipeline for {mismatched} images")
+        return
+    print("✓ Output is bit-identical to the reference pipeline")
+
+    buffer = allocate_batch(len(encoded))
+    legacy_time = time_call(lambda: np.stack([legacy_preprocess(data) for data in encoded]), args.repeats)
+    shared_time = time_call(
+        lambda: preprocess_batch([decode_image(data) for data in encoded], out=buffer), args.repeats
+    )
+
+    # Preprocessing alone, with decoding excluded, isolates the CLAHE path
+    decoded_color = [cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) for data in encoded]
+    decoded_native = [decode_image(data) for data in encoded]
+
+    def legacy_transform():
+        for img in decoded_color:
+            rgb = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), IMG_SIZE)
+            lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
+            lab[:,:,0] = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8)).apply(lab[:,:,0])
+            cv2.cvtColor(lab, cv2.COLOR_LAB2RGB).astype(np.float32) / 255.0
+
+    legacy_transform_time = time_call(legacy_transform, args.repeats)
+    shared_transform_time = time_call(lambda: preprocess_batch(decoded_native, out=buffer), args.repeats)
+
+    print(f"\n{'Stage':<28}{'Reference ms/img':>18}{'Shared ms/img':>16}{'Speedup':>10}")
+    for stage, before, after in [
+        ('decode + preprocess', legacy_time, shared_time),
+        ('preprocess only', legacy_transform_time, shared_transform_time),
+    ]:
+        print(f"{stage:<28}{before / len(encoded) * 1000:>18.3f}"
+              f"{after / len(encoded) * 1000:>16.3f}{before / after:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
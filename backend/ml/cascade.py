@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Two-Stage Screening Cascade
+A small CNN scores P(abnormal) for every image; confident Normal cases are
+answered by it alone and everything else escalates to the full EfficientNetB3
+model. The threshold is tuned on the validation split for a target sensitivity.
+"""
+
+import json
+from pathlib import Path
+import numpy as np
+
+SCREENING_ARTIFACT = 'fracture_screening_model.h5'
+CASCADE_CONFIG = 'cascade.json'
+DEFAULT_TARGET_SENSITIVITY = 0.99
+NORMAL_CLASS = 'Normal'
+
+def create_screening_model(img_size=(224, 224)):
+    """Tiny strided CNN scoring P(abnormal); a few percent of EfficientNetB3's cost"""
+    from tensorflow import keras
+    from tensorflow.keras import layers
+
+    inputs = keras.Input(shape=(*img_size, 3))
+    x = inputs
+    for filters in (16, 32, 64, 96):
+        x = layers.Conv2D(filters, 3, strides=2, padding='same', use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.ReLU()(x)
+    x = layers.SeparableConv2D(128, 3, padding='same', activation='relu')(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x)
+    outputs = layers.Dense(1, activation='sigmoid', name='p_abnormal')(x)
+    return keras.Model(inputs, outputs, name='fracture_screening')
+
+def tune_threshold(p_abnormal, is_abnormal, target_sensitivity=DEFAULT_TARGET_SENSITIVITY):
+    """Highest P(abnormal) threshold that still escalates target_sensitivity of abnormal cases.
+
+    Images scoring below the threshold are answered as Normal by the
+    screening model. Returns the threshold with the validation statistics
+    it implies.
+    """
+    p_abnormal = np.asarray(p_abnormal, dtype=np.float64).ravel()
+    is_abnormal = np.asarray(is_abnormal, dtype=bool).ravel()
+    abnormal_scores = np.sort(p_abnormal[is_abnormal])
+    if abnormal_scores.size == 0:
+        raise ValueError("Validation split has no abnormal cases to tune the cascade on")
+
+    # Abnormal cases allowed to fall below the threshold (be screened out)
+    allowed_misses = int(np.floor((1.0 - target_sensitivity) * abnormal_scores.size + 1e-9))
+    threshold = float(abnormal_scores[allowed_misses])
+
+    escalated = p_abnormal >= threshold
+    normal = ~is_abnormal
+    return {
+        'threshold': threshold,
+        'target_sensitivity': target_sensitivity,
+        'sensitivity': float(np.mean(escalated[is_abnormal])),
+        'normal_screened_out': float(np.mean(~escalated[normal])) if normal.any() else 0.0,
+        'escalation_rate': float(np.mean(escalated)),
+        'validation_samples': int(p_abnormal.size)
+    }
+
+def save_cascade_config(models_dir, tuning):
+    """Write the tuned threshold next to the screening model"""
+    path = Path(models_dir) / CASCADE_CONFIG
+    with open(path, 'w') as f:
+        json.dump(tuning, f, indent=2)
+    return path
+
+def load_cascade_config(models_dir):
+    """Tuned cascade settings saved by training, or None"""
+    try:
+        with open(Path(models_dir) / CASCADE_CONFIG) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def screening_probabilities(p_abnormal, class_names):
+    """Class probabilities for an image the screening model decided.
+
+    The screening model only separates Normal from abnormal, so the abnormal
+    mass is spread evenly over the other classes.
+    """
+    others = len(class_names) - 1
+    return np.array([
+        1.0 - p_abnormal if name == NORMAL_CLASS else p_abnormal / others
+        for name in class_names
+    ], dtype=np.float32)
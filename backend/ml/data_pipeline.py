@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+tf.data Training Input Pipeline
+Replaces ImageDataGenerator.flow_from_dataframe: images are decoded, resized
+and CLAHE-enhanced in parallel (OpenCV releases the GIL inside
+tf.numpy_function), kept as uint8 so cache() stays compact, and augmented per
+batch with tensor ops before being prefetched
+
+Decoded images go through the same shared preprocessing as serving, so the
+model trains on the [0, 1] CLAHE input it will see at prediction time.
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+from preprocessing import enhance_xray, read_image
+
+AUTOTUNE = tf.data.AUTOTUNE
+SHUFFLE_BUFFER = 1024
+# Upper bound for endless epoch streams
+MAX_EPOCHS = 1 << 31
+
+# Augmentation strengths; mirror the ImageDataGenerator settings they replace
+MEDICAL_AUGMENTATION = {
+    'rotation_degrees': 10,
+    'shift': 0.05,
+    'zoom': 0.05,
+    'brightness': 0.1,
+    'horizontal_flip': True
+}
+
+def image_paths(df, data_dir=None, x_col='image_path'):
+    """Image paths of a manifest, resolved against data_dir when given"""
+    if data_dir is None:
+        return df[x_col].astype(str).tolist()
+    return [str(data_dir / image_path) for image_path in df[x_col]]
+
+def class_indices(df, classes, y_col='class'):
+    """Integer labels of a manifest in the order of classes"""
+    lookup = {name: index for index, name in enumerate(classes)}
+    labels = df[y_col].map(lookup)
+    if labels.isna().any():
+        unknown = sorted(set(df[y_col][labels.isna()].astype(str)))
+        raise ValueError(f"Unknown labels in '{y_col}': {', '.join(unknown)} (expected {', '.join(classes)})")
+    return labels.to_numpy(dtype=np.int32)
+
+def load_image(path, img_size, clahe=True):
+    """Deterministic part of training preprocessing: (H, W, 3) uint8 RGB"""
+    import cv2
+
+    img = read_image(path)
+    if clahe:
+        return enhance_xray(img, tuple(img_size))
+    img = cv2.resize(img, tuple(img_size))
+    if img.ndim == 2:
+        return np.repeat(img[:, :, np.newaxis], 3, axis=2)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+def _loader(img_size, clahe):
+    """numpy function: path bytes -> (H, W, 3) uint8 RGB"""
+    def load(path):
+        return load_image(path.decode(), img_size, clahe)
+    return load
+
+def steps_per_epoch(count, batch_size):
+    """Batches in one epoch of count samples"""
+    return -(-count // batch_size)
+
+def epoch_batches(count, batch_size, seed=42, start_epoch=0):
+    """Endless dataset of row-index batches from start_epoch on.
+
+    Each epoch is a permutation seeded by (seed, epoch) alone, so a resumed
+    run sees exactly the order an uninterrupted one would have. Batches never
+    span two epochs.
+    """
+    def epoch_rows(epoch):
+        order = tf.random.experimental.stateless_shuffle(
+            tf.range(count, dtype=tf.int64), seed=tf.stack([tf.constant(seed, tf.int64), epoch]))
+        return tf.data.Dataset.from_tensor_slices(order).batch(batch_size)
+    return tf.data.Dataset.range(start_epoch, MAX_EPOCHS).flat_map(epoch_rows)
+
+def augmentation_layers(rotation_degrees=10, shift=0.05, zoom=0.05, horizontal_flip=True, seed=42, **_):
+    """Geometric augmentation applied to whole batches"""
+    stages = []
+    if horizontal_flip:
+        stages.append(layers.RandomFlip('horizontal', seed=seed))
+    if rotation_degrees:
+        stages.append(layers.RandomRotation(rotation_degrees / 360.0, fill_mode='reflect', seed=seed))
+    if shift:
+        stages.append(layers.RandomTranslation(shift, shift, fill_mode='reflect', seed=seed))
+    if zoom:
+        stages.append(layers.RandomZoom(zoom, fill_mode='reflect', seed=seed))
+    return keras.Sequential(stages, name='batch_augmentation')
+
+def make_dataset(df, classes, img_size=(224, 224), data_dir=None, x_col='image_path', y_col='class',
+                 label_mode='categorical', batch_size=32, training=False, augmentation=None,
+                 clahe=True, scale=1.0 / 255.0, cache=None, store=None, start_epoch=None, seed=42):
+    """Batched (images, labels) dataset for a DataFrame manifest.
+
+    label_mode is 'categorical' (one-hot over classes) or 'binary' (index of
+    the second class as a float). Images are float32 RGB multiplied by scale.
+    training shuffles every epoch and applies augmentation (a dict like
+    MEDICAL_AUGMENTATION) to each batch. cache is None, 'memory' or a file
+    prefix; the decoded, enhanced uint8 images are cached, so only
+    augmentation runs again in later epochs. store is an ImageStore
+    (image_store.py) holding the preprocessed images; batches are then read
+    from its memory map and nothing is decoded. start_epoch makes an endless
+    stream of epochs (see epoch_batches) for resumable training; fit it with
+    steps_per_epoch(len(df), batch_size).
+    """
+    paths = image_paths(df, data_dir, x_col)
+    labels = class_indices(df, classes, y_col)
+    if label_mode == 'categorical':
+        targets = np.eye(len(classes), dtype=np.float32)[labels]
+    elif label_mode == 'binary':
+        targets = labels.astype(np.float32)
+    else:
+        raise ValueError(f"Unknown label_mode '{label_mode}'")
+
+    shape = (img_size[1], img_size[0], 3)
+    if start_epoch is not None:
+        if cache is not None:
+            raise ValueError("cache cannot be combined with start_epoch; use an image store instead")
+        if store is not None:
+            store.check(img_size, clahe)
+            rows = store.rows(paths)
+            read = lambda indices: store.gather(rows[indices])
+        else:
+            load = _loader(img_size, clahe)
+            encoded = np.array([path.encode() for path in paths], dtype=object)
+            read = lambda indices: np.stack([load(path) for path in encoded[indices]])
+        target_table = tf.constant(targets)
+
+        def read_batch(indices):
+            images = tf.numpy_function(read, [indices], tf.uint8)
+            images.set_shape((None, *shape))
+            return images, tf.gather(target_table, indices)
+
+        ds = epoch_batches(len(paths), batch_size, seed, start_epoch).map(read_batch, num_parallel_calls=AUTOTUNE)
+    elif store is not None:
+        store.check(img_size, clahe)
+
+        def gather(rows, targets):
+            images = tf.numpy_function(store.gather, [rows], tf.uint8)
+            images.set_shape((None, *shape))
+            return images, targets
+
+        ds = tf.data.Dataset.from_tensor_slices((store.rows(paths), targets))
+        if training:
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size).map(gather, num_parallel_calls=AUTOTUNE)
+    else:
+        load = _loader(img_size, clahe)
+
+        def decode(path, target):
+            image = tf.numpy_function(load, [path], tf.uint8)
+            image.set_shape(shape)
+            return image, target
+
+        ds = tf.data.Dataset.from_tensor_slices((paths, targets))
+        if training and cache is None:
+            # Shuffling names is free; decoded images are shuffled only when cached
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.map(decode, num_parallel_calls=AUTOTUNE)
+        if cache is not None:
+            ds = ds.cache() if cache == 'memory' else ds.cache(str(cache))
+            if training:
+                ds = ds.shuffle(min(len(paths), SHUFFLE_BUFFER), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size)
+
+    augment = None
+    brightness = 0.0
+    if training and augmentation:
+        augment = augmentation_layers(seed=seed, **augmentation)
+        brightness = augmentation.get('brightness', 0.0)
+
+    def to_model_input(images, targets):
+        images = tf.cast(images, tf.float32) * scale
+        if augment is not None:
+            images = augment(images, training=True)
+        if brightness:
+            # Per-image multiplicative brightness, as ImageDataGenerator's brightness_range
+            factors = tf.random.uniform((tf.shape(images)[0], 1, 1, 1), 1.0 - brightness, 1.0 + brightness)
+            images = tf.clip_by_value(images * factors, 0.0, 255.0 * scale)
+        return images, targets
+
+    ds = ds.map(to_model_input, num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
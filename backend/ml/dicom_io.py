@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+DICOM Input
+Reads DICOM files or bytes straight into the 8-bit grayscale array the shared
+preprocessing expects, without a lossy JPEG round trip
+
+The header is parsed first without pixel data, so studies of an unsupported
+modality are rejected before anything is decoded. Very large detector images
+can be strided down: uncompressed pixel data is then sampled straight from
+the file's bytes without building the full-resolution array, while
+compressed data is decoded in full and strided afterwards. The rescale,
+window and MONOCHROME1 inversion are folded into a single lookup table for
+integer data.
+"""
+
+import io
+from pathlib import Path
+import numpy as np
+
+DICOM_EXTENSIONS = {'.dcm', '.dicom'}
+# Extensions that are never DICOM, so their files are not opened to check
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff'}
+# Computed, digital and general radiography, plus the CT slices of the RSNA training set
+SUPPORTED_MODALITIES = ('CR', 'DX', 'RG', 'CT')
+DICOM_MAGIC = b'DICM'
+DICOM_MAGIC_OFFSET = 128
+WINDOW_MODES = ('auto', 'voi', 'percentile', 'minmax')
+PERCENTILE_RANGE = (0.5, 99.5)
+# Sample at most about this many pixels when estimating percentiles
+PERCENTILE_SAMPLES = 1 << 18
+
+def _has_magic(preamble):
+    return bytes(preamble[DICOM_MAGIC_OFFSET:DICOM_MAGIC_OFFSET + len(DICOM_MAGIC)]) == DICOM_MAGIC
+
+def is_dicom(image):
+    """True for DICOM bytes or files (DICM preamble) or a path with a DICOM extension.
+
+    PACS exports often have no extension (or a numeric one), so a path
+    without a DICOM or image extension is recognised by reading its preamble.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return _has_magic(image)
+    suffix = Path(image).suffix.lower()
+    if suffix in DICOM_EXTENSIONS:
+        return True
+    if suffix in IMAGE_EXTENSIONS:
+        return False
+    try:
+        with open(image, 'rb') as f:
+            return _has_magic(f.read(DICOM_MAGIC_OFFSET + len(DICOM_MAGIC)))
+    except OSError:
+        return False
+
+def _open(source):
+    """File object for a DICOM path or in-memory buffer"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return open(source, 'rb')
+
+def _first(value):
+    """First value of a possibly multi-valued DICOM element"""
+    try:
+        return float(value[0])
+    except TypeError:
+        return float(value)
+
+def validate_header(header, modalities=SUPPORTED_MODALITIES):
+    """Reject studies that are not single-frame grayscale images of a supported modality"""
+    modality = getattr(header, 'Modality', None)
+    if modalities and modality and modality not in modalities:
+        raise ValueError(f"Unsupported DICOM modality '{modality}' (expected {', '.join(modalities)})")
+    photometric = getattr(header, 'PhotometricInterpretation', 'MONOCHROME2')
+    if photometric not in ('MONOCHROME1', 'MONOCHROME2'):
+        raise ValueError(f"Unsupported DICOM photometric interpretation '{photometric}'")
+    if int(getattr(header, 'NumberOfFrames', 1) or 1) > 1:
+        raise ValueError("Multi-frame DICOM is not supported")
+
+def read_dicom_header(source, modalities=SUPPORTED_MODALITIES):
+    """Parse and validate the DICOM header only, leaving pixel data unread"""
+    import pydicom
+
+    with _open(source) as f:
+        header = pydicom.dcmread(f, stop_before_pixels=True)
+    validate_header(header, modalities)
+    return header
+
+def stride_for(shape, max_size):
+    """Integer decimation that keeps the short side at least max_size"""
+    if not max_size:
+        return 1
+    return max(1, min(shape[:2]) // max_size)
+
+def _native_pixels(ds, stride):
+    """Strided copy of uncompressed single-frame pixel data, or None if it must be decoded.
+
+    Reads only every stride-th row and column of the raw PixelData bytes, with
+    the same masking / sign extension of BitsStored that pydicom applies.
+    """
+    transfer_syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    # Retired big-endian syntaxes swap 8-bit data in 16-bit words; leave them to pydicom
+    if (transfer_syntax is None or transfer_syntax.is_compressed or not transfer_syntax.is_little_endian
+            or 'PixelData' not in ds):
+        return None
+    bits_allocated = int(getattr(ds, 'BitsAllocated', 0))
+    if bits_allocated not in (8, 16, 32) or int(getattr(ds, 'SamplesPerPixel', 1)) != 1:
+        return None
+    rows, columns = int(ds.Rows), int(ds.Columns)
+    signed = int(getattr(ds, 'PixelRepresentation', 0)) == 1
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits_allocated // 8}")
+    data = ds.PixelData
+    if len(data) < rows * columns * dtype.itemsize:
+        return None
+
+    pixels = np.frombuffer(data, dtype=dtype, count=rows * columns).reshape(rows, columns)
+    pixels = pixels[::stride, ::stride].astype(dtype.newbyteorder('='))
+    shift = bits_allocated - int(getattr(ds, 'BitsStored', bits_allocated))
+    if shift > 0:
+        # Drops unused high bits; the arithmetic right shift sign-extends signed data
+        pixels = (pixels << shift) >> shift
+    return pixels
+
+def _window_bounds(ds, pixels, mode, slope, intercept):
+    """Output-space (low, high) bounds mapped to 0 and 255"""
+    center = getattr(ds, 'WindowCenter', None)
+    width = getattr(ds, 'WindowWidth', None)
+    if mode in ('auto', 'voi') and center is not None and width is not None:
+        center, width = _first(center), max(_first(width), 1.0)
+        return center - width / 2.0, center + width / 2.0
+    if mode == 'voi':
+        raise ValueError("DICOM has no WindowCenter/WindowWidth for VOI windowing")
+
+    if mode == 'minmax':
+        low, high = float(pixels.min()), float(pixels.max())
+    else:
+        # A strided sample is plenty for the percentiles of a smooth radiograph
+        step = max(1, int(np.sqrt(pixels.size / PERCENTILE_SAMPLES)))
+        low, high = np.percentile(pixels[::step, ::step], PERCENTILE_RANGE)
+    low, high = low * slope + intercept, high * slope + intercept
+    return (min(low, high), max(low, high))
+
+def _apply_window(pixels, low, high, slope, intercept, invert):
+    """Rescale, window and (for MONOCHROME1) invert to uint8 in one pass"""
+    scale = 255.0 / max(high - low, 1e-6)
+    if pixels.dtype.kind in 'iu' and pixels.dtype.itemsize <= 2:
+        # Every stored value maps through one table: a single gather per pixel
+        start = int(pixels.min())
+        values = np.arange(start, int(pixels.max()) + 1, dtype=np.float32) * slope + intercept
+        lut = np.clip((values - low) * scale, 0, 255).astype(np.uint8)
+        if invert:
+            lut = 255 - lut
+        if start:
+            return lut[pixels.astype(np.int32) - start]
+        return lut[pixels]
+
+    values = pixels.astype(np.float32) * slope + intercept
+    out = np.clip((values - low) * scale, 0, 255).astype(np.uint8)
+    return 255 - out if invert else out
+
+def read_dicom(source, window='auto', max_size=None, modalities=SUPPORTED_MODALITIES):
+    """Decode a DICOM path or buffer to a windowed 2-D uint8 image.
+
+    window is 'auto' (the file's VOI window, else percentiles), 'voi',
+    'percentile' or 'minmax'. With max_size the pixels are decimated by an
+    integer stride, keeping the short side >= max_size; uncompressed data is
+    sampled without a full-resolution decode, compressed data is decoded first.
+    """
+    import pydicom
+
+    if window not in WINDOW_MODES:
+        raise ValueError(f"Unknown window mode '{window}'. Choose from: {', '.join(WINDOW_MODES)}")
+
+    with _open(source) as f:
+        # Cheap header pass first: bail out before decoding the wrong study
+        validate_header(pydicom.dcmread(f, stop_before_pixels=True), modalities)
+        f.seek(0)
+        ds = pydicom.dcmread(f)
+
+    stride = stride_for((int(ds.Rows), int(ds.Columns)), max_size)
+    pixels = _native_pixels(ds, stride) if stride > 1 else None
+    if pixels is None:
+        pixels = ds.pixel_array
+        if pixels.ndim != 2:
+            raise ValueError(f"Expected a single grayscale frame, got pixel array of shape {pixels.shape}")
+        stride = stride_for(pixels.shape, max_size)
+        if stride > 1:
+            pixels = pixels[::stride, ::stride]
+
+    slope = float(getattr(ds, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(ds, 'RescaleIntercept', 0) or 0)
+    low, high = _window_bounds(ds, pixels, window, slope, intercept)
+    invert = getattr(ds, 'PhotometricInterpretation', 'MONOCHROME2') == 'MONOCHROME1'
+    return np.ascontiguousarray(_apply_window(pixels, low, high, slope, intercept, invert))
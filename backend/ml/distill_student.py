@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Knowledge Distillation into a Latency-Targeted Student
+Trains a small MobileNet/EfficientNetB0 student on the trained EfficientNetB3
+teacher's soft targets, then compares accuracy and CPU latency on the held-out
+split
+
+The teacher scores every training and validation image once; its
+probabilities are cached on disk keyed by the teacher's checksum, so repeated
+student runs never execute the teacher again. The student accepts the same
+224x224 input as the teacher and resizes internally, so every serving path and
+export works with it unchanged.
+"""
+
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+from backends import BACKEND_ARTIFACTS, KerasBackend
+from export_models import ModelExporter
+from model_registry import ModelRegistry, file_checksum
+from predict_fracture import FracturePredictionService, read_model_version
+from train_with_real_data import EnhancedFractureModel, split_dataset
+
+MODELS_DIR = Path(__file__).parent / 'models'
+STUDENT_ARTIFACT = 'fracture_student_model.h5'
+SOFT_TARGETS_FILE = 'teacher_soft_targets.npz'
+
+# Backbone constructor and the affine map from [0, 1] service input to what it expects
+STUDENT_ARCHITECTURES = {
+    'mobilenetv3-small': (keras.applications.MobileNetV3Small, 255.0, 0.0),
+    'mobilenetv3-large': (keras.applications.MobileNetV3Large, 255.0, 0.0),
+    'mobilenetv2': (keras.applications.MobileNetV2, 2.0, -1.0),
+    'efficientnetb0': (keras.applications.EfficientNetB0, 255.0, 0.0),
+}
+
+def distillation_loss(num_classes, temperature=4.0, alpha=0.9):
+    """KL to the teacher's softened distribution plus cross-entropy to the label.
+
+    y_true packs [one-hot label | teacher probabilities]. The student emits
+    probabilities like the teacher, so log-probabilities stand in for logits
+    when softening; the T^2 factor keeps soft-target gradients on the same
+    scale as the hard term.
+    """
+    def loss(y_true, y_pred):
+        hard, teacher = y_true[:, :num_classes], y_true[:, num_classes:]
+        student_log = tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0))
+        teacher_log = tf.math.log(tf.clip_by_value(teacher, 1e-7, 1.0))
+        soft_teacher = tf.nn.softmax(teacher_log / temperature)
+        soft_student_log = tf.nn.log_softmax(student_log / temperature)
+        soft = tf.reduce_sum(
+            soft_teacher * (tf.math.log(tf.clip_by_value(soft_teacher, 1e-7, 1.0)) - soft_student_log), axis=-1
+        )
+        hard_loss = keras.losses.categorical_crossentropy(hard, y_pred)
+        return alpha * temperature ** 2 * soft + (1.0 - alpha) * hard_loss
+    return loss
+
+def hard_accuracy(num_classes):
+    """Accuracy against the one-hot half of the packed targets"""
+    def accuracy(y_true, y_pred):
+        return keras.metrics.categorical_accuracy(y_true[:, :num_classes], y_pred)
+    return accuracy
+
+class DistillationSequence(keras.utils.Sequence):
+    """Batches of preprocessed images with packed [label | teacher] targets"""
+    def __init__(self, predictor, paths, targets, batch_size=32, shuffle=False, flip=False, seed=42):
+        super().__init__()
+        self.predictor = predictor
+        self.paths = list(paths)
+        self.targets = targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.flip = flip
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(self.paths))
+        if shuffle:
+            self.rng.shuffle(self.order)
+
+    def __len__(self):
+        return (len(self.paths) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, index):
+        rows = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        images = np.empty((len(rows), *self.predictor.img_size, 3), dtype=np.float32)
+        for slot, row in enumerate(rows):
+            self.predictor.preprocess_image(self.paths[row], out=images[slot])
+        if self.flip:
+            # Left/right flips preserve the label and, near enough, the teacher's output
+            flipped = self.rng.random(len(rows)) < 0.5
+            images[flipped] = images[flipped, :, ::-1]
+        return images, self.targets[rows]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+class StudentDistiller:
+    def __init__(self, teacher, data_dir='data', models_dir=MODELS_DIR,
+                 architecture='mobilenetv3-small', input_size=160):
+        if architecture not in STUDENT_ARCHITECTURES:
+            raise ValueError(f"Unknown student '{architecture}'. "
+                             f"Choose from: {', '.join(STUDENT_ARCHITECTURES)}")
+        self.teacher = teacher
+        self.data_dir = Path(data_dir)
+        self.models_dir = Path(models_dir)
+        self.architecture = architecture
+        self.student_size = (input_size, input_size) if input_size else teacher.img_size
+        self.class_names = teacher.class_names
+        self.model = None
+        self.base_model = None
+
+    def image_paths(self, df):
+        return [self.data_dir / image_path for image_path in df['image_path']]
+
+    def soft_targets(self, df, batch_size=32):
+        """Teacher probabilities for df's images, computed once and cached on disk"""
+        cache_path = self.models_dir / SOFT_TARGETS_FILE
+        checksum = file_checksum(self.teacher.model_path)
+        keys = np.array([str(image_path) for image_path in df['image_path']])
+
+        cached = {}
+        if cache_path.exists():
+            with np.load(cache_path) as stored:
+                if str(stored['teacher_sha256']) == checksum:
+                    cached = dict(zip(stored['image_paths'], stored['probabilities']))
+
+        missing = [key for key in dict.fromkeys(keys) if key not in cached]
+        if missing:
+            print(f"Scoring {len(missing)} images with the teacher "
+                  f"({len(keys) - len(missing)} cached)...", file=sys.stderr)
+            batch = np.empty((batch_size, *self.teacher.img_size, 3), dtype=np.float32)
+            for start in range(0, len(missing), batch_size):
+                chunk = missing[start:start + batch_size]
+                for slot, key in enumerate(chunk):
+                    self.teacher.preprocess_image(self.data_dir / key, out=batch[slot])
+                for key, probabilities in zip(chunk, self.teacher.backend.predict(batch[:len(chunk)])):
+                    cached[key] = probabilities
+
+            self.models_dir.mkdir(parents=True, exist_ok=True)
+            np.savez(cache_path,
+                     teacher_sha256=checksum,
+                     image_paths=np.array(list(cached)),
+                     probabilities=np.stack(list(cached.values())).astype(np.float32))
+
+        return np.stack([cached[key] for key in keys]).astype(np.float32)
+
+    def packed_targets(self, df):
+        """[one-hot label | teacher probabilities] rows in the service's class order"""
+        labels = np.array([self.class_names.index(name) for name in df['class']])
+        hard = np.eye(len(self.class_names), dtype=np.float32)[labels]
+        return np.concatenate([hard, self.soft_targets(df)], axis=1)
+
+    def create_student(self):
+        """Backbone at the student resolution behind a resize from the service input size"""
+        constructor, scale, offset = STUDENT_ARCHITECTURES[self.architecture]
+        inputs = keras.Input(shape=(*self.teacher.img_size, 3))
+        x = inputs
+        if self.student_size != tuple(self.teacher.img_size):
+            x = layers.Resizing(*self.student_size, name='student_resize')(x)
+        x = layers.Rescaling(scale, offset=offset, name='student_scale')(x)
+
+        self.base_model = constructor(weights='imagenet', include_top=False, input_shape=(*self.student_size, 3))
+        self.base_model.trainable = False
+        x = self.base_model(x, training=False)
+        x = layers.GlobalAveragePooling2D()(x)
+        x = layers.Dropout(0.2)(x)
+        outputs = layers.Dense(len(self.class_names), activation='softmax', name='predictions')(x)
+
+        self.model = keras.Model(inputs, outputs, name=f"fracture_student_{self.architecture}")
+        return self.model
+
+    def compile_student(self, learning_rate, temperature, alpha):
+        self.model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
+            loss=distillation_loss(len(self.class_names), temperature, alpha),
+            metrics=[hard_accuracy(len(self.class_names))]
+        )
+
+    def train(self, train_df, val_df, epochs=30, batch_size=32, temperature=4.0, alpha=0.9):
+        """Head first on the frozen backbone, then the whole student at a lower rate"""
+        train_seq = DistillationSequence(self.teacher, self.image_paths(train_df), self.packed_targets(train_df),
+                                         batch_size=batch_size, shuffle=True, flip=True)
+        val_seq = DistillationSequence(self.teacher, self.image_paths(val_df), self.packed_targets(val_df),
+                                       batch_size=batch_size)
+
+        def callbacks():
+            return [keras.callbacks.EarlyStopping(
+                monitor='val_accuracy', patience=6, restore_best_weights=True, mode='max'
+            )]
+
+        print("Phase 1: Training student head with frozen backbone...")
+        self.compile_student(1e-3, temperature, alpha)
+        self.model.fit(train_seq, epochs=max(1, epochs // 3), validation_data=val_seq,
+                       callbacks=callbacks(), verbose=1)
+
+        print("Phase 2: Fine-tuning the whole student...")
+        self.base_model.trainable = True
+        self.compile_student(1e-4, temperature, alpha)
+        self.model.fit(train_seq, epochs=epochs - max(1, epochs // 3), validation_data=val_seq,
+                       callbacks=callbacks(), verbose=1)
+        return self.model
+
+    def save(self, report):
+        """Write the student and metadata that identifies it as its own model version"""
+        student_path = self.models_dir / STUDENT_ARTIFACT
+        # A standard loss in the saved config, so load_model() needs no custom objects
+        self.model.compile(loss='categorical_crossentropy', metrics=['accuracy'])
+        self.model.save(str(student_path))
+        teacher_version = read_model_version(self.teacher.metadata_path)
+        metadata = {
+            'model_architecture': self.architecture,
+            'student_input_size': list(self.student_size),
+            'input_size': list(self.teacher.img_size),
+            'num_classes': len(self.class_names),
+            'class_names': self.class_names,
+            'model_version': f"{teacher_version}-{self.architecture}",
+            'teacher_version': teacher_version,
+            'distillation': report
+        }
+        metadata_path = student_path.with_name(f"{student_path.stem}_metadata.json")
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        print(f"✓ Student saved: {student_path}")
+        return student_path, metadata
+
+    def register(self, student_path, metadata, activate=False):
+        """Publish the student as a registry version the predictors can swap to"""
+        with tempfile.TemporaryDirectory() as staging:
+            # The registry stores the Keras artifact under its backend name
+            staged = Path(staging) / BACKEND_ARTIFACTS['keras']
+            shutil.copy2(student_path, staged)
+            return ModelRegistry().register([staged], metadata=metadata, activate=activate)
+
+def main():
+    """Distill the trained teacher and report student accuracy and CPU latency"""
+    parser = argparse.ArgumentParser(description='Distill the fracture model into a smaller student')
+    parser.add_argument('--student', choices=list(STUDENT_ARCHITECTURES), default='mobilenetv3-small',
+                        help='Student backbone')
+    parser.add_argument('--input-size', type=int, default=160,
+                        help='Student resolution; inputs stay 224x224 and are resized inside the model')
+    parser.add_argument('--temperature', type=float, default=4.0, help='Softening temperature')
+    parser.add_argument('--alpha', type=float, default=0.9,
+                        help='Weight of the soft-target loss (the rest goes to the hard labels)')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--latency-runs', type=int, default=50, help='Batch-of-one timing repeats')
+    parser.add_argument('--register', action='store_true', help='Register the student in the model registry')
+    parser.add_argument('--activate', action='store_true', help='With --register, make it the active version')
+    args = parser.parse_args()
+
+    print("=== Distilling Fracture Model ===")
+
+    teacher = FracturePredictionService(backend='keras')
+    if not teacher.model_path.exists():
+        print("❌ Trained model not found. Run train_with_real_data.py first.")
+        return
+
+    # Same filtering and split as training, so the test split is truly held out
+    df = EnhancedFractureModel().load_and_preprocess_data()
+    train_df, val_df, test_df = split_dataset(df)
+
+    distiller = StudentDistiller(teacher, architecture=args.student, input_size=args.input_size)
+    distiller.create_student()
+    print(f"Student parameters: {distiller.model.count_params():,} "
+          f"(teacher: {teacher.model.count_params():,})")
+    distiller.train(train_df, val_df, epochs=args.epochs, batch_size=args.batch_size,
+                    temperature=args.temperature, alpha=args.alpha)
+
+    print("\nEvaluating on held-out test split (CPU)...")
+    exporter = ModelExporter(teacher)
+    test_images = exporter.load_images(test_df)
+    labels = np.array([teacher.class_names.index(name) for name in test_df['class']])
+    with tf.device('/CPU:0'):
+        teacher_metrics = exporter.evaluate(KerasBackend(model=teacher.model), test_images, labels,
+                                            latency_runs=args.latency_runs)
+        student_metrics = exporter.evaluate(KerasBackend(model=distiller.model), test_images, labels,
+                                            latency_runs=args.latency_runs)
+
+    report = {
+        'test_samples': len(test_df),
+        'temperature': args.temperature,
+        'alpha': args.alpha,
+        'teacher': {
+            'path': str(teacher.model_path),
+            'parameters': int(teacher.model.count_params()),
+            'accuracy': teacher_metrics['accuracy'],
+            'cpu_latency_ms': teacher_metrics['latency_ms']
+        },
+        'student': {
+            'architecture': args.student,
+            'input_size': list(distiller.student_size),
+            'parameters': int(distiller.model.count_params()),
+            'accuracy': student_metrics['accuracy'],
+            'cpu_latency_ms': student_metrics['latency_ms']
+        },
+        'accuracy_delta': student_metrics['accuracy'] - teacher_metrics['accuracy'],
+        'agreement_with_teacher': float(np.mean(student_metrics['predicted'] == teacher_metrics['predicted'])),
+        'speedup': teacher_metrics['latency_ms'] / student_metrics['latency_ms']
+    }
+
+    print(f"\n{'Model':<22}{'Params':>12}{'Accuracy':>10}{'CPU ms':>9}")
+    for name, label in (('teacher', 'EfficientNetB3'), ('student', args.student)):
+        model_report = report[name]
+        print(f"{label:<22}{model_report['parameters']:>12,}{model_report['accuracy']:>10.4f}"
+              f"{model_report['cpu_latency_ms']:>9.1f}")
+    print(f"Accuracy delta: {report['accuracy_delta']:+.4f}, "
+          f"agreement: {report['agreement_with_teacher']:.3f}, speedup: {report['speedup']:.1f}x")
+
+    student_path, metadata = distiller.save(report)
+    report_path = MODELS_DIR / 'distillation_report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Report saved: {report_path}")
+
+    if args.register:
+        version = distiller.register(student_path, metadata, activate=args.activate)
+        print(f"✓ Registered student as model version {version}" + (" (active)" if args.activate else ""))
+    else:
+        print(f"Serve it with: python predict_fracture.py --serve --model-path models/{STUDENT_ARTIFACT}")
+
+if __name__ == "__main__":
+    main()
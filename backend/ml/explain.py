@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Grad-CAM Explainability Maps
+Computes class probabilities and Grad-CAM heatmaps for a batch in the same
+forward pass: the model runs once under a GradientTape that also returns its
+last convolutional feature map, so an explanation costs one backward pass
+rather than a second inference.
+"""
+
+import base64
+import numpy as np
+
+# Heatmaps are downsampled to fit this size; EfficientNetB3's native 7x7 map is left as is
+HEATMAP_MAX_SIZE = 28
+
+def _chain(model):
+    """Top-level layers in call order; both training scripts build a plain chain"""
+    from tensorflow import keras
+
+    return [layer for layer in model.layers if not isinstance(layer, keras.layers.InputLayer)]
+
+def find_feature_layer(model):
+    """Last top-level layer with a spatial (N, H, W, C) output, e.g. the EfficientNet base"""
+    feature_layer = None
+    # Follow static shapes: nested models have no symbolic output in the outer graph
+    shape = tuple(model.input_shape)
+    for layer in _chain(model):
+        shape = tuple(layer.compute_output_shape(shape))
+        if len(shape) == 4:
+            feature_layer = layer
+    if feature_layer is None:
+        raise ValueError("Model has no convolutional feature map for Grad-CAM")
+    return feature_layer
+
+def _split_model(model, layer):
+    """images -> (layer's feature map, model output) in a single pass"""
+    chain = _chain(model)
+    split = chain.index(layer) + 1
+
+    def run(images):
+        x = images
+        for sublayer in chain[:split]:
+            x = sublayer(x, training=False)
+        features = x
+        for sublayer in chain[split:]:
+            x = sublayer(x, training=False)
+        return features, x
+    return run
+
+class GradCAM:
+    """Batched forward pass returning (probabilities, Grad-CAM maps in [0, 1])"""
+    def __init__(self, model, layer_name=None):
+        import tensorflow as tf
+
+        layer = model.get_layer(layer_name) if layer_name else find_feature_layer(model)
+        self.layer_name = layer.name
+        split_model = _split_model(model, layer)
+
+        def forward(images):
+            with tf.GradientTape() as tape:
+                features, probabilities = split_model(images)
+                # Rows are independent at inference, so one gradient of the summed
+                # predicted-class scores yields every image's own gradient
+                scores = tf.reduce_max(probabilities, axis=-1)
+            grads = tape.gradient(scores, features)
+            weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+            cams = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1))
+            cams /= tf.reduce_max(cams, axis=(1, 2), keepdims=True) + 1e-8
+            return probabilities, cams
+
+        input_shape = [None, *model.input_shape[1:]]
+        self._forward = tf.function(forward, input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+
+    def __call__(self, images):
+        probabilities, cams = self._forward(np.asarray(images, dtype=np.float32))
+        return probabilities.numpy(), cams.numpy()
+
+def encode_heatmap(cam, max_size=HEATMAP_MAX_SIZE):
+    """A [0, 1] map as a compact grayscale PNG (base64), downsampled to fit max_size"""
+    import cv2
+
+    heatmap = np.rint(np.clip(cam, 0.0, 1.0) * 255).astype(np.uint8)
+    height, width = heatmap.shape
+    if max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        heatmap = cv2.resize(heatmap, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+    ok, png = cv2.imencode('.png', heatmap)
+    if not ok:
+        raise ValueError("Could not encode heatmap")
+    return {
+        'shape': list(heatmap.shape),
+        'png_base64': base64.b64encode(png.tobytes()).decode('ascii')
+    }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Quantized Model Export for CPU Inference
+Converts the trained Keras model to float16 and int8 TFLite (and optionally
+ONNX), then measures accuracy and latency of each variant on the held-out split
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+
+from backends import BACKEND_ARTIFACTS, load_backend
+from model_registry import DEFAULT_REGISTRY, ModelRegistry
+from predict_fracture import FracturePredictionService
+from train_with_real_data import EnhancedFractureModel, split_dataset
+
+MODELS_DIR = Path(__file__).parent / 'models'
+
+class ModelExporter:
+    def __init__(self, predictor, data_dir='data', models_dir=MODELS_DIR):
+        self.predictor = predictor
+        self.data_dir = Path(data_dir)
+        self.models_dir = Path(models_dir)
+
+    def load_images(self, df):
+        """Preprocess a split exactly as the prediction service does"""
+        images = []
+        for image_path in df['image_path']:
+            images.append(self.predictor.preprocess_image(self.data_dir / image_path)[0])
+        return np.stack(images)
+
+    def export_tflite_fp16(self):
+        """Float16 weight quantization: half the size, near-identical accuracy"""
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.predictor.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+        return self._write(converter.convert(), 'tflite-fp16')
+
+    def export_tflite_int8(self, calibration_images):
+        """Full int8 quantization calibrated on training images"""
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.predictor.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        try:
+            model_bytes = converter.convert()
+        except Exception as e:
+            # Some ops have no int8 kernel; let those fall back to float
+            print(f"Full int8 conversion failed ({e}); allowing float fallback ops", file=sys.stderr)
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                tf.lite.OpsSet.TFLITE_BUILTINS
+            ]
+            model_bytes = converter.convert()
+        return self._write(model_bytes, 'tflite-int8')
+
+    def export_onnx(self, opset=13):
+        """ONNX export via tf2onnx for ONNX Runtime"""
+        try:
+            import tf2onnx
+        except ImportError:
+            raise ImportError("ONNX export requires tf2onnx: pip install tf2onnx onnxruntime")
+
+        output_path = self.models_dir / BACKEND_ARTIFACTS['onnx']
+        input_signature = [tf.TensorSpec((None, *self.predictor.img_size, 3), tf.float32, name='input')]
+        tf2onnx.convert.from_keras(
+            self.predictor.model,
+            input_signature=input_signature,
+            opset=opset,
+            output_path=str(output_path)
+        )
+        print(f"✓ Exported onnx: {output_path}")
+        return output_path
+
+    def _write(self, model_bytes, backend_name):
+        output_path = self.models_dir / BACKEND_ARTIFACTS[backend_name]
+        output_path.write_bytes(model_bytes)
+        print(f"✓ Exported {backend_name}: {output_path} ({len(model_bytes) / 1e6:.1f} MB)")
+        return output_path
+
+    def evaluate(self, backend, images, labels, batch_size=32, latency_runs=20):
+        """Accuracy over the split plus single-image CPU latency"""
+        probabilities = np.concatenate([
+            backend.predict(images[start:start + batch_size])
+            for start in range(0, len(images), batch_size)
+        ])
+        predicted = np.argmax(probabilities, axis=1)
+
+        # Warm once, then time batch-of-one calls as seen by the online service
+        sample = images[:1]
+        backend.predict(sample)
+        started = time.perf_counter()
+        for _ in range(latency_runs):
+            backend.predict(sample)
+        latency_ms = (time.perf_counter() - started) / latency_runs * 1000
+
+        return {
+            'accuracy': float(np.mean(predicted == labels)),
+            'latency_ms': latency_ms,
+            'predicted': predicted,
+            'probabilities': probabilities
+        }
+
+def main():
+    """Export quantized variants and report their accuracy delta"""
+    parser = argparse.ArgumentParser(description='Export quantized fracture detection models')
+    parser.add_argument('--calibration-samples', type=int, default=200,
+                        help='Training images used to calibrate int8 quantization')
+    parser.add_argument('--onnx', action='store_true', help='Also export an ONNX model')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Largest acceptable accuracy drop versus Keras')
+    parser.add_argument('--registry', default=str(DEFAULT_REGISTRY),
+                        help="Model registry; its active version is exported and the variants registered with it")
+    args = parser.parse_args()
+
+    print("=== Exporting Quantized Models ===")
+
+    registry = ModelRegistry(args.registry)
+    predictor = FracturePredictionService(backend='keras', registry=registry)
+    if not predictor.model_path.exists():
+        print("❌ Trained model not found. Run train_with_real_data.py first.")
+        return
+
+    # Same filtering and split as training, so the test split is truly held out
+    df = EnhancedFractureModel().load_and_preprocess_data()
+    train_df, _, test_df = split_dataset(df)
+
+    exporter = ModelExporter(predictor)
+    calibration_df = train_df.sample(min(args.calibration_samples, len(train_df)), random_state=42)
+    calibration_images = exporter.load_images(calibration_df)
+
+    exported = {
+        'tflite-fp16': exporter.export_tflite_fp16(),
+        'tflite-int8': exporter.export_tflite_int8(calibration_images),
+    }
+    if args.onnx:
+        exported['onnx'] = exporter.export_onnx()
+
+    print("\nEvaluating on held-out test split...")
+    test_images = exporter.load_images(test_df)
+    labels = np.array([predictor.class_names.index(name) for name in test_df['class']])
+
+    reference = exporter.evaluate(predictor.backend, test_images, labels)
+    report = {
+        'test_samples': len(test_df),
+        'tolerance': args.tolerance,
+        'variants': {
+            'keras': {
+                'path': str(predictor.model_path),
+                'size_mb': predictor.model_path.stat().st_size / 1e6,
+                'accuracy': reference['accuracy'],
+                'accuracy_delta': 0.0,
+                'agreement_with_keras': 1.0,
+                'max_probability_diff': 0.0,
+                'latency_ms': reference['latency_ms']
+            }
+        }
+    }
+
+    for name, path in exported.items():
+        metrics = exporter.evaluate(load_backend(name, path), test_images, labels)
+        report['variants'][name] = {
+            'path': str(path),
+            'size_mb': path.stat().st_size / 1e6,
+            'accuracy': metrics['accuracy'],
+            'accuracy_delta': metrics['accuracy'] - reference['accuracy'],
+            'agreement_with_keras': float(np.mean(metrics['predicted'] == reference['predicted'])),
+            'max_probability_diff': float(np.max(np.abs(metrics['probabilities'] - reference['probabilities']))),
+            'latency_ms': metrics['latency_ms']
+        }
+
+    # Fastest variant whose accuracy stays within tolerance of the Keras model
+    within_tolerance = [
+        name for name, variant in report['variants'].items()
+        if variant['accuracy_delta'] >= -args.tolerance
+    ]
+    report['recommended_backend'] = min(
+        within_tolerance, key=lambda name: report['variants'][name]['latency_ms']
+    )
+
+    print(f"\n{'Backend':<14}{'Size MB':>9}{'Accuracy':>10}{'Delta':>9}{'Agree':>8}{'Latency ms':>12}")
+    for name, variant in report['variants'].items():
+        print(f"{name:<14}{variant['size_mb']:>9.1f}{variant['accuracy']:>10.4f}"
+              f"{variant['accuracy_delta']:>+9.4f}{variant['agreement_with_keras']:>8.3f}"
+              f"{variant['latency_ms']:>12.1f}")
+
+    if predictor.registry_version is not None:
+        # Predictors resolve every backend from the active version, so the variants must live there
+        report['registry_version'] = registry.extend(predictor.registry_version, exported.values(), activate=True)
+        print(f"\n✓ Registered and activated model version {report['registry_version']} "
+              f"with {', '.join(exported)}")
+
+    report_path = MODELS_DIR / 'export_report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n✓ Report saved: {report_path}")
+    print(f"Recommended backend: {report['recommended_backend']} "
+          f"(use --backend {report['recommended_backend']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Frozen-Backbone Feature Cache
+While the EfficientNet base is frozen (Phase 1 of both training scripts) every
+epoch would recompute the same backbone forward pass. Instead the backbone
+runs once over the training and validation images, the pooled embeddings are
+written to a memory-mapped array, and the classification head is trained on
+them directly. The head model shares its layers with the full model, so the
+trained weights carry straight into fine-tuning.
+
+Layout:
+    <root>/<key>/features.npy    (N, D) float32 pooled embeddings
+    <root>/<key>/labels.npy      (N, ...) float32 targets
+
+The key hashes the backbone weights and a description of the images (paths,
+size, augmented copies), so a different backbone or dataset gets its own cache.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from data_pipeline import epoch_batches
+
+FEATURES_FILE = 'features.npy'
+LABELS_FILE = 'labels.npy'
+# Part of the cache key; bumped when the same images would be embedded differently
+CACHE_VERSION = 2
+
+def split_at_pooling(model):
+    """(backbone layers ending with the pooled embedding, head layers) of a chain model"""
+    chain = [layer for layer in model.layers if not isinstance(layer, keras.layers.InputLayer)]
+    for index, layer in enumerate(chain):
+        if isinstance(layer, keras.layers.GlobalAveragePooling2D):
+            return chain[:index + 1], chain[index + 1:]
+    raise ValueError("Model has no GlobalAveragePooling2D embedding to cache")
+
+def embedding_size(model):
+    """Width of the pooled embedding"""
+    backbone, _ = split_at_pooling(model)
+    shape = tuple(model.input_shape)
+    for layer in backbone:
+        shape = tuple(layer.compute_output_shape(shape))
+    return shape[-1]
+
+def head_model(model):
+    """Model from pooled embeddings to the output, sharing the full model's head layers"""
+    _, head = split_at_pooling(model)
+    inputs = keras.Input(shape=(embedding_size(model),))
+    x = inputs
+    for layer in head:
+        x = layer(x)
+    return keras.Model(inputs, x, name='cached_feature_head')
+
+def backbone_fingerprint(model):
+    """SHA-256 of the backbone weights"""
+    backbone, _ = split_at_pooling(model)
+    digest = hashlib.sha256()
+    for layer in backbone:
+        for weight in layer.weights:
+            digest.update(np.ascontiguousarray(weight.numpy()).tobytes())
+    return digest.hexdigest()
+
+def _backbone_fn(model):
+    """tf.function images -> pooled embeddings, every layer in inference mode.
+
+    Augmented copies arrive already augmented by their dataset; running the
+    model's own augmentation layers as well would augment them twice.
+    """
+    backbone, _ = split_at_pooling(model)
+
+    @tf.function
+    def forward(images):
+        x = images
+        for layer in backbone:
+            x = layer(x, training=False)
+        return x
+    return forward
+
+class FeatureSet:
+    """Cached embeddings and labels, memory-mapped read-only"""
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.features = np.load(self.directory / FEATURES_FILE, mmap_mode='r')
+        self.labels = np.load(self.directory / LABELS_FILE, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.features)
+
+    def gather(self, rows):
+        """(features, labels) for a batch of rows, read in ascending order"""
+        rows = np.sort(rows)
+        return np.asarray(self.features[rows]), np.asarray(self.labels[rows])
+
+    def dataset(self, batch_size=32, training=False, seed=42, start_epoch=None):
+        """Batched (features, labels) dataset; training reshuffles every epoch.
+
+        With start_epoch, training streams endlessly from that epoch, each
+        epoch in an order fixed by (seed, epoch) as in data_pipeline.make_dataset,
+        so a resumed run sees the same batches; fit it with steps_per_epoch.
+        """
+        feature_shape = self.features.shape[1:]
+        label_shape = self.labels.shape[1:]
+
+        def gather(rows):
+            features, labels = tf.numpy_function(self.gather, [rows], (tf.float32, tf.float32))
+            features.set_shape((None, *feature_shape))
+            labels.set_shape((None, *label_shape))
+            return features, labels
+
+        if training and start_epoch is not None:
+            ds = epoch_batches(len(self), batch_size, seed, start_epoch)
+        else:
+            ds = tf.data.Dataset.from_tensor_slices(np.arange(len(self), dtype=np.int64))
+            if training:
+                ds = ds.shuffle(len(self), seed=seed, reshuffle_each_iteration=True)
+            ds = ds.batch(batch_size)
+        return ds.map(gather, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+def cache_features(model, passes, root, description):
+    """Run the frozen backbone once per pass and open the cached embeddings.
+
+    passes is a list of (dataset, sample count) covering the images in
+    order; augmented copies come from an augmenting dataset. The description
+    (JSON-serializable) identifies the images and copies for the cache key.
+    Embeddings are written under a temporary name and renamed into place, so
+    an interrupted run is never reused.
+    """
+    root = Path(root)
+    key_source = json.dumps({'version': CACHE_VERSION, 'backbone': backbone_fingerprint(model),
+                             'images': description}, sort_keys=True)
+    key = hashlib.sha256(key_source.encode()).hexdigest()[:16]
+    directory = root / key
+    if (directory / LABELS_FILE).exists():
+        return FeatureSet(directory)
+
+    total = sum(count for _, count in passes)
+    root.mkdir(parents=True, exist_ok=True)
+    staging = root / f".{key}.{os.getpid()}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+    try:
+        features = np.lib.format.open_memmap(staging / FEATURES_FILE, mode='w+', dtype=np.float32,
+                                             shape=(total, embedding_size(model)))
+        labels = None
+        row = 0
+        forward = _backbone_fn(model)
+        for dataset, count in passes:
+            for images, targets in dataset:
+                targets = targets.numpy()
+                if labels is None:
+                    labels = np.lib.format.open_memmap(staging / LABELS_FILE, mode='w+', dtype=np.float32,
+                                                       shape=(total, *targets.shape[1:]))
+                features[row:row + len(targets)] = forward(images).numpy()
+                labels[row:row + len(targets)] = targets
+                row += len(targets)
+        if row != total:
+            raise ValueError(f"Expected {total} samples from the datasets, got {row}")
+        features.flush()
+        labels.flush()
+        del features, labels
+        os.replace(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return FeatureSet(directory)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Preprocessed Training Image Store
+Materializes the deterministic part of training preprocessing (decode, resize,
+CLAHE) once into a uint8 array that the input pipeline memory-maps, so epochs
+read pixels through the page cache instead of re-decoding every JPEG. Only the
+random augmentation runs per epoch.
+
+Layout:
+    <root>/<key>/images.npy    (N, H, W, 3) uint8 RGB, one row per image
+    <root>/<key>/index.json    image paths in row order and the preprocessing parameters
+
+The key hashes the preprocessing parameters and the manifest (each path with
+its size and modification time), so a changed dataset or setting builds a new
+store and the superseded one is removed.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+from preprocessing import CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID
+
+STORE_VERSION = 1
+IMAGES_FILE = 'images.npy'
+INDEX_FILE = 'index.json'
+
+def store_parameters(img_size, clahe):
+    """Everything besides the manifest that changes the stored pixels"""
+    return {
+        'version': STORE_VERSION,
+        'img_size': list(img_size),
+        'clahe': bool(clahe),
+        'clip_limit': CLAHE_CLIP_LIMIT,
+        'tile_grid': list(CLAHE_TILE_GRID)
+    }
+
+def store_key(paths, parameters):
+    """Hash of the preprocessing parameters and each image's path, size and mtime"""
+    digest = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+class ImageStore:
+    """Read-only view of a materialized store; images is a memory map"""
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / INDEX_FILE) as f:
+            self.index = json.load(f)
+        self.images = np.load(self.directory / IMAGES_FILE, mmap_mode='r')
+        self._rows = {path: row for row, path in enumerate(self.index['paths'])}
+
+    def __len__(self):
+        return len(self.images)
+
+    def check(self, img_size, clahe):
+        """Raise if the store was built with other preprocessing"""
+        parameters = store_parameters(img_size, clahe)
+        if self.index['parameters'] != parameters:
+            raise ValueError(f"Image store {self.directory} was built with {self.index['parameters']}, "
+                             f"not {parameters}")
+
+    def rows(self, paths):
+        """Row of each image path"""
+        try:
+            return np.array([self._rows[str(path)] for path in paths], dtype=np.int64)
+        except KeyError as error:
+            raise ValueError(f"Image not in store {self.directory}: {error.args[0]}") from None
+
+    def gather(self, rows):
+        """(N, H, W, 3) uint8 batch for rows, read from the map in ascending order"""
+        order = np.argsort(rows)
+        batch = np.empty((len(rows), *self.images.shape[1:]), dtype=np.uint8)
+        batch[order] = self.images[rows[order]]
+        return batch
+
+def _prune(root, parameters, keep):
+    """Remove stores built with the same parameters for an older manifest"""
+    for directory in root.iterdir():
+        if directory.name == keep or directory.name.startswith('.') or not directory.is_dir():
+            continue
+        try:
+            with open(directory / INDEX_FILE) as f:
+                stale = json.load(f)['parameters'] == parameters
+        except (OSError, ValueError, KeyError):
+            continue
+        if stale:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def materialize(paths, img_size, root, clahe=True, workers=None):
+    """Open the store for these images, building it first when it is missing or stale.
+
+    Images are decoded and enhanced on a thread pool (OpenCV releases the GIL)
+    straight into the memory-mapped array. The store is assembled under a
+    temporary name and renamed into place, so an interrupted build is never
+    reused.
+    """
+    from data_pipeline import load_image
+
+    paths = list(dict.fromkeys(str(path) for path in paths))
+    if not paths:
+        raise ValueError("No images to materialize")
+    root = Path(root)
+    parameters = store_parameters(img_size, clahe)
+    key = store_key(paths, parameters)
+    directory = root / key
+    if (directory / INDEX_FILE).exists():
+        return ImageStore(directory)
+
+    root.mkdir(parents=True, exist_ok=True)
+    staging = root / f".{key}.{os.getpid()}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+    try:
+        images = np.lib.format.open_memmap(staging / IMAGES_FILE, mode='w+', dtype=np.uint8,
+                                           shape=(len(paths), img_size[1], img_size[0], 3))
+
+        def write(row):
+            images[row] = load_image(paths[row], img_size, clahe)
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for _ in pool.map(write, range(len(paths))):
+                pass
+        images.flush()
+        del images
+
+        with open(staging / INDEX_FILE, 'w') as f:
+            json.dump({'key': key, 'parameters': parameters, 'paths': paths}, f)
+        os.replace(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _prune(root, parameters, keep=key)
+    return ImageStore(directory)
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Asyncio Fracture Inference Server
+Serves FracturePredictionService over HTTP with a bounded request queue,
+per-request deadlines and fast rejection when overloaded
+"""
+
+import sys
+import json
+import signal
+import asyncio
+import argparse
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from backends import BACKEND_ARTIFACTS
+from dicom_io import WINDOW_MODES
+from metrics import format_prometheus
+from model_registry import DEFAULT_REGISTRY, ModelRegistry
+from predict_fracture import FracturePredictionService, prediction_options, request_image
+from process_pool import ProcessPool, processes_arg
+from tiling import DEFAULT_MAX_TILES, DEFAULT_TILE_OVERLAP, DEFAULT_TILE_SCALE
+
+class HTTPError(Exception):
+    """Error that maps directly onto an HTTP status response"""
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+class InferenceJob:
+    """A queued prediction waiting for an inference worker"""
+    def __init__(self, image, deadline, future, enqueued=None, options=None):
+        self.image = image
+        self.options = options or {}
+        self.deadline = deadline
+        self.future = future
+        self.enqueued = enqueued
+
+class FractureInferenceServer:
+    def __init__(self, predictor, host='127.0.0.1', port=8765, max_queue_size=32,
+                 workers=2, request_timeout=30.0, max_body_size=10 * 1024 * 1024):
+        self.predictor = predictor
+        self.host = host
+        self.port = port
+        self.max_queue_size = max_queue_size
+        self.workers = max(1, workers)
+        self.request_timeout = request_timeout
+        self.max_body_size = max_body_size
+        self.accepting = False
+        self.in_flight = 0
+        self.responses = Counter()
+        self._queue = None
+        self._server = None
+        self._worker_tasks = []
+        self._executor = None
+        self._stopped = None
+        self._submit_async = False
+        self.routes = {
+            ('GET', '/health'): self.handle_health,
+            ('GET', '/model-info'): self.handle_model_info,
+            ('GET', '/metrics'): self.handle_metrics,
+            ('POST', '/predict'): self.handle_predict,
+            ('POST', '/model/reload'): self.handle_reload,
+        }
+
+    async def start(self):
+        """Start inference workers and begin accepting connections"""
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._stopped = asyncio.Event()
+        # With batching enabled, enough requests must be in flight to fill a batch
+        if getattr(self.predictor, 'batcher', None) is not None:
+            self.workers = max(self.workers, self.predictor.batcher.max_batch_size)
+        # A pipeline overlaps preprocessing with the model, so keep both stages fed
+        pipeline = getattr(self.predictor, 'pipeline', None)
+        if pipeline is not None:
+            self.workers = max(self.workers,
+                               pipeline.preprocess_workers + pipeline.batcher.max_batch_size)
+        # Pipelines and worker processes answer through futures without holding a thread
+        self._submit_async = pipeline is not None or isinstance(self.predictor, ProcessPool)
+        # Inference runs in threads so the event loop keeps accepting connections
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='inference')
+        self._worker_tasks = [
+            asyncio.create_task(self._inference_worker())
+            for _ in range(self.workers)
+        ]
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        self.accepting = True
+        print(f"Inference server listening on http://{self.host}:{self.port}", file=sys.stderr)
+
+    async def stop(self):
+        """Stop accepting work, drain queued jobs and shut down"""
+        if not self.accepting:
+            return
+        self.accepting = False
+        self._server.close()
+        await self._server.wait_closed()
+        await self._queue.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._stopped.set()
+
+    async def wait_stopped(self):
+        """Block until stop() has completed"""
+        await self._stopped.wait()
+
+    async def _inference_worker(self):
+        """Pull queued jobs and run them off the event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                # The caller already gave up (deadline or disconnect)
+                if job.future.done():
+                    continue
+                if loop.time() >= job.deadline:
+                    job.future.set_exception(HTTPError(
+                        HTTPStatus.GATEWAY_TIMEOUT, 'Request deadline exceeded while queued'))
+                    continue
+
+                # Time spent in the server queue, before the service's own stages
+                self.predictor.metrics.observe('server_queue', (loop.time() - job.enqueued) * 1000)
+                self.in_flight += 1
+                try:
+                    if self._submit_async:
+                        result = await asyncio.wrap_future(self.predictor.submit(job.image, **job.options))
+                    else:
+                        result = await loop.run_in_executor(
+                            self._executor, partial(self.predictor.predict, job.image, **job.options))
+                    if not job.future.done():
+                        job.future.set_result(result)
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                finally:
+                    self.in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    async def handle_health(self, request):
+        """Report liveness and queue pressure"""
+        return HTTPStatus.OK, {
+            'success': True,
+            'status': 'healthy' if self.accepting else 'draining',
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue_size,
+            'in_flight': self.in_flight,
+            'workers': self.workers
+        }
+
+    async def handle_model_info(self, request):
+        """Describe the loaded model"""
+        loop = asyncio.get_running_loop()
+        # A process pool asks its workers, so stay off the event loop
+        model_info = await loop.run_in_executor(None, self.predictor.get_model_info)
+        return HTTPStatus.OK, {
+            'success': True,
+            'model_info': model_info
+        }
+
+    async def handle_metrics(self, request):
+        """Report serving metrics as JSON, or Prometheus text with ?format=prometheus"""
+        loop = asyncio.get_running_loop()
+        metrics = await loop.run_in_executor(None, self.predictor.get_metrics)
+        metrics['server'] = {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue_size,
+            'in_flight': self.in_flight,
+            'responses': {str(status): count for status, count in sorted(self.responses.items())}
+        }
+        formats = request['query'].get('format', [])
+        if 'prometheus' in formats or ('json' not in formats
+                                       and 'text/plain' in request['headers'].get('accept', '')):
+            return HTTPStatus.OK, format_prometheus(metrics)
+        return HTTPStatus.OK, {
+            'success': True,
+            'metrics': metrics
+        }
+
+    async def handle_reload(self, request):
+        """Hot-swap to a registry version while predictions keep being served"""
+        version = request['json'].get('version')
+        loop = asyncio.get_running_loop()
+        try:
+            # Loading and warming run off the event loop; the swap itself is between batches
+            swapped = await loop.run_in_executor(None, self.predictor.reload_model, version)
+        except (ValueError, RuntimeError) as e:
+            raise HTTPError(HTTPStatus.CONFLICT, str(e))
+        return HTTPStatus.OK, {
+            'success': True,
+            'reloaded': swapped,
+            'model_info': await loop.run_in_executor(None, self.predictor.get_model_info)
+        }
+
+    async def handle_predict(self, request):
+        """Queue a prediction and wait for it within the request deadline"""
+        if not self.accepting:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, 'Server is shutting down')
+
+        payload = request['json']
+        if request['raw_image'] is not None:
+            # Encoded image sent as the request body, decoded in memory
+            image = request['raw_image']
+        else:
+            try:
+                image = request_image(payload)
+            except ValueError as e:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+        # Options come from the JSON body, or the query string for raw image bodies
+        query = {name: values[-1] for name, values in request['query'].items()}
+        try:
+            options = prediction_options({**query, **payload})
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+        timeout = self.request_timeout
+        timeout_ms = payload.get('timeout_ms', request['headers'].get('x-request-timeout-ms'))
+        if timeout_ms is not None:
+            try:
+                timeout = min(timeout, float(timeout_ms) / 1000.0)
+            except (TypeError, ValueError):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'timeout_ms must be a number')
+
+        loop = asyncio.get_running_loop()
+        job = InferenceJob(image, loop.time() + timeout, loop.create_future(), loop.time(), options)
+
+        # Fail fast instead of letting work pile up behind a slow model
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, 'Inference queue is full',
+                            headers={'Retry-After': '1'})
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(job.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            job.future.cancel()
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, 'Request deadline exceeded')
+        except HTTPError:
+            raise
+        except ValueError as e:
+            # Undecodable images and invalid request modes, as raised by the service
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+
+        return HTTPStatus.OK, {'success': True, 'result': result}
+
+    async def read_request(self, reader):
+        """Parse one HTTP/1.1 request, returning None on a closed connection"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Headers too large')
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Malformed request line')
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid Content-Length')
+        if content_length > self.max_body_size:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body too large')
+
+        body = await reader.readexactly(content_length) if content_length else b''
+
+        path, _, query = target.partition('?')
+        return {
+            'method': method.upper(),
+            'path': path,
+            'query': parse_qs(query),
+            'version': version,
+            'headers': headers,
+            'body': body
+        }
+
+    async def dispatch(self, request):
+        """Route a parsed request to its handler"""
+        handler = self.routes.get((request['method'], request['path']))
+        if handler is None:
+            if any(path == request['path'] for _, path in self.routes):
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Method not allowed')
+            raise HTTPError(HTTPStatus.NOT_FOUND, 'Not found')
+
+        request['json'] = {}
+        request['raw_image'] = None
+        content_type = request['headers'].get('content-type', '').split(';', 1)[0].strip().lower()
+        if content_type in ('application/octet-stream', 'application/dicom') or content_type.startswith('image/'):
+            request['raw_image'] = memoryview(request['body'])
+        elif request['body']:
+            try:
+                request['json'] = json.loads(request['body'])
+            except json.JSONDecodeError as e:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {e}")
+            if not isinstance(request['json'], dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'JSON body must be an object')
+
+        return await handler(request)
+
+    async def write_response(self, writer, status, payload, headers=None, keep_alive=True):
+        """Serialize a JSON response, or a plain-text one for string payloads"""
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = json.dumps(payload).encode('utf-8')
+            content_type = 'application/json'
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                headers = {}
+                keep_alive = True
+                request = None
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    keep_alive = request['headers'].get('connection', '').lower() != 'close'
+                    status, payload = await self.dispatch(request)
+                except HTTPError as e:
+                    status, payload, headers = e.status, {'success': False, 'error': e.message}, e.headers
+                except asyncio.IncompleteReadError:
+                    break
+                except ConnectionError:
+                    raise
+                except Exception:
+                    # A failing handler still answers, rather than dropping the connection
+                    print(f"Unhandled error serving {request['path'] if request else 'a request'}:",
+                          file=sys.stderr)
+                    traceback.print_exc()
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {
+                        'success': False, 'error': 'Internal server error'}
+                    # The stream position is unknown if the request itself could not be read
+                    keep_alive = keep_alive and request is not None
+
+                if request is not None and request['path'] == '/predict':
+                    self.responses[status.value] += 1
+                await self.write_response(writer, status, payload, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+async def run_server(args):
+    """Load the model once (or once per worker process) and serve until interrupted"""
+    service_kwargs = {
+        'model_path': args.model_path,
+        'backend': args.backend,
+        'jit_compile': args.xla,
+        'compile_cache_dir': args.compile_cache_dir if args.xla else None,
+        'dicom_window': args.dicom_window,
+        'registry': ModelRegistry(args.registry)
+    }
+
+    def setup(service):
+        """Enable the serving features chosen on the command line"""
+        service.configure_tiling(args.tile_scale, args.tile_overlap, args.max_tiles)
+        if args.cascade:
+            service.enable_cascade(args.cascade_threshold)
+        if args.cache_size > 0 or args.cache_db:
+            service.enable_cache(args.cache_size, args.cache_db)
+        service.enable_pipeline(
+            preprocess_workers=args.preprocess_workers,
+            queue_size=args.ready_queue_size,
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_wait_ms if args.max_batch_size > 1 else 0.0
+        )
+        if args.watch_registry > 0 and args.model_path is None:
+            service.watch_registry(args.watch_registry)
+
+    workers = args.workers
+    if args.processes != 1:
+        # Forked before TensorFlow is imported in this process; each worker loads the model
+        predictor = ProcessPool(
+            service_kwargs,
+            setup,
+            processes=args.processes,
+            intra_op_threads=args.intra_op_threads,
+            inter_op_threads=args.inter_op_threads,
+            pin=not args.no_pin,
+            benchmark_batch_size=args.max_batch_size
+        )
+        # Keep every worker process's pipeline fed
+        workers = max(workers, predictor.processes * (args.preprocess_workers + args.max_batch_size))
+    else:
+        predictor = FracturePredictionService(**service_kwargs)
+        setup(predictor)
+
+    server = FractureInferenceServer(
+        predictor,
+        host=args.host,
+        port=args.port,
+        max_queue_size=args.max_queue_size,
+        workers=workers,
+        request_timeout=args.timeout
+    )
+    await server.start()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(server.stop()))
+        except NotImplementedError:
+            # Signal handlers are unavailable on Windows event loops
+            pass
+
+    await server.wait_stopped()
+    if isinstance(predictor, ProcessPool):
+        predictor.close()
+    else:
+        predictor.stop_watching()
+        predictor.close_pipeline()
+
+def parse_args(argv=None):
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Fracture detection inference server')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--backend', choices=list(BACKEND_ARTIFACTS), default='keras',
+                        help='Model format to load (see export_models.py)')
+    parser.add_argument('--model-path', help='Model artifact to load instead of the backend default')
+    parser.add_argument('--registry', default=str(DEFAULT_REGISTRY),
+                        help="Model registry; its active version is served when --model-path is not given")
+    parser.add_argument('--watch-registry', type=float, default=5.0, metavar='SECONDS',
+                        help='Poll the registry and hot-swap on activation (0 disables)')
+    parser.add_argument('--xla', action='store_true',
+                        help='JIT-compile the Keras forward pass with XLA')
+    parser.add_argument('--compile-cache-dir', default=str(Path(__file__).parent / 'models' / '.xla_cache'),
+                        help='Directory for persistent XLA compilation artifacts (used with --xla)')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Let the screening model answer confident Normal cases (see train_with_real_data.py)')
+    parser.add_argument('--cascade-threshold', type=float,
+                        help='P(abnormal) below which the screening model decides (default: tuned value)')
+    parser.add_argument('--dicom-window', choices=WINDOW_MODES, default='auto',
+                        help="DICOM intensity windowing: the file's VOI window, percentiles or min/max")
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Predictions run concurrently off the event loop')
+    parser.add_argument('--preprocess-workers', type=int, default=2,
+                        help='Threads decoding and preprocessing images ahead of the model (per process)')
+    parser.add_argument('--processes', type=processes_arg, default=1,
+                        help="Model worker processes, each pinned to its own CPUs; "
+                             "'auto' benchmarks the host to choose them and their thread counts")
+    parser.add_argument('--intra-op-threads', type=int,
+                        help='Threads per operation in each worker process (default: its CPU share)')
+    parser.add_argument('--inter-op-threads', type=int,
+                        help='Operations run concurrently in each worker process (default: 1, or 2 from 8 threads)')
+    parser.add_argument('--no-pin', action='store_true',
+                        help='Do not pin worker processes to CPU sets')
+    parser.add_argument('--ready-queue-size', type=int, default=32,
+                        help='Preprocessed images waiting for the model before preprocessing blocks')
+    parser.add_argument('--max-queue-size', type=int, default=32,
+                        help='Queued requests before new ones are rejected with 429')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Default per-request deadline in seconds')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Results kept in the in-memory LRU (0 disables)')
+    parser.add_argument('--cache-db',
+                        help='SQLite file that persists cached results across restarts')
+    parser.add_argument('--max-batch-size', type=int, default=1,
+                        help='Group up to this many concurrent requests per forward pass (1 disables batching)')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help='Longest a request waits for its batch to fill')
+    parser.add_argument('--tile-scale', type=float, default=DEFAULT_TILE_SCALE,
+                        help='Default resize factor for tiled requests')
+    parser.add_argument('--tile-overlap', type=float, default=DEFAULT_TILE_OVERLAP,
+                        help='Fraction of each tile shared with its neighbours')
+    parser.add_argument('--max-tiles', type=int, default=DEFAULT_MAX_TILES,
+                        help='Tiles per tiled request; the scale is lowered to stay within it')
+    return parser.parse_args(argv)
+
+def main():
+    """Main function for command-line usage"""
+    args = parse_args()
+    try:
+        asyncio.run(run_server(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
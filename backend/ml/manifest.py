@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Training Manifest Validation
+Checks that every image in a dataset manifest (train.csv) exists and has a
+readable header before training starts, without a per-row filesystem call or
+a full decode:
+
+1. Existence: each distinct image directory is listed once with os.scandir
+   (in parallel) and manifest paths are matched by set membership.
+2. Headers: existing files are opened in parallel and only their header is
+   parsed for format and dimensions, plus a cheap end-of-file marker check
+   that catches truncated PNG and JPEG files.
+3. Cache: the validated manifest is written next to the CSV together with the
+   CSV's and every image directory's modification time. While none of these
+   change, later runs read it back instead of validating again.
+
+Directory mtimes change when files are added, removed or renamed, not when a
+file is overwritten in place; delete the cached file to force a full check.
+"""
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+VALIDATION_VERSION = 1
+MIN_IMAGE_SIDE = 32
+# Formats the training loader (OpenCV) decodes
+IMAGE_FORMATS = ('PNG', 'JPEG', 'BMP', 'TIFF')
+# Trailing bytes that must be present at the end of a complete file
+END_MARKERS = {'PNG': b'IEND\xaeB`\x82', 'JPEG': b'\xff\xd9'}
+HEADER_CHUNK = 4096
+# Files per parallel task, so millions of rows do not become millions of futures
+HEADER_BATCH = 1024
+
+def validated_paths(csv_path):
+    """(validated manifest CSV, its metadata JSON) stored next to csv_path"""
+    csv_path = Path(csv_path)
+    return (csv_path.with_name(f"{csv_path.stem}.validated.csv"),
+            csv_path.with_name(f"{csv_path.stem}.validated.json"))
+
+def _split(paths):
+    """Directory and file name columns of '/'-separated relative paths"""
+    parts = paths.str.rpartition('/')
+    return parts[0], parts[2]
+
+def _list_directory(directory):
+    """File names in a directory, or an empty set if it does not exist"""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def existing_mask(paths, data_dir, workers=None):
+    """Boolean mask of manifest paths present on disk, from one listing per directory"""
+    directories, names = _split(paths)
+    unique = directories.unique()
+    with ThreadPoolExecutor(max_workers=_workers(workers)) as pool:
+        listings = dict(zip(unique, pool.map(lambda d: _list_directory(Path(data_dir) / d), unique)))
+    present = {f"{directory}/{name}" if directory else name
+               for directory, files in listings.items() for name in files}
+    return paths.isin(present).to_numpy()
+
+def read_header(path, min_side=MIN_IMAGE_SIDE):
+    """(width, height) from an image header, or None if it is unreadable, too small or truncated"""
+    from PIL import Image
+
+    try:
+        with open(path, 'rb') as f:
+            with Image.open(f) as img:
+                image_format, (width, height) = img.format, img.size
+            marker = END_MARKERS.get(image_format)
+            if marker:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - HEADER_CHUNK))
+                if marker not in f.read():
+                    return None
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    if image_format not in IMAGE_FORMATS or min(width, height) < min_side:
+        return None
+    return width, height
+
+def _workers(workers):
+    # File system bound: more threads than cores keeps the disk queue busy
+    return workers or min(32, (os.cpu_count() or 1) * 4)
+
+def read_headers(paths, min_side=MIN_IMAGE_SIDE, workers=None):
+    """(N, 2) array of (width, height), zero for unreadable files, read in parallel batches"""
+    batches = [paths[start:start + HEADER_BATCH] for start in range(0, len(paths), HEADER_BATCH)]
+
+    def read_batch(batch):
+        return [read_header(path, min_side) or (0, 0) for path in batch]
+
+    sizes = np.zeros((len(paths), 2), dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=_workers(workers)) as pool:
+        for index, batch_sizes in enumerate(pool.map(read_batch, batches)):
+            if batch_sizes:
+                sizes[index * HEADER_BATCH:index * HEADER_BATCH + len(batch_sizes)] = batch_sizes
+    return sizes
+
+def _directory_state(csv_path, data_dir, directories):
+    """Modification times that invalidate a cached validation"""
+    return {
+        'version': VALIDATION_VERSION,
+        'manifest': [str(csv_path), _mtime(csv_path)],
+        'data_dir': str(data_dir),
+        'directories': {directory: _mtime(Path(data_dir) / directory) for directory in sorted(directories)}
+    }
+
+def validate_manifest(csv_path, data_dir, x_col='image_path', min_side=MIN_IMAGE_SIDE, workers=None):
+    """Manifest rows whose images exist and have readable headers, with width and height columns.
+
+    Returns (DataFrame, stats); stats counts the rows dropped per reason and
+    records whether the cached validation was reused.
+    """
+    csv_path = Path(csv_path)
+    cached_csv, cached_state = validated_paths(csv_path)
+    if cached_csv.exists() and cached_state.exists():
+        with open(cached_state) as f:
+            cached = json.load(f)
+        state = _directory_state(csv_path, data_dir, cached['state']['directories'])
+        if cached.get('min_side') == min_side and cached['state'] == state:
+            return pd.read_csv(cached_csv), dict(cached['stats'], cached=True)
+
+    df = pd.read_csv(csv_path)
+    paths = df[x_col].astype(str).str.replace('\\', '/', regex=False)
+    exists = existing_mask(paths, data_dir, workers)
+
+    # Each distinct file is read once, however often the manifest lists it
+    codes, unique = pd.factorize(paths[exists])
+    sizes = np.zeros((len(df), 2), dtype=np.int64)
+    sizes[exists] = read_headers([str(Path(data_dir) / path) for path in unique], min_side, workers)[codes]
+    readable = sizes[:, 0] > 0
+
+    valid = df[readable].assign(width=sizes[readable, 0], height=sizes[readable, 1])
+    stats = {
+        'total': len(df),
+        'missing': int((~exists).sum()),
+        'unreadable': int(exists.sum() - readable.sum()),
+        'valid': len(valid)
+    }
+
+    state = _directory_state(csv_path, data_dir, _split(paths)[0].unique())
+    tmp_csv = cached_csv.with_name(f".{cached_csv.name}.{os.getpid()}.tmp")
+    valid.to_csv(tmp_csv, index=False)
+    os.replace(tmp_csv, cached_csv)
+    tmp_state = cached_state.with_name(f".{cached_state.name}.{os.getpid()}.tmp")
+    with open(tmp_state, 'w') as f:
+        json.dump({'state': state, 'min_side': min_side, 'stats': stats}, f)
+    os.replace(tmp_state, cached_state)
+    return valid, dict(stats, cached=False)
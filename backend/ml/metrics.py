@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Serving Metrics
+Cumulative latency histograms, request counters and throughput for the
+persistent worker and the inference server, exported as JSON or in the
+Prometheus text exposition format
+"""
+
+import math
+import time
+import threading
+from collections import Counter, deque
+
+# Upper bounds in milliseconds, Prometheus-style (cumulative, +Inf implied)
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+THROUGHPUT_WINDOW_S = 60
+
+class Histogram:
+    """Fixed-bucket histogram with interpolated percentiles"""
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0-100) by interpolating within a bucket"""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def snapshot(self):
+        cumulative, buckets = 0, {}
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets['+Inf'] = self.count
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': buckets
+        }
+
+class ServiceMetrics:
+    """Thread-safe per-stage latency histograms, outcomes and throughput"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.outcomes = Counter()
+        # (second, completed requests) pairs for the recent throughput window
+        self._recent = deque()
+
+    def _observe(self, stage, duration_ms):
+        """Add a stage duration to its histogram (lock held)"""
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(duration_ms)
+
+    def observe(self, stage, duration_ms):
+        """Record one stage duration"""
+        with self._lock:
+            self._observe(stage, duration_ms)
+
+    def record_request(self, timings_ms, cached=False):
+        """Record a completed prediction and each of its stage timings"""
+        with self._lock:
+            for stage, duration_ms in timings_ms.items():
+                self._observe(stage, duration_ms)
+            self.outcomes['cached' if cached else 'success'] += 1
+            self._tick()
+
+    def record_error(self):
+        with self._lock:
+            self.outcomes['error'] += 1
+            self._tick()
+
+    def _tick(self):
+        """Count a completion in the current second (lock held)"""
+        second = int(time.time())
+        if self._recent and self._recent[-1][0] == second:
+            self._recent[-1][1] += 1
+        else:
+            self._recent.append([second, 1])
+        while self._recent and self._recent[0][0] <= second - THROUGHPUT_WINDOW_S:
+            self._recent.popleft()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.time()
+            uptime = max(now - self.started, 1e-9)
+            window = min(uptime, THROUGHPUT_WINDOW_S)
+            recent = sum(count for second, count in self._recent if second > now - THROUGHPUT_WINDOW_S)
+            completed = sum(self.outcomes.values())
+            return {
+                'uptime_s': uptime,
+                'requests': dict(self.outcomes),
+                'requests_total': completed,
+                'throughput_rps': completed / uptime,
+                'recent_throughput_rps': recent / window,
+                'stage_latency_ms': {stage: histogram.snapshot() for stage, histogram in self.stages.items()}
+            }
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_prometheus(metrics, prefix='fracture'):
+    """Render FracturePredictionService.get_metrics() in Prometheus text format"""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+    def sample(name, value, **labels):
+        label_text = ','.join(f'{key}="{_label_value(val)}"' for key, val in labels.items())
+        lines.append(f"{prefix}_{name}{{{label_text}}} {_number(value)}" if label_text
+                     else f"{prefix}_{name} {_number(value)}")
+
+    requests = metrics.get('requests') or {}
+    if requests:
+        family('requests_total', 'counter', 'Completed predictions by outcome')
+        for outcome, count in sorted(requests.get('requests', {}).items()):
+            sample('requests_total', count, outcome=outcome)
+        family('throughput_rps', 'gauge', 'Completed predictions per second')
+        sample('throughput_rps', requests['throughput_rps'], window='lifetime')
+        sample('throughput_rps', requests['recent_throughput_rps'], window=f'{THROUGHPUT_WINDOW_S}s')
+        family('uptime_seconds', 'gauge', 'Seconds since the service started')
+        sample('uptime_seconds', requests['uptime_s'])
+
+        family('stage_duration_ms', 'histogram', 'Per-request stage latency in milliseconds')
+        for stage, histogram in sorted(requests.get('stage_latency_ms', {}).items()):
+            for bound, count in histogram['buckets'].items():
+                sample('stage_duration_ms_bucket', count, stage=stage, le=bound)
+            sample('stage_duration_ms_sum', histogram['sum'], stage=stage)
+            sample('stage_duration_ms_count', histogram['count'], stage=stage)
+
+    startup = metrics.get('startup_timings_ms') or {}
+    if startup:
+        family('startup_duration_ms', 'gauge', 'Model startup stage durations in milliseconds')
+        for stage, duration in startup.items():
+            sample('startup_duration_ms', duration, stage=stage[:-3] if stage.endswith('_ms') else stage)
+
+    batching = metrics.get('batching')
+    if batching:
+        family('batch_size', 'histogram', 'Images per model forward pass')
+        cumulative = 0
+        histogram = batching.get('batch_size_histogram', {})
+        for size in range(1, batching['max_batch_size'] + 1):
+            cumulative += histogram.get(str(size), 0)
+            sample('batch_size_bucket', cumulative, le=size)
+        sample('batch_size_bucket', batching['requests'], le='+Inf')
+        sample('batch_size_sum', batching['requests'])
+        sample('batch_size_count', batching['batches'])
+        family('batch_queue_depth', 'gauge', 'Preprocessed images waiting for the model')
+        sample('batch_queue_depth', batching['queue_depth'])
+
+    pipeline = metrics.get('pipeline')
+    if pipeline:
+        family('pending_preprocess', 'gauge', 'Images waiting for or in preprocessing')
+        sample('pending_preprocess', pipeline['pending_preprocess'])
+
+    pool = metrics.get('pool')
+    if pool:
+        family('pool_processes', 'gauge', 'Model worker processes')
+        sample('pool_processes', pool['processes'])
+        family('pool_worker_up', 'gauge', 'Whether a worker process is alive')
+        for worker in pool['workers']:
+            sample('pool_worker_up', worker['alive'], worker=worker['index'])
+        family('pool_outstanding', 'gauge', 'Requests dispatched to a worker process and not yet answered')
+        for worker in pool['workers']:
+            sample('pool_outstanding', worker['outstanding'], worker=worker['index'])
+
+    cascade = metrics.get('cascade')
+    if cascade:
+        family('cascade_decisions_total', 'counter', 'Images decided by each cascade stage')
+        sample('cascade_decisions_total', cascade['screening'], stage='screening')
+        sample('cascade_decisions_total', cascade['full'], stage='full')
+
+    cache = metrics.get('cache')
+    if cache:
+        family('cache_lookups_total', 'counter', 'Prediction cache lookups by result')
+        sample('cache_lookups_total', cache['memory_hits'], result='memory_hit')
+        sample('cache_lookups_total', cache['disk_hits'], result='disk_hit')
+        sample('cache_lookups_total', cache['misses'], result='miss')
+        family('cache_hit_ratio', 'gauge', 'Fraction of cache lookups served from the cache')
+        sample('cache_hit_ratio', cache['hit_rate'])
+        family('cache_entries', 'gauge', 'Results held in the in-memory LRU')
+        sample('cache_entries', cache['entries'])
+        family('cache_invalidations_total', 'counter', 'Cache flushes caused by a model version change')
+        sample('cache_invalidations_total', cache['invalidations'])
+
+    server = metrics.get('server')
+    if server:
+        family('server_queue_depth', 'gauge', 'Requests queued for an inference worker')
+        sample('server_queue_depth', server['queue_depth'])
+        family('server_in_flight', 'gauge', 'Requests currently running')
+        sample('server_in_flight', server['in_flight'])
+        family('server_responses_total', 'counter', 'HTTP prediction responses by status code')
+        for status, count in sorted(server.get('responses', {}).items()):
+            sample('server_responses_total', count, status=status)
+
+    return '\n'.join(lines) + '\n'
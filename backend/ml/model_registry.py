@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Fracture Model Registry
+Versioned model directories with checksummed artifacts and an atomically
+switched "active" pointer that long-lived predictors follow without restarting
+
+Layout:
+    models/registry/<version>/metadata.json     version, checksums, training metadata
+    models/registry/<version>/<artifact>         e.g. fracture_detection_model.h5
+    models/registry/active.json                  active version and rollback history
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from backends import BACKEND_ARTIFACTS
+from cascade import CASCADE_CONFIG, SCREENING_ARTIFACT
+
+DEFAULT_REGISTRY = Path(__file__).parent / 'models' / 'registry'
+ACTIVE_FILE = 'active.json'
+METADATA_FILE = 'metadata.json'
+HISTORY_LIMIT = 20
+
+def file_checksum(path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temporary file and rename it over path"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class ModelRegistry:
+    def __init__(self, root=DEFAULT_REGISTRY):
+        self.root = Path(root)
+
+    def version_dir(self, version):
+        return self.root / version
+
+    def metadata_path(self, version):
+        return self.version_dir(version) / METADATA_FILE
+
+    def artifact_path(self, version, backend='keras'):
+        """Artifact a backend loads for a registered version"""
+        return self.version_dir(version) / BACKEND_ARTIFACTS[backend]
+
+    def get(self, version):
+        """Metadata of a registered version"""
+        try:
+            with open(self.metadata_path(version)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"Model version '{version}' is not registered")
+
+    def versions(self):
+        """Metadata of every registered version, oldest first"""
+        if not self.root.exists():
+            return []
+        found = [
+            self.get(path.name) for path in self.root.iterdir()
+            if path.is_dir() and not path.name.startswith('.') and (path / METADATA_FILE).exists()
+        ]
+        return sorted(found, key=lambda metadata: metadata['registered'])
+
+    def _read_active(self):
+        try:
+            with open(self.root / ACTIVE_FILE) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'version': None, 'history': []}
+
+    def active_version(self):
+        """Version currently marked active, or None"""
+        return self._read_active()['version']
+
+    def active_stamp(self):
+        """Cheap change marker for the active pointer, for polling"""
+        try:
+            stat = (self.root / ACTIVE_FILE).stat()
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _unique_version(self, version):
+        """Keep a requested version, suffixing a timestamp if it is already taken"""
+        version = version or '1.0.0'
+        if not self.version_dir(version).exists():
+            return version
+        return f"{version}+{datetime.now().strftime('%Y%m%d.%H%M%S')}"
+
+    def register(self, artifacts, version=None, metadata=None, activate=False):
+        """Copy model artifacts into a new version directory and record their checksums.
+
+        The directory is assembled under a temporary name and renamed into
+        place, so readers never see a partially written version.
+        """
+        artifacts = [Path(path) for path in artifacts]
+        known = set(BACKEND_ARTIFACTS.values()) | {SCREENING_ARTIFACT, CASCADE_CONFIG}
+        for path in artifacts:
+            if not path.is_file():
+                raise ValueError(f"Artifact not found: {path}")
+            if path.name not in known:
+                raise ValueError(f"Unknown artifact '{path.name}'. Expected one of: {', '.join(sorted(known))}")
+
+        metadata = dict(metadata or {})
+        version = self._unique_version(version or metadata.get('model_version'))
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = self.root / f".{version}.{os.getpid()}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+
+        try:
+            checksums = {}
+            for path in artifacts:
+                shutil.copy2(path, staging / path.name)
+                checksums[path.name] = {
+                    'sha256': file_checksum(staging / path.name),
+                    'size': (staging / path.name).stat().st_size
+                }
+            metadata.update({
+                'model_version': version,
+                'registered': time.time(),
+                'artifacts': checksums
+            })
+            _write_json_atomic(staging / METADATA_FILE, metadata)
+            os.replace(staging, self.version_dir(version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def extend(self, version, artifacts, activate=False):
+        """Register a new version holding a version's artifacts plus new ones (e.g. exported variants).
+
+        Registered versions never change, so added or replaced artifacts go
+        into a new version that keeps the source version's training metadata.
+        """
+        metadata = {key: value for key, value in self.get(version).items()
+                    if key not in ('registered', 'artifacts')}
+        metadata['derived_from'] = version
+        artifacts = {Path(path).name: Path(path) for path in artifacts}
+        existing = {name: self.version_dir(version) / name for name in self.get(version).get('artifacts', {})}
+        return self.register(list({**existing, **artifacts}.values()), metadata=metadata, activate=activate)
+
+    def verify(self, version):
+        """Recompute artifact checksums; raises ValueError on any mismatch"""
+        metadata = self.get(version)
+        for name, expected in metadata.get('artifacts', {}).items():
+            path = self.version_dir(version) / name
+            if not path.exists():
+                raise ValueError(f"Model version '{version}' is missing {name}")
+            if file_checksum(path) != expected['sha256']:
+                raise ValueError(f"Checksum mismatch for {name} in model version '{version}'")
+        return metadata
+
+    def activate(self, version):
+        """Verify a version and atomically point the registry at it"""
+        self.verify(version)
+        active = self._read_active()
+        history = active['history']
+        if active['version'] and active['version'] != version:
+            history = (history + [active['version']])[-HISTORY_LIMIT:]
+        _write_json_atomic(self.root / ACTIVE_FILE, {
+            'version': version,
+            'activated': time.time(),
+            'history': history
+        })
+        return version
+
+    def rollback(self):
+        """Reactivate the previously active version"""
+        active = self._read_active()
+        if not active['history']:
+            raise ValueError("No previous model version to roll back to")
+        previous = active['history'][-1]
+        self.verify(previous)
+        _write_json_atomic(self.root / ACTIVE_FILE, {
+            'version': previous,
+            'activated': time.time(),
+            'history': active['history'][:-1]
+        })
+        return previous
+
+def main():
+    """Command-line management of the model registry"""
+    parser = argparse.ArgumentParser(description='Manage versioned fracture detection models')
+    parser.add_argument('--root', default=str(DEFAULT_REGISTRY), help='Registry directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    register_parser = commands.add_parser('register', help='Register model artifacts as a new version')
+    register_parser.add_argument('artifacts', nargs='+',
+                                 help='Model files (.h5, .tflite, .onnx, screening model, cascade.json)')
+    register_parser.add_argument('--version', help='Version name (default: from --metadata)')
+    register_parser.add_argument('--metadata', help='Training metadata JSON to store with the version')
+    register_parser.add_argument('--activate', action='store_true', help='Make the new version active')
+
+    commands.add_parser('list', help='List registered versions')
+    activate_parser = commands.add_parser('activate', help='Switch the active version')
+    activate_parser.add_argument('version')
+    verify_parser = commands.add_parser('verify', help='Check artifact checksums')
+    verify_parser.add_argument('version')
+    commands.add_parser('rollback', help='Reactivate the previously active version')
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.root)
+
+    try:
+        if args.command == 'register':
+            metadata = None
+            if args.metadata:
+                with open(args.metadata) as f:
+                    metadata = json.load(f)
+            version = registry.register(args.artifacts, args.version, metadata, activate=args.activate)
+            print(f"✓ Registered model version {version}" + (" (active)" if args.activate else ""))
+        elif args.command == 'list':
+            active = registry.active_version()
+            for metadata in registry.versions():
+                marker = '*' if metadata['model_version'] == active else ' '
+                registered = datetime.fromtimestamp(metadata['registered']).isoformat(timespec='seconds')
+                print(f"{marker} {metadata['model_version']:<32} {registered}  {', '.join(metadata['artifacts'])}")
+        elif args.command == 'activate':
+            print(f"✓ Active model version: {registry.activate(args.version)}")
+        elif args.command == 'verify':
+            registry.verify(args.version)
+            print(f"✓ Checksums match for model version {args.version}")
+        elif args.command == 'rollback':
+            print(f"✓ Rolled back to model version {registry.rollback()}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Two-Stage Inference Pipeline
+A thread pool decodes and preprocesses images (OpenCV releases the GIL) into a
+bounded queue of ready tensors, while a single model stage drains that queue
+in batches
+"""
+
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from batching import MicroBatcher
+from predict_fracture import InvalidImageError
+
+class InferencePipeline:
+    def __init__(self, service, preprocess_workers=2, queue_size=32,
+                 max_batch_size=1, max_wait_ms=0.0):
+        self.service = service
+        self.preprocess_workers = max(1, preprocess_workers)
+        self.queue_size = queue_size
+        # Stage 2: the model pulls ready tensors from a bounded queue
+        self.batcher = MicroBatcher(
+            service.run_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_queue_size=queue_size
+        )
+        # Stage 1: decode and preprocess in parallel
+        self._pool = ThreadPoolExecutor(max_workers=self.preprocess_workers,
+                                        thread_name_prefix='preprocess')
+        self._pending_lock = threading.Lock()
+        self.pending_preprocess = 0
+
+    def submit(self, image):
+        """Queue an image (path or encoded bytes); returns a Future for its result"""
+        future = Future()
+        with self._pending_lock:
+            self.pending_preprocess += 1
+        self._pool.submit(self._preprocess, image, future, time.perf_counter())
+        return future
+
+    def submit_call(self, fn, *args, **kwargs):
+        """Run a whole-request function (e.g. tiled prediction) on the stage 1 pool"""
+        future = Future()
+        with self._pending_lock:
+            self.pending_preprocess += 1
+        self._pool.submit(self._call, future, fn, args, kwargs)
+        return future
+
+    def _call(self, future, fn, args, kwargs):
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            future.set_result(result)
+        finally:
+            with self._pending_lock:
+                self.pending_preprocess -= 1
+
+    def _preprocess(self, image, future, started):
+        """Stage 1: cache lookup, decode and preprocess, then hand off to the model"""
+        # Skip work for callers that cancelled while waiting for a thread
+        if not future.set_running_or_notify_cancel():
+            with self._pending_lock:
+                self.pending_preprocess -= 1
+            return
+        # Waiting for a preprocessing thread counts towards queue_wait
+        timings = {'queue_wait': (time.perf_counter() - started) * 1000}
+        try:
+            image, cache_key, cached = self.service.lookup_cache(image, timings)
+            if cached is not None:
+                future.set_result(self.service.complete_prediction(cached, timings, started))
+                return
+            tensor = self.service.preprocess_image(image, timings=timings)[0]
+            # Blocks while the ready queue is full, pushing back on stage 1
+            model_future = self.batcher.submit(tensor)
+        except InvalidImageError as e:
+            self.service.metrics.record_error()
+            future.set_exception(e)
+            return
+        except Exception as e:
+            self.service.metrics.record_error()
+            future.set_exception(RuntimeError(f"Prediction failed: {e}"))
+            return
+        finally:
+            with self._pending_lock:
+                self.pending_preprocess -= 1
+
+        model_future.add_done_callback(
+            lambda done: self._finish(done, image, cache_key, future, timings, started)
+        )
+
+    def _finish(self, model_future, image, cache_key, future, timings, started):
+        """Postprocess one row of a finished batch"""
+        try:
+            output = model_future.result()
+            pool_wait = timings['queue_wait']
+            timings.update(model_future.timings)
+            timings['queue_wait'] += pool_wait
+            result = self.service.finish_prediction(output, image, cache_key, timings, started)
+        except Exception as e:
+            self.service.metrics.record_error()
+            future.set_exception(RuntimeError(f"Prediction failed: {e}"))
+            return
+        future.set_result(result)
+
+    def close(self):
+        """Drain both stages and stop their threads"""
+        self._pool.shutdown(wait=True)
+        self.batcher.close()
+
+    def get_metrics(self):
+        """Stage configuration and current occupancy"""
+        return {
+            'preprocess_workers': self.preprocess_workers,
+            'pending_preprocess': self.pending_preprocess,
+            'ready_queue_depth': self.batcher._queue.qsize(),
+            'ready_queue_capacity': self.queue_size
+        }
@@ -4,40 +4,332 @@ Real-time Bone Fracture Prediction Script
 Loads trained model and predicts fracture type from X-ray images
 """
 
+import os
+import re
 import sys
+import time
 import json
+import base64
+import binascii
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import Future, wait
 import numpy as np
-import cv2
-import tensorflow as tf
-from tensorflow import keras
 from pathlib import Path
+from backends import BACKEND_ARTIFACTS, KerasBackend, load_backend
+from dicom_io import WINDOW_MODES, is_dicom, read_dicom_header
+from metrics import ServiceMetrics, format_prometheus
+from model_registry import DEFAULT_REGISTRY, ModelRegistry
+from prediction_cache import PredictionCache, image_digest
+from process_pool import ProcessPool, processes_arg
+from tiling import DEFAULT_MAX_TILES, DEFAULT_TILE_OVERLAP, DEFAULT_TILE_SCALE
+from study import AGGREGATIONS
+from tta import TTA_CHOICES, TTA_LEVELS
 import warnings
 warnings.filterwarnings('ignore')
 
+DATA_URL_PREFIX = re.compile(r'^data:[\w/+.-]+;base64,')
+METADATA_PATH = Path(__file__).parent / 'models' / 'fracture_detection_model_metadata.json'
+DEFAULT_MODEL_VERSION = '1.0.0'
+
+class InvalidImageError(ValueError):
+    """An image that cannot be read, decoded or preprocessed: a bad request, not a service fault"""
+
+def resolve_model_path(model_path=None, backend='keras'):
+    """Model artifact for a backend, relative to this script unless absolute"""
+    if model_path is None:
+        model_path = Path('models') / BACKEND_ARTIFACTS[backend]
+    return Path(__file__).parent / model_path
+
+def resolve_model_source(model_path=None, backend='keras', registry=None):
+    """(artifact, metadata path, registry version) for the model to serve.
+
+    An explicit model_path wins, then the registry's active version, then the
+    legacy files in models/. An explicit artifact with its own
+    <stem>_metadata.json (e.g. a distilled student) is versioned by that file.
+    """
+    if model_path is None and registry is not None:
+        version = registry.active_version()
+        if version is not None:
+            return registry.artifact_path(version, backend), registry.metadata_path(version), version
+    path = resolve_model_path(model_path, backend)
+    own_metadata = path.with_name(f"{path.stem}_metadata.json")
+    if model_path is not None and own_metadata.exists():
+        return path, own_metadata, None
+    return path, METADATA_PATH, None
+
+def read_model_version(metadata_path):
+    """model_version recorded in a metadata file, else the default"""
+    try:
+        with open(metadata_path) as f:
+            return str(json.load(f).get('model_version') or DEFAULT_MODEL_VERSION)
+    except (OSError, ValueError):
+        return DEFAULT_MODEL_VERSION
+
+def cache_namespace(model_path, backend, cascade=False):
+    """Separates cached results by backend and cascade mode, and mock results from real ones"""
+    if cascade:
+        backend = f"{backend}+cascade"
+    return backend if Path(model_path).exists() else f"{backend}-mock"
+
+def decode_base64_image(data):
+    """Decode a base64 string (optionally a data URL) into raw image bytes"""
+    try:
+        return base64.b64decode(DATA_URL_PREFIX.sub('', data.strip(), count=1))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image data: {e}")
+
+def _flag(value):
+    """Boolean request option, given as JSON or as a query-string value"""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def prediction_options(request):
+    """Per-request prediction options from a JSON request or flattened query string"""
+    options = {}
+    if _flag(request.get('tiled')):
+        options['tiled'] = True
+    tta = request.get('tta')
+    if tta is not None and tta != 'none':
+        if tta not in TTA_LEVELS:
+            raise ValueError(f"tta must be one of: none, {', '.join(TTA_LEVELS)}")
+        options['tta'] = tta
+    if _flag(request.get('explain')):
+        options['explain'] = True
+    if request.get('aggregation') is not None:
+        if request['aggregation'] not in AGGREGATIONS:
+            raise ValueError(f"aggregation must be one of: {', '.join(AGGREGATIONS)}")
+        options['aggregation'] = request['aggregation']
+    if sum(bool(options.get(mode)) for mode in ('tiled', 'tta', 'explain')) > 1:
+        raise ValueError('tiled, tta and explain cannot be combined')
+    if request.get('tile_scale') is not None:
+        try:
+            options['tile_scale'] = float(request['tile_scale'])
+        except (TypeError, ValueError):
+            raise ValueError('tile_scale must be a number')
+        if options['tile_scale'] <= 0:
+            raise ValueError('tile_scale must be positive')
+    return options
+
+def request_image(request):
+    """Image source named by a JSON request: one image, or a study of several.
+
+    Accepts image_base64, image_path, images (paths), images_base64 or
+    series_dir (a directory holding a DICOM series).
+    """
+    if request.get('image_base64'):
+        return decode_base64_image(request['image_base64'])
+    if request.get('image_path'):
+        return request['image_path']
+    if request.get('images_base64'):
+        return [decode_base64_image(data) for data in request['images_base64']]
+    if request.get('images'):
+        return list(request['images'])
+    if request.get('series_dir'):
+        return request['series_dir']
+    raise ValueError('Missing image_path, image_base64, images, images_base64 or series_dir')
+
+def is_study(image):
+    """True for a list of images or a DICOM series directory"""
+    if isinstance(image, (list, tuple)):
+        return True
+    return isinstance(image, (str, Path)) and Path(image).is_dir()
+
+def is_image_bytes(image):
+    """True when image is an in-memory encoded buffer rather than a path"""
+    return isinstance(image, (bytes, bytearray, memoryview))
+
 class FracturePredictionService:
-    def __init__(self, model_path='models/fracture_detection_model.h5'):
-        self.model_path = Path(__file__).parent / model_path
+    # TensorFlow and OpenCV are imported lazily so argument validation and
+    # cache lookups never pay for them; see load_model() for the staged startup
+    def __init__(self, model_path=None, backend='keras', num_threads=None,
+                 warmup=True, jit_compile=False, compile_cache_dir=None, dicom_window='auto',
+                 registry=None):
+        if backend not in BACKEND_ARTIFACTS:
+            raise ValueError(f"Unknown backend '{backend}'. Choose from: {', '.join(BACKEND_ARTIFACTS)}")
+        self.registry = registry
+        self.model_path, self.metadata_path, self.registry_version = resolve_model_source(
+            model_path, backend, registry)
+        self.model_version = read_model_version(self.metadata_path)
+        self.backend_name = backend
+        self.num_threads = num_threads
+        self.warmup = warmup
+        self.jit_compile = jit_compile
+        self.compile_cache_dir = compile_cache_dir
+        self.dicom_window = dicom_window
+        self.startup_timings = {}
         self.img_size = (224, 224)
         self.class_names = ['Normal', 'Crack', 'Fracture', 'Hemorrhage']
         self.model = None
+        self.backend = None
+        # Neither Keras models nor TFLite interpreters are safe for concurrent calls
+        self._model_lock = threading.Lock()
+        self.batcher = None
+        self.pipeline = None
+        self.cache = None
+        self.metrics = ServiceMetrics()
+        self.screening = None
+        self.cascade_threshold = None
+        self._cascade_threshold_override = None
+        self._metrics_lock = threading.Lock()
+        self.cascade_counts = Counter()
+        # Grad-CAM forward pass, built on the first explained request for the current model
+        self._gradcam = None
+        self.tiling = {
+            'scale': DEFAULT_TILE_SCALE,
+            'overlap': DEFAULT_TILE_OVERLAP,
+            'max_tiles': DEFAULT_MAX_TILES
+        }
+        # Serializes hot swaps; requests keep using _model_lock only
+        self._reload_lock = threading.Lock()
+        self._watch_stop = None
         self.load_model()
     
+    def _configure_compile_cache(self):
+        """Point XLA's persistent compilation cache at disk before TF is imported"""
+        if not self.compile_cache_dir:
+            return
+        if 'tensorflow' in sys.modules:
+            print("Warning: TensorFlow already imported; XLA cache directory not applied", file=sys.stderr)
+            return
+        cache_dir = Path(self.compile_cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        flags = os.environ.get('TF_XLA_FLAGS', '')
+        if '--tf_xla_persistent_cache_directory' not in flags:
+            os.environ['TF_XLA_FLAGS'] = f"{flags} --tf_xla_persistent_cache_directory={cache_dir}".strip()
+    
+    def _record_stage(self, stage, started):
+        """Store the duration of a startup stage in milliseconds"""
+        self.startup_timings[stage] = (time.perf_counter() - started) * 1000
+        return time.perf_counter()
+    
     def load_model(self):
-        """Load the trained fracture detection model"""
+        """Load the trained fracture detection model in timed stages"""
+        stage_start = time.perf_counter()
+        self._configure_compile_cache()
+        # TFLite and ONNX artifacts can run without TensorFlow on the import path
+        needs_tensorflow = self.backend_name == 'keras' or not self.model_path.exists()
+        if needs_tensorflow:
+            import tensorflow  # noqa: F401
+        import preprocessing  # noqa: F401  (OpenCV)
+        stage_start = self._record_stage('import_ms', stage_start)
+        
         try:
             if not self.model_path.exists():
                 # If trained model doesn't exist, create a mock model for demonstration
                 self.model = self.create_mock_model()
+                self.backend = KerasBackend(model=self.model, jit_compile=self.jit_compile)
                 print(f"Warning: Using mock model. Train the actual model first.", file=sys.stderr)
             else:
-                self.model = keras.models.load_model(str(self.model_path))
-                print(f"Model loaded successfully from {self.model_path}", file=sys.stderr)
+                if self.registry_version is not None:
+                    self.registry.verify(self.registry_version)
+                self.backend = load_backend(self.backend_name, self.model_path, self.num_threads,
+                                            jit_compile=self.jit_compile)
+                # The raw Keras model is kept for Keras-only features
+                self.model = getattr(self.backend, 'model', None)
+                print(f"Model loaded successfully from {self.model_path} ({self.backend_name})", file=sys.stderr)
         except Exception as e:
             print(f"Error loading model: {e}", file=sys.stderr)
             self.model = self.create_mock_model()
+            self.backend = KerasBackend(model=self.model, jit_compile=self.jit_compile)
+        stage_start = self._record_stage('load_ms', stage_start)
+        
+        if self.warmup:
+            # Trace the forward function now instead of on the first real request
+            self.backend.predict(np.zeros((1, *self.img_size, 3), dtype=np.float32))
+            self._record_stage('warmup_ms', stage_start)
+        
+        print("Startup timings (ms): " + ", ".join(
+            f"{stage}={duration:.0f}" for stage, duration in self.startup_timings.items()
+        ), file=sys.stderr)
+    
+    def reload_model(self, version=None):
+        """Hot-swap to a registry version (default: the active one).
+
+        The new model is loaded and warmed alongside the current one, then
+        swapped in under the model lock between forward passes, so in-flight
+        and queued requests are never dropped. Returns False when that version
+        is already being served.
+        """
+        if self.registry is None:
+            raise RuntimeError("No model registry configured")
+        version = version or self.registry.active_version()
+        if version is None:
+            raise ValueError("The model registry has no active version")
+        
+        with self._reload_lock:
+            if version == self.registry_version:
+                return False
+            started = time.perf_counter()
+            metadata = self.registry.verify(version)
+            model_path = self.registry.artifact_path(version, self.backend_name)
+            if not model_path.exists():
+                raise ValueError(f"Model version '{version}' has no {self.backend_name} artifact")
+            
+            backend = load_backend(self.backend_name, model_path, self.num_threads,
+                                   jit_compile=self.jit_compile)
+            # A cascading service needs the new version's screening model as well
+            screening, threshold = None, None
+            if self.screening is not None:
+                screening, threshold = self._load_screening(model_path.parent, self._cascade_threshold_override)
+            # Warm at every batch size the service will run so the swap adds no latency
+            batch_sizes = {1, self.batcher.max_batch_size if self.batcher is not None else 1}
+            for batch_size in sorted(batch_sizes):
+                warmup_batch = np.zeros((batch_size, *self.img_size, 3), dtype=np.float32)
+                backend.predict(warmup_batch)
+                if screening is not None:
+                    screening.predict(warmup_batch)
+            
+            with self._model_lock:
+                self.backend = backend
+                if screening is not None:
+                    self.screening, self.cascade_threshold = screening, threshold
+                self.model = getattr(backend, 'model', None)
+                self._gradcam = None
+                self.model_path = model_path
+                self.metadata_path = self.registry.metadata_path(version)
+                self.model_version = metadata['model_version']
+                self.registry_version = version
+            
+            if self.cache is not None:
+                self.cache.retarget(self.metadata_path, self.model_path, self.cache_namespace())
+            self.metrics.observe('model_reload', (time.perf_counter() - started) * 1000)
+            print(f"Swapped to model version {version} ({model_path})", file=sys.stderr)
+            return True
+    
+    def watch_registry(self, interval=5.0):
+        """Poll the registry's active pointer and hot-swap when it changes"""
+        if self.registry is None:
+            raise RuntimeError("No model registry configured")
+        self.stop_watching()
+        stop = self._watch_stop = threading.Event()
+        
+        def watch():
+            stamp = self.registry.active_stamp()
+            while not stop.wait(interval):
+                current = self.registry.active_stamp()
+                if current == stamp:
+                    continue
+                stamp = current
+                try:
+                    self.reload_model()
+                except Exception as e:
+                    # Keep serving the current model; a later activation can retry
+                    print(f"Model reload failed: {e}", file=sys.stderr)
+        
+        threading.Thread(target=watch, name='registry-watch', daemon=True).start()
+    
+    def stop_watching(self):
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
     
     def create_mock_model(self):
         """Create a mock model for demonstration purposes"""
+        from tensorflow import keras
+        
         model = keras.Sequential([
             keras.layers.Input(shape=(*self.img_size, 3)),
             keras.layers.Conv2D(32, 3, activation='relu'),
@@ -47,83 +339,592 @@ class FracturePredictionService:
         model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
         return model
     
-    def preprocess_image(self, image_path):
-        """Preprocess X-ray image for prediction"""
+    def get_model_info(self):
+        """Describe the loaded model for health and info endpoints"""
+        using_mock = not self.model_path.exists()
+        return {
+            'model_path': str(self.model_path),
+            'model_loaded': self.backend is not None,
+            'backend': self.backend_name,
+            'using_mock': using_mock,
+            'model_version': f"{self.model_version}-mock" if using_mock else self.model_version,
+            'registry_version': self.registry_version,
+            'classes': self.class_names,
+            'input_size': list(self.img_size),
+            'startup_timings_ms': self.startup_timings
+        }
+    
+    def decode_image(self, image, full_resolution=False):
+        """Decode an image path or in-memory encoded bytes (grayscale stays single-channel)"""
+        from preprocessing import decode_image, read_image
+        
         try:
-            # Read image
-            img = cv2.imread(str(image_path))
-            if img is None:
-                raise ValueError(f"Could not read image from {image_path}")
+            if is_dicom(image):
+                from dicom_io import read_dicom
+                # Windowed straight to 8-bit; huge detector images are strided down to ~2x input size
+                max_size = None if full_resolution else 2 * max(self.img_size)
+                return read_dicom(image, window=self.dicom_window, max_size=max_size)
+            if is_image_bytes(image):
+                # Zero-copy view over the caller's buffer, decoded without touching disk
+                return decode_image(image)
+            return read_image(image)
+        except Exception as e:
+            raise InvalidImageError(f"Image decoding failed: {e}")
+    
+    def preprocess_image(self, image, out=None, timings=None):
+        """Preprocess X-ray image (path or encoded bytes) for prediction.
+
+        Returns a (1, H, W, 3) batch; out may be a preallocated (H, W, 3)
+        float32 slot of a larger batch buffer to write into instead. Decode
+        and preprocess durations (ms) are stored in timings when given.
+        """
+        from preprocessing import preprocess_xray
+        
+        try:
+            started = time.perf_counter()
+            img = self.decode_image(image)
+            decoded = time.perf_counter()
             
-            # Convert BGR to RGB
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            # Resize, CLAHE (grayscale fast path for X-rays) and normalize to [0, 1]
+            processed = preprocess_xray(img, self.img_size, out=out)
             
-            # Resize to target size
-            img = cv2.resize(img, self.img_size)
+            if timings is not None:
+                timings['decode'] = (decoded - started) * 1000
+                timings['preprocess'] = (time.perf_counter() - decoded) * 1000
             
-            # Apply CLAHE for better contrast (important for X-rays)
-            lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            lab[:,:,0] = clahe.apply(lab[:,:,0])
-            img = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+            # Add batch dimension
+            return processed[np.newaxis]
             
-            # Normalize pixel values
-            img = img.astype(np.float32) / 255.0
+        except InvalidImageError:
+            raise
+        except Exception as e:
+            raise InvalidImageError(f"Image preprocessing failed: {e}")
+    
+    def configure_tiling(self, scale=None, overlap=None, max_tiles=None):
+        """Defaults for tiled requests: resize scale, tile overlap and the per-request tile cap"""
+        if scale is not None:
+            self.tiling['scale'] = float(scale)
+        if overlap is not None:
+            self.tiling['overlap'] = float(overlap)
+        if max_tiles is not None:
+            self.tiling['max_tiles'] = int(max_tiles)
+    
+    def predict_tiled(self, image, scale=None):
+        """Score overlapping full-resolution tiles in one forward pass (see tiling.py).
+
+        The result carries the most abnormal tile's probabilities, a coarse
+        (rows, cols) abnormality map and that tile's box in original pixels.
+        Tiles always go through the full model and are not cached.
+        """
+        from cascade import NORMAL_CLASS
+        from preprocessing import preprocess_xray
+        from tiling import aggregate_tiles, gather_tiles, plan_tiles, tile_box, tile_views
+        
+        started = time.perf_counter()
+        timings = {}
+        try:
+            img = self.decode_image(image, full_resolution=True)
+            decoded = time.perf_counter()
+            height, width = img.shape[:2]
+            plan = plan_tiles(height, width, scale or self.tiling['scale'], self.img_size,
+                              self.tiling['overlap'], self.tiling['max_tiles'])
+            processed = preprocess_xray(img, plan['size'])
+            batch = gather_tiles(tile_views(processed, self.img_size, plan['stride']))
+            timings['decode'] = (decoded - started) * 1000
+            timings['preprocess'] = (time.perf_counter() - decoded) * 1000
             
-            # Add batch dimension
-            img = np.expand_dims(img, axis=0)
+            model_start = time.perf_counter()
+            outputs = self.predict_batch(batch)
+            timings['model'] = (time.perf_counter() - model_start) * 1000
             
-            return img
+            postprocess_start = time.perf_counter()
+            probabilities, location_map, peak = aggregate_tiles(
+                outputs, plan['grid'], self.class_names.index(NORMAL_CLASS))
+            result = self.build_result(probabilities, image)
+            result['tiling'] = {
+                'scale': round(plan['scale'], 4),
+                'tiles': len(batch),
+                'grid': list(plan['grid']),
+                'location_map': np.round(location_map, 4).tolist(),
+                'peak_tile': tile_box(peak, plan, (width, height), self.img_size)
+            }
+            timings['postprocess'] = (time.perf_counter() - postprocess_start) * 1000
+            return self.complete_prediction(result, timings, started)
             
+        except InvalidImageError:
+            self.metrics.record_error()
+            raise
         except Exception as e:
-            raise ValueError(f"Image preprocessing failed: {e}")
+            self.metrics.record_error()
+            raise RuntimeError(f"Tiled prediction failed: {e}")
     
-    def predict(self, image_path):
-        """Make prediction on X-ray image"""
+    def predict_tta(self, image, level='standard'):
+        """Average the model over augmented views of an image in one forward pass (see tta.py).
+
+        The result adds the per-class standard deviation across views and that
+        of the predicted class as an uncertainty estimate. Like tiled requests,
+        TTA skips the cascade and the cache.
+        """
+        from tta import build_views, summarize_views
+        
+        started = time.perf_counter()
+        timings = {}
         try:
-            # Preprocess image
-            processed_img = self.preprocess_image(image_path)
+            img = self.decode_image(image)
+            decoded = time.perf_counter()
+            batch = build_views(img, level, self.img_size)
+            timings['decode'] = (decoded - started) * 1000
+            timings['preprocess'] = (time.perf_counter() - decoded) * 1000
+            
+            model_start = time.perf_counter()
+            outputs = self.predict_batch(batch)
+            timings['model'] = (time.perf_counter() - model_start) * 1000
+            
+            postprocess_start = time.perf_counter()
+            mean, spread = summarize_views(outputs)
+            result = self.build_result(mean, image)
+            predicted = self.class_names.index(result['predicted_class'])
+            result['tta'] = {
+                'level': level,
+                'views': len(batch),
+                'uncertainty': float(spread[predicted]),
+                'std': {name: float(value) for name, value in zip(self.class_names, spread)}
+            }
+            timings['postprocess'] = (time.perf_counter() - postprocess_start) * 1000
+            return self.complete_prediction(result, timings, started)
+            
+        except InvalidImageError:
+            self.metrics.record_error()
+            raise
+        except Exception as e:
+            self.metrics.record_error()
+            raise RuntimeError(f"TTA prediction failed: {e}")
+    
+    def predict_explained(self, image):
+        """Prediction plus a Grad-CAM heatmap from the same forward pass (see explain.py).
+
+        Needs the Keras backend. The heatmap is for the predicted class and is
+        returned as a small grayscale PNG; explained results are cached
+        separately from plain ones. The full model decides, even with the
+        cascade enabled.
+        """
+        from explain import GradCAM, encode_heatmap
+        
+        if self.model is None:
+            raise ValueError(f"Grad-CAM needs the Keras backend, not '{self.backend_name}'")
+        
+        started = time.perf_counter()
+        timings = {}
+        try:
+            image, cache_key, cached = self.lookup_cache(image, timings, variant='gradcam')
+            if cached is not None:
+                return self.complete_prediction(cached, timings, started)
             
-            # Make prediction
-            predictions = self.model.predict(processed_img, verbose=0)
+            processed_img = self.preprocess_image(image, timings=timings)
             
-            # Get probabilities and predicted class
-            probabilities = predictions[0]
-            predicted_class_idx = np.argmax(probabilities)
-            predicted_class = self.class_names[predicted_class_idx]
-            confidence = float(probabilities[predicted_class_idx])
+            model_start = time.perf_counter()
+            with self._model_lock:
+                if self._gradcam is None:
+                    self._gradcam = GradCAM(self.model)
+                gradcam = self._gradcam
+                probabilities, cams = gradcam(processed_img)
+            timings['model'] = (time.perf_counter() - model_start) * 1000
             
-            # Create probability dictionary
-            prob_dict = {
-                class_name: float(prob) 
-                for class_name, prob in zip(self.class_names, probabilities)
+            postprocess_start = time.perf_counter()
+            explanation = {
+                'method': 'grad-cam',
+                'layer': gradcam.layer_name,
+                'target_class': self.class_names[int(np.argmax(probabilities[0]))],
+                **encode_heatmap(cams[0])
             }
+            result = self.finish_prediction((probabilities[0], None), image, cache_key,
+                                            extra={'explanation': explanation})
+            timings['postprocess'] = (time.perf_counter() - postprocess_start) * 1000
+            return self.complete_prediction(result, timings, started)
             
-            # If using mock model, generate realistic-looking predictions
-            if not self.model_path.exists():
-                # Generate more realistic mock predictions
-                mock_predictions = self.generate_mock_prediction(image_path)
-                return mock_predictions
+        except InvalidImageError:
+            self.metrics.record_error()
+            raise
+        except Exception as e:
+            self.metrics.record_error()
+            raise RuntimeError(f"Explained prediction failed: {e}")
+    
+    def predict_study(self, images, aggregation='max'):
+        """Score every view of a study in one batch and pool them into a study result.
+
+        images is a list of paths or encoded buffers, or a directory holding a
+        DICOM series (see study.py). Views found in the cache skip the model;
+        the rest go through run_batch together, cascade included. The result
+        carries the study-level prediction, the per-view results and any
+        patient/study identifiers from the DICOM headers.
+        """
+        from cascade import NORMAL_CLASS
+        from preprocessing import allocate_batch
+        from study import AGGREGATIONS, aggregate_views, expand_study
+        
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"aggregation must be one of: {', '.join(AGGREGATIONS)}")
+        views, study_info = expand_study(images)
+        
+        started = time.perf_counter()
+        timings = {'cache_lookup': 0.0, 'decode': 0.0, 'preprocess': 0.0}
+        try:
+            entries = []
+            for view in views:
+                view_timings = {}
+                entries.append(self.lookup_cache(view, view_timings))
+                timings['cache_lookup'] += view_timings.get('cache_lookup', 0.0)
+            pending = [index for index, (_, _, cached) in enumerate(entries) if cached is None]
+            
+            batch = allocate_batch(len(pending), self.img_size)
+            for slot, index in enumerate(pending):
+                view_timings = {}
+                self.preprocess_image(entries[index][0], out=batch[slot], timings=view_timings)
+                timings['decode'] += view_timings['decode']
+                timings['preprocess'] += view_timings['preprocess']
+            
+            outputs = []
+            if pending:
+                model_start = time.perf_counter()
+                outputs = self.run_batch(batch)
+                timings['model'] = (time.perf_counter() - model_start) * 1000
             
+            postprocess_start = time.perf_counter()
+            results = [cached for _, _, cached in entries]
+            for index, output in zip(pending, outputs):
+                image, cache_key, _ = entries[index]
+                results[index] = self.finish_prediction(output, image, cache_key)
+            
+            probabilities = [[view['probabilities'][name] for name in self.class_names] for view in results]
+            study_probabilities, deciding = aggregate_views(
+                probabilities, self.class_names.index(NORMAL_CLASS), aggregation)
             result = {
-                'predicted_class': predicted_class,
-                'confidence': confidence,
-                'probabilities': prob_dict,
-                'model_version': '1.0.0',
-                'processing_time': 'real-time'
+                **self.summarize_probabilities(study_probabilities),
+                # Mock views carry the -mock suffix
+                'model_version': results[0]['model_version'],
+                'study': {
+                    **study_info,
+                    'views': len(results),
+                    'aggregation': aggregation,
+                    'deciding_view': deciding
+                },
+                'views': results
             }
+            timings['postprocess'] = (time.perf_counter() - postprocess_start) * 1000
+            return self.complete_prediction(result, timings, started)
+            
+        except InvalidImageError:
+            self.metrics.record_error()
+            raise
+        except Exception as e:
+            self.metrics.record_error()
+            raise RuntimeError(f"Study prediction failed: {e}")
+    
+    def enable_batching(self, max_batch_size=16, max_wait_ms=10.0):
+        """Route forward passes through a dynamic micro-batching scheduler"""
+        from batching import MicroBatcher
+        
+        if self.batcher is not None:
+            self.batcher.close()
+        self.batcher = MicroBatcher(
+            self.run_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms
+        )
+        return self.batcher
+    
+    def predict_batch(self, images):
+        """Run one forward pass over a batch of preprocessed images"""
+        with self._model_lock:
+            return self.backend.predict(images)
+    
+    def _load_screening(self, models_dir, threshold=None):
+        """Screening backend and threshold stored next to a main model artifact"""
+        from cascade import SCREENING_ARTIFACT, load_cascade_config
+        
+        screening_path = Path(models_dir) / SCREENING_ARTIFACT
+        if not screening_path.exists():
+            raise ValueError(f"Screening model not found: {screening_path}")
+        if threshold is None:
+            config = load_cascade_config(models_dir)
+            if config is None:
+                raise ValueError("No tuned cascade threshold found; pass one explicitly")
+            threshold = config['threshold']
+        return KerasBackend(screening_path, jit_compile=self.jit_compile), float(threshold)
+    
+    def enable_cascade(self, threshold=None):
+        """Answer confident Normal cases with the screening model next to the main artifact.
+
+        threshold defaults to the one tuned during training (cascade.json).
+        """
+        screening, tuned_threshold = self._load_screening(self.model_path.parent, threshold)
+        if self.warmup:
+            screening.predict(np.zeros((1, *self.img_size, 3), dtype=np.float32))
+        with self._model_lock:
+            self.screening = screening
+            self.cascade_threshold = tuned_threshold
+            # An explicit threshold also applies to versions swapped in later
+            self._cascade_threshold_override = threshold
+        if self.cache is not None:
+            self.cache.retarget(self.metadata_path, self.model_path, self.cache_namespace())
+        print(f"Cascade enabled: screening threshold {self.cascade_threshold:.4f}", file=sys.stderr)
+    
+    def run_batch(self, images):
+        """Model outputs for a batch as (probabilities, deciding stage) pairs.
+
+        With the cascade enabled, the screening model scores every image and
+        only those at or above the threshold go through the full model. The
+        stage is None when the cascade is off.
+        """
+        from cascade import screening_probabilities
+        
+        with self._model_lock:
+            if self.screening is None:
+                return [(row, None) for row in self.backend.predict(images)]
             
+            p_abnormal = np.asarray(self.screening.predict(images)).reshape(-1)
+            escalate = np.flatnonzero(p_abnormal >= self.cascade_threshold)
+            full = self.backend.predict(images[escalate]) if escalate.size else []
+        
+        outputs = [
+            (screening_probabilities(float(p), self.class_names), 'screening')
+            for p in p_abnormal
+        ]
+        for index, row in zip(escalate, full):
+            outputs[index] = (row, 'full')
+        with self._metrics_lock:
+            self.cascade_counts['full'] += len(escalate)
+            self.cascade_counts['screening'] += len(images) - len(escalate)
+        return outputs
+    
+    def build_result(self, probabilities, image, stage=None):
+        """Turn model probabilities for one image into a prediction result"""
+        # If using mock model, generate realistic-looking predictions
+        if not self.model_path.exists():
+            # Mock predictions are seeded by the content digest the cache uses, so every
+            # request mode (plain, tiled, TTA, path or bytes) agrees on the same image
+            if not is_image_bytes(image):
+                image = Path(image).read_bytes()
+            return self.generate_mock_prediction(image_digest(image))
+        
+        result = self.summarize_probabilities(probabilities)
+        if stage is not None:
+            # Which cascade stage produced this answer
+            result['decided_by'] = stage
+        return result
+    
+    def summarize_probabilities(self, probabilities):
+        """Predicted class, confidence and per-class probabilities for a probability vector"""
+        # Get probabilities and predicted class
+        predicted_class_idx = np.argmax(probabilities)
+        predicted_class = self.class_names[predicted_class_idx]
+        confidence = float(probabilities[predicted_class_idx])
+        
+        # Create probability dictionary
+        prob_dict = {
+            class_name: float(prob) 
+            for class_name, prob in zip(self.class_names, probabilities)
+        }
+        
+        return {
+            'predicted_class': predicted_class,
+            'confidence': confidence,
+            'probabilities': prob_dict,
+            'model_version': self.model_version
+        }
+    
+    def cache_namespace(self):
+        """Cache namespace for the model currently being served"""
+        return cache_namespace(self.model_path, self.backend_name, cascade=self.screening is not None)
+    
+    def enable_cache(self, max_entries=1024, db_path=None):
+        """Reuse results for identical image bytes under the same model version"""
+        if self.cache is not None:
+            self.cache.close()
+        self.cache = PredictionCache(
+            self.metadata_path,
+            self.model_path,
+            namespace=self.cache_namespace(),
+            max_entries=max_entries,
+            db_path=db_path
+        )
+        return self.cache
+    
+    def enable_pipeline(self, preprocess_workers=2, queue_size=32, max_batch_size=1, max_wait_ms=0.0):
+        """Preprocess in a thread pool that feeds the model through a bounded queue"""
+        from pipeline import InferencePipeline
+        
+        self.close_pipeline()
+        if self.batcher is not None:
+            self.batcher.close()
+        self.pipeline = InferencePipeline(
+            self,
+            preprocess_workers=preprocess_workers,
+            queue_size=queue_size,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms
+        )
+        self.batcher = self.pipeline.batcher
+        return self.pipeline
+    
+    def close_pipeline(self):
+        """Drain in-flight pipeline work and stop its threads"""
+        if self.pipeline is not None:
+            self.pipeline.close()
+            self.pipeline = None
+            self.batcher = None
+    
+    def lookup_cache(self, image, timings=None, variant=None):
+        """Return (image, cache key, cached result); paths are read to bytes when caching.
+
+        variant keeps results of other request modes (e.g. 'gradcam') apart
+        from plain predictions of the same image.
+        """
+        if self.cache is None:
+            return image, None, None
+        started = time.perf_counter()
+        # Read the file once: the same bytes are hashed and decoded
+        if not is_image_bytes(image):
+            try:
+                image = Path(image).read_bytes()
+            except OSError as e:
+                raise InvalidImageError(f"Could not read image: {e}")
+        digest = image_digest(image)
+        if variant:
+            digest = f"{digest}:{variant}"
+        cached, cache_version = self.cache.lookup(digest)
+        if timings is not None:
+            timings['cache_lookup'] = (time.perf_counter() - started) * 1000
+        # The cache key carries the model version it was looked up under
+        cache_key = (digest, cache_version)
+        if cached is not None:
+            return image, cache_key, {**cached, 'cached': True}
+        return image, cache_key, None
+    
+    def finish_prediction(self, output, image, cache_key, timings=None, started=None, extra=None):
+        """Build the result for one image's run_batch output and store it in the cache"""
+        postprocess_start = time.perf_counter()
+        probabilities, stage = output
+        result = self.build_result(probabilities, image, stage)
+        if extra:
+            result.update(extra)
+        if cache_key is not None:
+            # Dropped if the model was swapped while this request was in flight
+            digest, cache_version = cache_key
+            self.cache.put(digest, result, model_version=cache_version)
+            result = {**result, 'cached': False}
+        if timings is None:
             return result
+        timings['postprocess'] = (time.perf_counter() - postprocess_start) * 1000
+        return self.complete_prediction(result, timings, started)
+    
+    def complete_prediction(self, result, timings, started):
+        """Attach measured stage timings to a result and record them in the metrics"""
+        timings['total'] = (time.perf_counter() - started) * 1000
+        self.metrics.record_request(timings, cached=result.get('cached', False))
+        return {
+            **result,
+            'processing_time': f"{timings['total']:.1f} ms",
+            'timings_ms': {stage: round(duration, 3) for stage, duration in timings.items()}
+        }
+    
+    def submit(self, image, **options):
+        """Start a prediction and return a Future for its result (options as for predict())"""
+        if self.pipeline is not None:
+            if options or is_study(image):
+                # Whole-request modes batch their own views; keep the reader unblocked
+                return self.pipeline.submit_call(self.predict, image, **options)
+            return self.pipeline.submit(image)
+        
+        future = Future()
+        try:
+            future.set_result(self.predict(image, **options))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def predict(self, image, tiled=False, tile_scale=None, tta=None, explain=False, aggregation=None):
+        """Make prediction on X-ray image given as a path or encoded bytes.
+
+        tiled=True scores full-resolution tiles instead of the downscaled
+        image; tile_scale overrides the configured tiling scale. tta names a
+        test-time augmentation level from tta.TTA_LEVELS. explain=True adds
+        a Grad-CAM heatmap. A list of images, or a DICOM series directory, is
+        scored as one study pooled by aggregation (default 'max').
+        """
+        if is_study(image):
+            if tiled or tta not in (None, 'none') or explain:
+                raise ValueError('Studies are scored without tiled, tta or explain modes')
+            return self.predict_study(image, aggregation or 'max')
+        if tiled:
+            return self.predict_tiled(image, scale=tile_scale)
+        if tta and tta != 'none':
+            return self.predict_tta(image, tta)
+        if explain:
+            return self.predict_explained(image)
+        if self.pipeline is not None:
+            return self.pipeline.submit(image).result()
+        
+        started = time.perf_counter()
+        timings = {}
+        try:
+            image, cache_key, cached = self.lookup_cache(image, timings)
+            if cached is not None:
+                return self.complete_prediction(cached, timings, started)
+            
+            # Preprocess image
+            processed_img = self.preprocess_image(image, timings=timings)
+            
+            # Make prediction, batched with concurrent requests when enabled
+            if self.batcher is not None:
+                model_future = self.batcher.submit(processed_img[0])
+                output = model_future.result()
+                timings.update(model_future.timings)
+            else:
+                model_start = time.perf_counter()
+                output = self.run_batch(processed_img)[0]
+                timings['model'] = (time.perf_counter() - model_start) * 1000
             
+            return self.finish_prediction(output, image, cache_key, timings, started)
+            
+        except InvalidImageError:
+            self.metrics.record_error()
+            raise
         except Exception as e:
+            self.metrics.record_error()
             raise RuntimeError(f"Prediction failed: {e}")
     
-    def generate_mock_prediction(self, image_path):
-        """Generate realistic mock predictions for demonstration"""
+    def get_cascade_metrics(self):
+        """Share of images each cascade stage decided, or None when the cascade is off"""
+        if self.screening is None:
+            return None
+        with self._metrics_lock:
+            decided = sum(self.cascade_counts.values())
+            return {
+                'threshold': self.cascade_threshold,
+                'screening': self.cascade_counts['screening'],
+                'full': self.cascade_counts['full'],
+                'screened_out_rate': self.cascade_counts['screening'] / decided if decided else 0.0
+            }
+    
+    def get_metrics(self):
+        """Runtime metrics for the serving modes"""
+        return {
+            'requests': self.metrics.snapshot(),
+            'startup_timings_ms': self.startup_timings,
+            'batching': self.batcher.get_metrics() if self.batcher is not None else None,
+            'pipeline': self.pipeline.get_metrics() if self.pipeline is not None else None,
+            'cascade': self.get_cascade_metrics(),
+            'cache': self.cache.get_stats() if self.cache is not None else None
+        }
+    
+    def generate_mock_prediction(self, digest):
+        """Generate realistic mock predictions for demonstration from an image's SHA-256 digest"""
         import random
         
-        # Set seed based on image path for consistent results
-        random.seed(hash(str(image_path)) % 1000)
+        # Seed from the digest itself: hash() of a string differs between processes
+        seed = int(digest, 16)
+        random.seed(seed % 1000)
         
         # Generate realistic probabilities
         scenarios = [
@@ -134,7 +935,7 @@ class FracturePredictionService:
         ]
         
         # Select scenario based on image hash
-        scenario = scenarios[hash(str(image_path)) % len(scenarios)]
+        scenario = scenarios[seed % len(scenarios)]
         
         # Add some randomness
         for key in scenario:
@@ -154,27 +955,285 @@ class FracturePredictionService:
             'predicted_class': predicted_class,
             'confidence': confidence,
             'probabilities': scenario,
-            'model_version': '1.0.0-mock',
-            'processing_time': 'real-time'
+            'model_version': f"{self.model_version}-mock"
         }
 
+def serve(predictor, input_stream=None, output_stream=None):
+    """Answer newline-delimited JSON prediction requests until stdin closes.
+
+    Each request is ``{"id": ..., "image_path": ...}`` or, to skip the disk,
+    ``{"id": ..., "image_base64": ...}``, optionally with ``"tiled": true``
+    (and ``"tile_scale"``) for full-resolution tiles, or ``"tta": <level>``
+    for test-time augmentation, or ``"explain": true`` for a Grad-CAM
+    heatmap. A study is sent as ``"images"``, ``"images_base64"`` or
+    ``"series_dir"`` (optionally with ``"aggregation"``). Responses carry the
+    same ``id`` and may be written out of order when the service runs a
+    preprocessing pipeline (see ``enable_pipeline``).
+    ``{"id": ..., "op": "metrics"}`` returns the service metrics instead
+    (add ``"format": "prometheus"`` for the Prometheus text format), and
+    ``{"id": ..., "op": "reload", "version": ...}`` hot-swaps to a registry
+    version (default: the active one) while requests keep being served.
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    write_lock = threading.Lock()
+    in_flight_lock = threading.Lock()
+    in_flight = set()
+
+    def respond(payload):
+        line = json.dumps(payload)
+        with write_lock:
+            output_stream.write(line + '\n')
+            output_stream.flush()
+
+    def done(request_id, future):
+        with in_flight_lock:
+            in_flight.discard(future)
+        try:
+            respond({'id': request_id, 'success': True, 'result': future.result()})
+        except Exception as e:
+            respond({'id': request_id, 'success': False, 'error': str(e)})
+
+    def reload(request_id, version):
+        try:
+            swapped = predictor.reload_model(version)
+            respond({'id': request_id, 'success': True, 'result': {
+                'reloaded': swapped, 'model_version': predictor.model_version
+            }})
+        except Exception as e:
+            respond({'id': request_id, 'success': False, 'error': str(e)})
+
+    # Tell the parent process the model is loaded and requests can be sent
+    respond({'event': 'ready', 'success': True, 'startup_timings_ms': predictor.startup_timings})
+
+    for line in input_stream:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            respond({'id': None, 'success': False, 'error': f"Invalid JSON request: {e}"})
+            continue
+
+        if not isinstance(request, dict):
+            respond({'id': None, 'success': False, 'error': 'Request must be a JSON object'})
+            continue
+
+        request_id = request.get('id')
+        if request.get('op') == 'metrics':
+            metrics = predictor.get_metrics()
+            if request.get('format') == 'prometheus':
+                metrics = format_prometheus(metrics)
+            respond({'id': request_id, 'success': True, 'result': metrics})
+            continue
+        if request.get('op') == 'reload':
+            threading.Thread(target=reload, args=(request_id, request.get('version')), daemon=True).start()
+            continue
+
+        try:
+            image = request_image(request)
+        except ValueError as e:
+            respond({'id': request_id, 'success': False, 'error': str(e)})
+            continue
+
+        try:
+            options = prediction_options(request)
+        except ValueError as e:
+            respond({'id': request_id, 'success': False, 'error': str(e)})
+            continue
+        
+        # The reader never waits on the model; results are written as they finish
+        future = predictor.submit(image, **options)
+        with in_flight_lock:
+            in_flight.add(future)
+        future.add_done_callback(lambda f, request_id=request_id: done(request_id, f))
+
+    # stdin closed: let accepted requests finish before exiting
+    with in_flight_lock:
+        pending = list(in_flight)
+    wait(pending)
+
+def parse_args(argv=None):
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Predict bone fractures from X-ray images'
+    )
+    parser.add_argument('image_path', nargs='?',
+                        help='X-ray image to classify (single-shot mode)')
+    parser.add_argument('--study', nargs='+', metavar='IMAGE',
+                        help='Score these views, or one DICOM series directory, as a single study')
+    parser.add_argument('--aggregation', choices=AGGREGATIONS, default='max',
+                        help="How views are pooled into the study result: max-risk view or mean")
+    parser.add_argument('--backend', choices=list(BACKEND_ARTIFACTS), default='keras',
+                        help='Model format to load (see export_models.py)')
+    parser.add_argument('--model-path', help='Model artifact to load instead of the backend default')
+    parser.add_argument('--registry', default=str(DEFAULT_REGISTRY),
+                        help="Model registry; its active version is served when --model-path is not given")
+    parser.add_argument('--watch-registry', type=float, default=5.0, metavar='SECONDS',
+                        help='In --serve mode, poll the registry and hot-swap on activation (0 disables)')
+    parser.add_argument('--xla', action='store_true',
+                        help='JIT-compile the Keras forward pass with XLA')
+    parser.add_argument('--compile-cache-dir', default=str(Path(__file__).parent / 'models' / '.xla_cache'),
+                        help='Directory for persistent XLA compilation artifacts (used with --xla)')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Let the screening model answer confident Normal cases (see train_with_real_data.py)')
+    parser.add_argument('--cascade-threshold', type=float,
+                        help='P(abnormal) below which the screening model decides (default: tuned value)')
+    parser.add_argument('--dicom-window', choices=WINDOW_MODES, default='auto',
+                        help="DICOM intensity windowing: the file's VOI window, percentiles or min/max")
+    parser.add_argument('--tiled', action='store_true',
+                        help='Score overlapping full-resolution tiles instead of the downscaled image (single-shot mode)')
+    parser.add_argument('--explain', action='store_true',
+                        help='Add a Grad-CAM heatmap to a single-shot prediction (Keras backend)')
+    parser.add_argument('--tta', choices=TTA_CHOICES, default='none',
+                        help='Test-time augmentation level for a single-shot prediction')
+    parser.add_argument('--tile-scale', type=float, default=DEFAULT_TILE_SCALE,
+                        help='Resize factor applied to the original image before tiling')
+    parser.add_argument('--tile-overlap', type=float, default=DEFAULT_TILE_OVERLAP,
+                        help='Fraction of each tile shared with its neighbours')
+    parser.add_argument('--max-tiles', type=int, default=DEFAULT_MAX_TILES,
+                        help='Tiles per request; the scale is lowered to stay within it')
+    parser.add_argument('--serve', action='store_true',
+                        help='Load the model once and answer JSON-lines requests on stdin')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Preprocessing threads in --serve mode (per process)')
+    parser.add_argument('--processes', type=processes_arg, default=1,
+                        help="Worker processes in --serve mode, each pinned to its own CPUs; "
+                             "'auto' benchmarks the host to choose them and their thread counts")
+    parser.add_argument('--intra-op-threads', type=int,
+                        help='Threads per operation in each worker process (default: its CPU share)')
+    parser.add_argument('--inter-op-threads', type=int,
+                        help='Operations run concurrently in each worker process (default: 1, or 2 from 8 threads)')
+    parser.add_argument('--no-pin', action='store_true',
+                        help='Do not pin worker processes to CPU sets')
+    parser.add_argument('--queue-size', type=int, default=32,
+                        help='Preprocessed images waiting for the model before preprocessing blocks')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Results kept in the in-memory LRU in --serve mode (0 disables)')
+    parser.add_argument('--cache-db',
+                        help='SQLite file that persists cached results across restarts')
+    parser.add_argument('--max-batch-size', type=int, default=1,
+                        help='Group up to this many concurrent requests per forward pass (1 disables batching)')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help='Longest a request waits for its batch to fill (with --max-batch-size > 1)')
+    return parser.parse_args(argv)
+
 def main():
     """Main function for command-line usage"""
-    if len(sys.argv) != 2:
+    started = time.perf_counter()
+    args = parse_args()
+
+    if not args.serve and not args.image_path and not args.study:
         print(json.dumps({
-            'error': 'Usage: python predict_fracture.py <image_path>',
+            'error': 'Usage: python predict_fracture.py <image_path> | --study <image>... | --serve',
             'success': False
         }))
         sys.exit(1)
-    
-    image_path = sys.argv[1]
+    inputs = [] if args.serve else args.study or [args.image_path]
+
+    # Reject a missing input before paying for TensorFlow and the model
+    for image_path in inputs:
+        if not Path(image_path).exists():
+            print(json.dumps({
+                'error': f"Image not found: {image_path}",
+                'success': False
+            }))
+            sys.exit(1)
+
+    # Reject non-radiograph DICOM from its header alone, before the model loads
+    for image_path in inputs:
+        if not is_dicom(image_path):
+            continue
+        try:
+            read_dicom_header(image_path)
+        except Exception as e:
+            print(json.dumps({
+                'error': f"Invalid DICOM input: {e}",
+                'success': False
+            }))
+            sys.exit(1)
+
+    # A persisted result for these exact bytes needs no model at all (plain predictions only)
+    if (not args.serve and not args.study and args.cache_db
+            and not (args.tiled or args.explain or args.tta != 'none')):
+        model_path, metadata_path, _ = resolve_model_source(
+            args.model_path, args.backend, ModelRegistry(args.registry))
+        cache = PredictionCache(metadata_path, model_path,
+                                namespace=cache_namespace(model_path, args.backend, cascade=args.cascade),
+                                db_path=args.cache_db)
+        cached = cache.get(image_digest(Path(args.image_path).read_bytes()))
+        cache.close()
+        if cached is not None:
+            print(json.dumps({**cached, 'cached': True}))
+            return
+    validate_ms = (time.perf_counter() - started) * 1000
     
     try:
-        # Initialize prediction service
-        predictor = FracturePredictionService()
+        service_kwargs = {
+            'model_path': args.model_path,
+            'backend': args.backend,
+            'jit_compile': args.xla,
+            'compile_cache_dir': args.compile_cache_dir if args.xla else None,
+            'dicom_window': args.dicom_window,
+            'registry': ModelRegistry(args.registry)
+        }
+        
+        def setup(service):
+            """Enable the serving features chosen on the command line"""
+            service.configure_tiling(args.tile_scale, args.tile_overlap, args.max_tiles)
+            if args.cascade:
+                service.enable_cascade(args.cascade_threshold)
+            if args.cache_db or (args.serve and args.cache_size > 0):
+                service.enable_cache(args.cache_size, args.cache_db)
+            if args.serve:
+                service.enable_pipeline(
+                    preprocess_workers=args.workers,
+                    queue_size=args.queue_size,
+                    max_batch_size=args.max_batch_size,
+                    max_wait_ms=args.max_wait_ms if args.max_batch_size > 1 else 0.0
+                )
+                if args.watch_registry > 0 and args.model_path is None:
+                    service.watch_registry(args.watch_registry)
+        
+        if args.serve and args.processes != 1:
+            # Workers fork before TensorFlow is imported here, then each loads the model
+            pool = ProcessPool(
+                service_kwargs,
+                setup,
+                processes=args.processes,
+                intra_op_threads=args.intra_op_threads,
+                inter_op_threads=args.inter_op_threads,
+                pin=not args.no_pin,
+                benchmark_batch_size=args.max_batch_size
+            )
+            try:
+                serve(pool)
+            finally:
+                pool.close()
+            return
+        
+        # Initialize prediction service; a one-shot run has no later request to warm up for
+        predictor = FracturePredictionService(warmup=args.serve, **service_kwargs)
+        predictor.startup_timings = {'validate_ms': validate_ms, **predictor.startup_timings}
+        setup(predictor)
+        
+        if args.serve:
+            try:
+                serve(predictor)
+            finally:
+                predictor.stop_watching()
+                predictor.close_pipeline()
+            return
         
         # Make prediction
-        result = predictor.predict(image_path)
+        if args.study:
+            # One directory is a DICOM series; anything else is a list of views
+            series = len(args.study) == 1 and Path(args.study[0]).is_dir()
+            result = predictor.predict(args.study[0] if series else args.study, aggregation=args.aggregation)
+        else:
+            result = predictor.predict(args.image_path, tiled=args.tiled, tta=args.tta, explain=args.explain)
         
         # Output result as JSON
         print(json.dumps(result))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Prediction Cache
+Keys results by image content hash and model version, with an in-memory LRU
+and an optional SQLite tier that survives restarts
+
+The model version combines the metadata's model_version with a fingerprint of
+the artifact (its registry checksum, else its size and modification time), so
+retraining under an unchanged version string still invalidates. Rows are
+tagged with the cache namespace (backend and cascade mode), and invalidation
+only deletes rows of its own namespace, so services sharing one database keep
+each other's results. Disk writes are buffered and committed in batches off
+the request path.
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Bumped when the table layout changes; an older table is dropped (it is only a cache)
+SCHEMA_VERSION = 2
+# Buffered disk writes are committed once this many are pending, or after WRITE_INTERVAL seconds
+WRITE_BATCH = 64
+WRITE_INTERVAL = 1.0
+
+def image_digest(image_bytes):
+    """SHA-256 of the encoded image bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+class PredictionCache:
+    def __init__(self, metadata_path, model_path, namespace='keras', max_entries=1024,
+                 db_path=None, check_interval=1.0, write_interval=WRITE_INTERVAL):
+        self.metadata_path = Path(metadata_path)
+        self.model_path = Path(model_path)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.db_path = Path(db_path) if db_path else None
+        self.check_interval = check_interval
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._pending = OrderedDict()
+        self._flush_stop = None
+        self._source_stamp = None
+        self._last_check = 0.0
+        self.model_version = None
+        self._version_namespace = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if self.db_path is not None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # With WAL, NORMAL only syncs at checkpoints; a crash can lose recent rows, never corrupt
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS predictions')
+                self._db.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'key TEXT PRIMARY KEY, namespace TEXT NOT NULL, model_version TEXT NOT NULL, '
+                'result TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS predictions_namespace '
+                             'ON predictions (namespace, model_version)')
+            self._db.commit()
+
+        with self._lock:
+            self._refresh_version(force=True)
+        if self._db is not None:
+            self._start_flusher(write_interval)
+
+    def _read_version(self):
+        """Metadata model version plus a fingerprint of the model artifact"""
+        metadata = {}
+        try:
+            with open(self.metadata_path) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            pass
+        version = str(metadata.get('model_version') or 'unversioned')
+        # Registered versions record their artifacts' checksums; anything else is fingerprinted by stat
+        checksum = (metadata.get('artifacts') or {}).get(self.model_path.name, {}).get('sha256')
+        if checksum:
+            return f"{version}@{checksum[:16]}"
+        try:
+            stat = self.model_path.stat()
+            return f"{version}@{stat.st_size}-{stat.st_mtime_ns}"
+        except OSError:
+            return f"{version}@missing"
+
+    def _refresh_version(self, force=False):
+        """Drop stale entries when the model metadata changes version (lock held)"""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        stamps = [self.namespace]
+        for path in (self.metadata_path, self.model_path):
+            try:
+                stat = path.stat()
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append(None)
+        if stamps == self._source_stamp:
+            return
+        self._source_stamp = stamps
+
+        version = self._read_version()
+        if version == self.model_version and self.namespace == self._version_namespace:
+            return
+
+        if self.model_version is not None:
+            self.invalidations += 1
+        self.model_version = version
+        self._version_namespace = self.namespace
+        self._lru.clear()
+        # Buffered rows belong to the previous version
+        self._pending.clear()
+        if self._db is not None:
+            self._db.execute('DELETE FROM predictions WHERE namespace = ? AND model_version != ?',
+                             (self.namespace, version))
+            self._db.commit()
+
+    def _key(self, digest):
+        return f"{self.namespace}:{self.model_version}:{digest}"
+
+    def retarget(self, metadata_path, model_path, namespace=None):
+        """Follow a different model artifact, e.g. after a hot swap"""
+        with self._lock:
+            self.metadata_path = Path(metadata_path)
+            self.model_path = Path(model_path)
+            if namespace is not None:
+                self.namespace = namespace
+            self._refresh_version(force=True)
+
+    def get(self, digest):
+        """Cached result for an image digest, or None"""
+        return self.lookup(digest)[0]
+
+    def lookup(self, digest):
+        """(cached result or None, model version the lookup was made against)"""
+        with self._lock:
+            self._refresh_version()
+            key = self._key(digest)
+
+            result = self._lru.get(key)
+            if result is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return dict(result), self.model_version
+
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.memory_hits += 1
+                return json.loads(pending[2]), self.model_version
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT result FROM predictions WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    self._remember(key, result)
+                    self.disk_hits += 1
+                    return dict(result), self.model_version
+
+            self.misses += 1
+            return None, self.model_version
+
+    def put(self, digest, result, model_version=None):
+        """Store a result for an image digest under the current model version.
+
+        When model_version is given and the model has changed since, the
+        result came from the old model and is dropped. The disk write is
+        buffered and committed with others (see flush()).
+        """
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            key = self._key(digest)
+            self._remember(key, result)
+            if self._db is not None:
+                self._pending[key] = (self.namespace, self.model_version, json.dumps(result), time.time())
+                if len(self._pending) >= WRITE_BATCH:
+                    self._flush()
+
+    def _flush(self):
+        """Write buffered rows in one transaction (lock held)"""
+        if not self._pending or self._db is None:
+            return
+        rows = [(key, *row) for key, row in self._pending.items()]
+        self._pending.clear()
+        self._db.executemany(
+            'INSERT OR REPLACE INTO predictions (key, namespace, model_version, result, created) '
+            'VALUES (?, ?, ?, ?, ?)', rows)
+        self._db.commit()
+
+    def flush(self):
+        """Commit buffered disk writes now"""
+        with self._lock:
+            self._flush()
+
+    def _start_flusher(self, interval):
+        """Background thread committing buffered writes every interval seconds"""
+        stop = self._flush_stop = threading.Event()
+
+        def flush_periodically():
+            while not stop.wait(interval):
+                try:
+                    self.flush()
+                except sqlite3.Error as e:
+                    print(f"Prediction cache write failed: {e}", file=sys.stderr)
+
+        threading.Thread(target=flush_periodically, name='cache-flush', daemon=True).start()
+
+    def _remember(self, key, result):
+        """Insert into the LRU, evicting the least recently used entry"""
+        if self.max_entries <= 0:
+            return
+        self._lru[key] = dict(result)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_stats(self):
+        """Hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            stats = {
+                'model_version': self.model_version,
+                'entries': len(self._lru),
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'pending_writes': len(self._pending),
+                'disk_path': str(self.db_path) if self.db_path else None
+            }
+            if self._db is not None:
+                stats['disk_entries'] = self._db.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+            return stats
+
+    def close(self):
+        if self._flush_stop is not None:
+            self._flush_stop.set()
+            self._flush_stop = None
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Shared X-ray Preprocessing
+Resize -> CLAHE -> float32 pipeline used by prediction, training and dataset setup
+
+The reference pipeline converts RGB to LAB, applies CLAHE to the L channel and
+converts back. X-rays are grayscale, so when all channels are equal the same
+result is produced from a single channel: L is looked up from the gray value,
+CLAHE runs once, and a precomputed (L', gray) -> RGB table replaces the LAB
+round trip. The table is built with OpenCV's own conversions, so the output is
+bit-identical to the colour path.
+"""
+
+import threading
+from functools import lru_cache
+import numpy as np
+import cv2
+
+IMG_SIZE = (224, 224)
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+
+_thread_state = threading.local()
+
+# uint8 -> float32 in [0, 1], computed exactly as img.astype(np.float32) / 255.0
+_U8_TO_UNIT_FLOAT = np.arange(256, dtype=np.float32) / 255.0
+
+def get_clahe(clip_limit=CLAHE_CLIP_LIMIT, tile_grid=CLAHE_TILE_GRID):
+    """Cached CLAHE object; one per thread because apply() is not thread-safe"""
+    cache = getattr(_thread_state, 'clahe', None)
+    if cache is None:
+        cache = _thread_state.clahe = {}
+    key = (float(clip_limit), tuple(tile_grid))
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=key[0], tileGridSize=key[1])
+    return clahe
+
+@lru_cache(maxsize=1)
+def _gray_tables():
+    """Lookup tables that reproduce the LAB round trip for gray pixels"""
+    gray = np.arange(256, dtype=np.uint8)
+    lab = cv2.cvtColor(np.repeat(gray[np.newaxis, :, np.newaxis], 3, axis=2), cv2.COLOR_RGB2LAB)[0]
+    l_lut = np.ascontiguousarray(lab[:, 0])
+
+    # Row = enhanced L, column = original gray value (which fixes a and b)
+    grid = np.empty((256, 256, 3), dtype=np.uint8)
+    grid[:, :, 0] = gray[:, np.newaxis]
+    grid[:, :, 1] = lab[np.newaxis, :, 1]
+    grid[:, :, 2] = lab[np.newaxis, :, 2]
+    rgb = cv2.cvtColor(grid, cv2.COLOR_LAB2RGB).reshape(256 * 256, 3)
+
+    return l_lut, rgb, _U8_TO_UNIT_FLOAT[rgb]
+
+def decode_image(data):
+    """Decode encoded image bytes, keeping grayscale files single-channel"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_ANYCOLOR)
+    if img is None:
+        raise ValueError("Could not decode image bytes")
+    return _drop_alpha(img)
+
+def read_image(image_path):
+    """Read an image file, keeping grayscale files single-channel"""
+    img = cv2.imread(str(image_path), cv2.IMREAD_ANYCOLOR)
+    if img is None:
+        raise ValueError(f"Could not read image from {image_path}")
+    return _drop_alpha(img)
+
+def _drop_alpha(img):
+    if img.ndim == 3 and img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+def as_gray(img):
+    """Single channel view when an image carries no colour, else None"""
+    if img.ndim == 2:
+        return img
+    if img.shape[2] == 1:
+        return img[:, :, 0]
+    channel = img[:, :, 0]
+    if np.array_equal(channel, img[:, :, 1]) and np.array_equal(channel, img[:, :, 2]):
+        return channel
+    return None
+
+def _gray_indices(gray, clip_limit, tile_grid):
+    """Flat (enhanced L, gray) table indices for a resized gray image"""
+    l_lut, _, _ = _gray_tables()
+    lightness = cv2.LUT(np.ascontiguousarray(gray), l_lut)
+    enhanced = get_clahe(clip_limit, tile_grid).apply(lightness)
+    return (enhanced.astype(np.uint16) << 8) | gray
+
+def _enhance_color(rgb, clip_limit, tile_grid):
+    """Reference LAB/CLAHE path for genuinely coloured images"""
+    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
+    lab[:, :, 0] = get_clahe(clip_limit, tile_grid).apply(lab[:, :, 0])
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+def _resized(img, size):
+    if size is None or (img.shape[1], img.shape[0]) == tuple(size):
+        return img
+    return cv2.resize(img, tuple(size))
+
+def enhance_xray(img, size=IMG_SIZE, clip_limit=CLAHE_CLIP_LIMIT,
+                 tile_grid=CLAHE_TILE_GRID, bgr=True):
+    """Resize and CLAHE-enhance an image to uint8 RGB.
+
+    img is grayscale, or 3-channel BGR (RGB when bgr=False). size=None skips
+    the resize.
+    """
+    img = _resized(img, size)
+    gray = as_gray(img)
+    if gray is not None:
+        _, rgb_table, _ = _gray_tables()
+        return rgb_table[_gray_indices(gray, clip_limit, tile_grid)]
+
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if bgr else img
+    return _enhance_color(rgb, clip_limit, tile_grid)
+
+def preprocess_xray(img, size=IMG_SIZE, out=None, clip_limit=CLAHE_CLIP_LIMIT,
+                    tile_grid=CLAHE_TILE_GRID, bgr=True):
+    """Model input for one image: float32 RGB in [0, 1], written into out if given"""
+    img = _resized(img, size)
+    height, width = img.shape[:2]
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.float32)
+
+    gray = as_gray(img)
+    if gray is not None:
+        # Channels are only materialized here, at the model boundary
+        _, _, float_table = _gray_tables()
+        np.take(float_table, _gray_indices(gray, clip_limit, tile_grid), axis=0, out=out)
+        return out
+
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if bgr else img
+    np.take(_U8_TO_UNIT_FLOAT, _enhance_color(rgb, clip_limit, tile_grid), out=out)
+    return out
+
+def allocate_batch(batch_size, size=IMG_SIZE):
+    """Preallocated float32 model input buffer for batch_size images"""
+    return np.empty((batch_size, size[1], size[0], 3), dtype=np.float32)
+
+def preprocess_batch(images, size=IMG_SIZE, out=None, **kwargs):
+    """Preprocess decoded images into one (N, H, W, 3) buffer"""
+    if out is None:
+        out = allocate_batch(len(images), size)
+    for i, img in enumerate(images):
+        preprocess_xray(img, size, out=out[i], **kwargs)
+    return out[:len(images)]
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Multi-Process Inference Pool
+Runs one prediction service per worker process, each pinned to its own CPU set
+with TensorFlow's intra-/inter-op thread pools sized to match, and
+load-balances requests across them from the parent
+
+Workers are forked before TensorFlow is imported: its runtime starts thread
+pools on first use and is not fork-safe afterwards, so the model cannot be
+loaded once and inherited. Each worker loads the artifact itself; its file
+pages are shared through the OS page cache.
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+import numpy as np
+
+from metrics import ServiceMetrics
+
+AUTO = 'auto'
+BENCHMARK_SECONDS = 2.0
+WORKER_START_TIMEOUT = 600.0
+
+def available_cpus():
+    """CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def default_inter_op_threads(intra_op_threads):
+    """A CNN forward pass is one chain of ops; a second inter-op thread only pays off on wide workers"""
+    return 1 if intra_op_threads < 8 else 2
+
+def candidate_threads(cpu_count):
+    """Threads-per-worker options tried by the auto benchmark: powers of two and all CPUs"""
+    candidates = {cpu_count}
+    threads = 1
+    while threads < cpu_count:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+def split_cpus(cpus, processes):
+    """Contiguous, disjoint CPU sets of equal size, one per worker"""
+    per_worker = max(1, len(cpus) // processes)
+    return [cpus[index * per_worker:(index + 1) * per_worker] or cpus for index in range(processes)]
+
+def processes_arg(value):
+    """argparse type for --processes: a positive count or 'auto'"""
+    if value == AUTO:
+        return AUTO
+    try:
+        processes = int(value)
+    except ValueError:
+        processes = 0
+    if processes < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer or '{AUTO}', got '{value}'")
+    return processes
+
+def _picklable(value):
+    """value with zero-copy buffers (a request body's memoryview, bytearrays) copied to bytes.
+
+    Pipe messages are pickled, and memoryview objects cannot be; tuples and
+    lists (a predict's (image, options), a study's views) are converted item by item.
+    """
+    if isinstance(value, (memoryview, bytearray)):
+        return bytes(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_picklable(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _picklable(item) for key, item in value.items()}
+    return value
+
+def _fork_context():
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        raise RuntimeError("The process pool needs the fork start method (Linux)")
+
+def _configure_process(cpus, intra_op_threads, inter_op_threads, pin, needs_tensorflow):
+    """Pin the process and size the math libraries' thread pools before any of them start"""
+    # Ctrl-C reaches the whole process group; the parent shuts the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if pin and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    if needs_tensorflow:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+def _create_service(service_kwargs, intra_op_threads):
+    from predict_fracture import FracturePredictionService
+    return FracturePredictionService(num_threads=intra_op_threads, **service_kwargs)
+
+def _benchmark_main(conn, cpus, intra_op_threads, inter_op_threads, pin, service_kwargs,
+                    needs_tensorflow, batch_size, seconds):
+    """Child process: model throughput of one worker on cpus, in images per second"""
+    try:
+        _configure_process(cpus, intra_op_threads, inter_op_threads, pin, needs_tensorflow)
+        service = _create_service(service_kwargs, intra_op_threads)
+        batch = np.zeros((batch_size, *service.img_size, 3), dtype=np.float32)
+        service.backend.predict(batch)
+        images, started = 0, time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            service.backend.predict(batch)
+            images += batch_size
+        conn.send((True, images / (time.perf_counter() - started)))
+    except Exception as e:
+        conn.send((False, str(e)))
+    finally:
+        conn.close()
+
+def _worker_main(conn, index, cpus, intra_op_threads, inter_op_threads, pin, service_kwargs,
+                 needs_tensorflow, setup):
+    """Child process: serve (request_id, op, argument) messages from the parent"""
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    try:
+        _configure_process(cpus, intra_op_threads, inter_op_threads, pin, needs_tensorflow)
+        service = _create_service(service_kwargs, intra_op_threads)
+        if setup is not None:
+            setup(service)
+    except Exception as e:
+        send((None, False, f"Worker {index} failed to start: {e}"))
+        return
+    send((None, True, service.get_model_info()))
+
+    def reply(request_id, future):
+        try:
+            send((request_id, True, future.result()))
+        except ValueError as e:
+            # Bad requests (e.g. undecodable images) keep their type across the pipe
+            send((request_id, False, e))
+        except Exception as e:
+            send((request_id, False, str(e)))
+
+    def reload(request_id, version):
+        try:
+            swapped = service.reload_model(version)
+            send((request_id, True, {'reloaded': swapped, 'model_version': service.model_version,
+                                     'registry_version': service.registry_version}))
+        except Exception as e:
+            send((request_id, False, str(e)))
+
+    while True:
+        try:
+            request_id, op, argument = conn.recv()
+        except (EOFError, OSError):
+            break
+        if op == 'close':
+            break
+        try:
+            if op == 'predict':
+                image, options = argument
+                service.submit(image, **options).add_done_callback(
+                    lambda future, request_id=request_id: reply(request_id, future))
+            elif op == 'metrics':
+                send((request_id, True, service.get_metrics()))
+            elif op == 'info':
+                send((request_id, True, service.get_model_info()))
+            elif op == 'reload':
+                threading.Thread(target=reload, args=(request_id, argument), daemon=True).start()
+            else:
+                send((request_id, False, f"Unknown operation '{op}'"))
+        except Exception as e:
+            send((request_id, False, str(e)))
+
+    # Let accepted requests finish and reply before exiting
+    service.stop_watching()
+    service.close_pipeline()
+    conn.close()
+
+class PoolWorker:
+    """Parent-side handle on one worker process"""
+    def __init__(self, index, process, conn, cpus):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.cpus = cpus
+        self.send_lock = threading.Lock()
+        self.outstanding = 0
+        self.completed = 0
+        self.alive = True
+        self.model_info = None
+
+class ProcessPool:
+    """Prediction service facade over worker processes, with least-outstanding load balancing.
+
+    Exposes the submit/predict/get_metrics/get_model_info/reload_model
+    interface of FracturePredictionService, so serve() and the inference
+    server drive it unchanged. setup(service) runs in every worker after its
+    model loads (cascade, cache, pipeline, registry watching).
+    """
+    def __init__(self, service_kwargs, setup=None, processes=AUTO, intra_op_threads=None,
+                 inter_op_threads=None, pin=True, benchmark_batch_size=1):
+        started = time.perf_counter()
+        if 'tensorflow' in sys.modules:
+            print("Warning: TensorFlow already imported; forked workers may hang", file=sys.stderr)
+        self.service_kwargs = dict(service_kwargs)
+        self.pin = pin and hasattr(os, 'sched_setaffinity')
+        # Thread counts go to TensorFlow's API for Keras models; anything importing
+        # TensorFlow later (the cascade's screening model) still sees TF_NUM_* variables
+        self._needs_tensorflow = self.service_kwargs.get('backend', 'keras') == 'keras'
+        self._context = _fork_context()
+        cpus = available_cpus()
+
+        self.benchmark = None
+        if processes == AUTO:
+            self.benchmark = self.benchmark_plans(cpus, benchmark_batch_size)
+            best = max(self.benchmark, key=lambda plan: plan['images_per_s'])
+            processes, intra_op_threads = best['processes'], best['intra_op_threads']
+            print(f"Auto pool: {processes} workers x {intra_op_threads} threads "
+                  f"(~{best['images_per_s']:.1f} images/s estimated)", file=sys.stderr)
+        self.processes = max(1, min(int(processes), len(cpus)))
+        cpu_sets = split_cpus(cpus, self.processes)
+        self.intra_op_threads = intra_op_threads or len(cpu_sets[0])
+        self.inter_op_threads = inter_op_threads or default_inter_op_threads(self.intra_op_threads)
+
+        self.metrics = ServiceMetrics()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._rotation = itertools.count()
+        self.workers = [self._start_worker(index, cpu_set, setup) for index, cpu_set in enumerate(cpu_sets)]
+
+        try:
+            for worker in self.workers:
+                if not worker.conn.poll(WORKER_START_TIMEOUT):
+                    raise RuntimeError(f"Worker {worker.index} did not start in time")
+                _, ok, payload = worker.conn.recv()
+                if not ok:
+                    raise RuntimeError(payload)
+                worker.model_info = payload
+        except Exception:
+            self.close()
+            raise
+
+        for worker in self.workers:
+            threading.Thread(target=self._read_results, args=(worker,),
+                             name=f'pool-reader-{worker.index}', daemon=True).start()
+
+        info = self.workers[0].model_info
+        self.model_version = info['model_version']
+        self.registry_version = info.get('registry_version')
+        self.startup_timings = {**info.get('startup_timings_ms', {}),
+                                'pool_ms': (time.perf_counter() - started) * 1000}
+        print(f"Process pool ready: {self.processes} workers, {self.intra_op_threads} intra-op / "
+              f"{self.inter_op_threads} inter-op threads each"
+              + (", pinned" if self.pin else ""), file=sys.stderr)
+
+    def _run_child(self, target, *args):
+        """Run target(conn, *args) in a forked child and return what it sends back"""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=target, args=(child_conn, *args), daemon=True)
+        process.start()
+        child_conn.close()
+        try:
+            ok, payload = parent_conn.recv()
+        except EOFError:
+            ok, payload = False, f"exited with code {process.exitcode}"
+        process.join()
+        parent_conn.close()
+        if not ok:
+            raise RuntimeError(payload)
+        return payload
+
+    def benchmark_plans(self, cpus, batch_size=1, seconds=BENCHMARK_SECONDS):
+        """Measure one pinned worker per threads-per-worker option and extrapolate to all CPUs.
+
+        Workers own disjoint CPUs, so host throughput is estimated as the
+        single-worker rate times the number of workers that fit.
+        """
+        plans = []
+        for threads in candidate_threads(len(cpus)):
+            inter_op_threads = default_inter_op_threads(threads)
+            rate = self._run_child(_benchmark_main, cpus[:threads], threads, inter_op_threads, self.pin,
+                                   self.service_kwargs, self._needs_tensorflow, batch_size, seconds)
+            processes = len(cpus) // threads
+            plans.append({
+                'processes': processes,
+                'intra_op_threads': threads,
+                'inter_op_threads': inter_op_threads,
+                'worker_images_per_s': rate,
+                'images_per_s': rate * processes
+            })
+            print(f"  {processes:>3} workers x {threads:>2} threads: {rate * processes:8.1f} images/s",
+                  file=sys.stderr)
+        return plans
+
+    def _start_worker(self, index, cpus, setup):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, index, cpus, self.intra_op_threads, self.inter_op_threads, self.pin,
+                  self.service_kwargs, self._needs_tensorflow, setup),
+            name=f'fracture-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return PoolWorker(index, process, parent_conn, cpus)
+
+    def _pick_worker(self):
+        """Alive worker with the fewest outstanding requests, rotating between ties (lock held)"""
+        alive = [worker for worker in self.workers if worker.alive]
+        if not alive:
+            raise RuntimeError("No live worker processes")
+        offset = next(self._rotation)
+        return min(alive, key=lambda worker: (worker.outstanding,
+                                              (worker.index - offset) % len(self.workers)))
+
+    def _send(self, worker, op, argument=None):
+        """Send one operation to a worker; returns a Future for its reply"""
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = (future, worker, op, time.perf_counter())
+            if op == 'predict':
+                worker.outstanding += 1
+        try:
+            message = (request_id, op, _picklable(argument))
+            with worker.send_lock:
+                worker.conn.send(message)
+        except (OSError, ValueError) as e:
+            self._resolve(request_id, False, f"Worker {worker.index} unavailable: {e}")
+        except Exception as e:
+            # Unpicklable arguments and the like: fail the request, never leak its pending slot
+            self._resolve(request_id, False, f"Could not send request to worker {worker.index}: {e}")
+        return future
+
+    def _resolve(self, request_id, ok, payload):
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+            if entry is None:
+                return
+            future, worker, op, sent = entry
+            if op == 'predict':
+                worker.outstanding -= 1
+                worker.completed += 1
+
+        if op == 'predict':
+            if ok:
+                # Stage timings as measured in the worker, plus the round trip around them
+                timings = dict(payload.get('timings_ms', {}))
+                total = (time.perf_counter() - sent) * 1000
+                timings['ipc'] = max(total - timings.get('total', total), 0.0)
+                timings['total'] = total
+                self.metrics.record_request(timings, cached=payload.get('cached', False))
+            else:
+                self.metrics.record_error()
+        if ok:
+            future.set_result(payload)
+        elif isinstance(payload, Exception):
+            future.set_exception(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _read_results(self, worker):
+        """Reader thread: resolve futures as a worker replies; fail them if it dies"""
+        while True:
+            try:
+                request_id, ok, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._resolve(request_id, ok, payload)
+
+        with self._lock:
+            worker.alive = False
+            lost = [request_id for request_id, entry in self._pending.items() if entry[1] is worker]
+        for request_id in lost:
+            self._resolve(request_id, False, f"Worker {worker.index} exited")
+        if lost or worker.process.exitcode not in (0, None):
+            print(f"Worker {worker.index} exited (code {worker.process.exitcode})", file=sys.stderr)
+
+    def submit(self, image, **options):
+        """Dispatch an image (path or encoded bytes) to the least-loaded worker"""
+        with self._lock:
+            worker = self._pick_worker()
+        return self._send(worker, 'predict', (image, options))
+
+    def predict(self, image, **options):
+        return self.submit(image, **options).result()
+
+    def _broadcast(self, op, argument=None, timeout=None):
+        """Send an operation to every live worker and wait for all replies"""
+        futures = [(worker, self._send(worker, op, argument)) for worker in self.workers if worker.alive]
+        return [(worker, future.result(timeout)) for worker, future in futures]
+
+    def reload_model(self, version=None):
+        """Hot-swap every worker to a registry version; True if any of them swapped"""
+        replies = self._broadcast('reload', version)
+        if replies:
+            self.model_version = replies[0][1]['model_version']
+            self.registry_version = replies[0][1]['registry_version']
+        return any(reply['reloaded'] for _, reply in replies)
+
+    def get_model_info(self):
+        """The first live worker's model info, plus the pool layout"""
+        with self._lock:
+            worker = self._pick_worker()
+        info = self._send(worker, 'info').result(timeout=30)
+        return {**info, 'processes': self.processes, 'startup_timings_ms': self.startup_timings}
+
+    def get_pool_metrics(self):
+        """Pool layout and per-worker load"""
+        with self._lock:
+            workers = [{
+                'index': worker.index,
+                'pid': worker.process.pid,
+                'cpus': worker.cpus if self.pin else None,
+                'alive': worker.alive,
+                'outstanding': worker.outstanding,
+                'completed': worker.completed
+            } for worker in self.workers]
+        return {
+            'processes': self.processes,
+            'intra_op_threads': self.intra_op_threads,
+            'inter_op_threads': self.inter_op_threads,
+            'pinned': self.pin,
+            'auto_benchmark': self.benchmark,
+            'workers': workers
+        }
+
+    def get_metrics(self):
+        """Pool-wide request metrics plus each worker's own service metrics"""
+        return {
+            'requests': self.metrics.snapshot(),
+            'startup_timings_ms': self.startup_timings,
+            'pool': self.get_pool_metrics(),
+            'workers': [metrics for _, metrics in self._broadcast('metrics', timeout=30)]
+        }
+
+    def close(self):
+        """Let workers finish accepted requests, then stop them"""
+        for worker in self.workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send((None, 'close', None))
+            except (OSError, ValueError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=30)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
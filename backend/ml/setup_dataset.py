@@ -5,6 +5,7 @@ Downloads and prepares the RSNA 2022 Cervical Spine Fracture Detection dataset
 """
 
 import os
+import argparse
 import pandas as pd
 import numpy as np
 import pydicom
@@ -15,10 +16,14 @@ import zipfile
 from tqdm import tqdm
 import json
 import shutil
+from dicom_io import WINDOW_MODES, read_dicom
+from preprocessing import enhance_xray
 
 class RSNADatasetSetup:
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', dicom_window=None):
         self.data_dir = Path(data_dir)
+        # None keeps the original min/max normalization the existing models were trained on
+        self.dicom_window = dicom_window
         self.raw_dir = self.data_dir / 'raw'
         self.processed_dir = self.data_dir / 'train_images'
         self.classes = ['Normal', 'Crack', 'Fracture', 'Hemorrhage']
@@ -57,32 +62,26 @@ class RSNADatasetSetup:
             print("❌ Please download the dataset manually using the commands above")
             return False
     
-    def convert_dicom_to_jpg(self, dicom_path, output_path, target_size=(224, 224)):
-        """Convert DICOM file to JPEG with preprocessing"""
+    def convert_dicom_to_jpg(self, dicom_path, output_path, target_size=(224, 224), window=None):
+        """Convert DICOM file to JPEG with preprocessing.
+
+        window None normalizes the stored pixels by their min/max, as the
+        existing models were trained. A dicom_io window mode ('auto', 'voi',
+        'percentile', 'minmax') instead rescales, windows and inverts exactly
+        as the predictor does for DICOM input; that changes the training
+        pixels, so models must be retrained on the new conversion.
+        """
         try:
-            # Read DICOM file
-            dicom = pydicom.dcmread(dicom_path)
-            
-            # Get pixel array
-            pixel_array = dicom.pixel_array
-            
-            # Normalize to 0-255
-            pixel_array = pixel_array.astype(np.float32)
-            pixel_array = (pixel_array - pixel_array.min()) / (pixel_array.max() - pixel_array.min())
-            pixel_array = (pixel_array * 255).astype(np.uint8)
-            
-            # Convert to RGB if grayscale
-            if len(pixel_array.shape) == 2:
-                pixel_array = cv2.cvtColor(pixel_array, cv2.COLOR_GRAY2RGB)
-            
-            # Resize
-            pixel_array = cv2.resize(pixel_array, target_size)
+            if window is None:
+                # Read DICOM file and normalize to 0-255
+                pixel_array = pydicom.dcmread(dicom_path).pixel_array.astype(np.float32)
+                pixel_array = (pixel_array - pixel_array.min()) / (pixel_array.max() - pixel_array.min())
+                pixel_array = (pixel_array * 255).astype(np.uint8)
+            else:
+                pixel_array = read_dicom(dicom_path, window=window, max_size=2 * max(target_size))
             
-            # Apply CLAHE for better contrast
-            lab = cv2.cvtColor(pixel_array, cv2.COLOR_RGB2LAB)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            lab[:,:,0] = clahe.apply(lab[:,:,0])
-            pixel_array = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+            # Resize and apply CLAHE for better contrast (grayscale stays single-channel until the end)
+            pixel_array = enhance_xray(pixel_array, size=target_size, bgr=False)
             
             # Save as JPEG
             cv2.imwrite(str(output_path), cv2.cvtColor(pixel_array, cv2.COLOR_RGB2BGR))
@@ -134,7 +133,7 @@ class RSNADatasetSetup:
             output_path = self.processed_dir / class_name.lower() / output_filename
             
             # Convert DICOM to JPEG
-            if self.convert_dicom_to_jpg(dicom_path, output_path):
+            if self.convert_dicom_to_jpg(dicom_path, output_path, window=self.dicom_window):
                 processed_data.append({
                     'image_path': f"train_images/{class_name.lower()}/{output_filename}",
                     'class': class_name,
@@ -195,9 +194,15 @@ class RSNADatasetSetup:
 
 def main():
     """Main setup function"""
+    parser = argparse.ArgumentParser(description='Download and prepare the RSNA fracture dataset')
+    parser.add_argument('--dicom-window', choices=WINDOW_MODES,
+                        help="Window DICOMs as the predictor does instead of the default min/max "
+                             "normalization (changes training pixels; retrain afterwards)")
+    args = parser.parse_args()
+    
     print("=== RSNA Fracture Dataset Setup ===")
     
-    setup = RSNADatasetSetup()
+    setup = RSNADatasetSetup(dicom_window=args.dicom_window)
     
     # Step 1: Create directories
     setup.create_directories()
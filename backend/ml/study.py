@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Study-Level Prediction
+Expands a study (a list of images or a directory holding a DICOM series) into
+its views and pools the per-view class probabilities into one study result, so
+a multi-view examination is scored in a single batched forward pass
+"""
+
+from pathlib import Path
+import numpy as np
+
+from dicom_io import is_dicom, read_dicom_header
+
+AGGREGATIONS = ('max', 'mean')
+MAX_STUDY_VIEWS = 32
+
+def _series_order(header):
+    """Sort key placing DICOM instances in series/instance order"""
+    def number(name):
+        try:
+            return int(getattr(header, name, 0) or 0)
+        except (TypeError, ValueError):
+            return 0
+    return number('SeriesNumber'), number('InstanceNumber')
+
+def expand_study(source, max_views=MAX_STUDY_VIEWS):
+    """(view sources, study metadata) for a list of images or a DICOM series directory.
+
+    DICOM views are validated from their headers, ordered by series and
+    instance number, and contribute PatientID and StudyInstanceUID to the
+    metadata.
+    """
+    if isinstance(source, (str, Path)) and Path(source).is_dir():
+        views = sorted(str(path) for path in Path(source).iterdir() if path.is_file() and is_dicom(path))
+        if not views:
+            raise ValueError(f"No DICOM files found in {source}")
+    else:
+        views = list(source)
+    if not views:
+        raise ValueError("Study has no images")
+    if len(views) > max_views:
+        raise ValueError(f"Study has {len(views)} images; at most {max_views} are scored together")
+
+    metadata = {}
+    headers = {}
+    for index, view in enumerate(views):
+        if is_dicom(view):
+            headers[index] = read_dicom_header(view)
+    if headers:
+        order = sorted(range(len(views)), key=lambda index: (
+            _series_order(headers[index]) if index in headers else (0, 0), index))
+        views = [views[index] for index in order]
+        first = next(iter(headers.values()))
+        for key, attribute in (('patient_id', 'PatientID'), ('study_uid', 'StudyInstanceUID')):
+            value = getattr(first, attribute, None)
+            if value:
+                metadata[key] = str(value)
+    return views, metadata
+
+def aggregate_views(probabilities, normal_index, method='max'):
+    """Study-level class probabilities and the index of the deciding view (None for 'mean').
+
+    'max' is max-risk pooling: the study takes the probabilities of its most
+    abnormal view (highest 1 - P(Normal)), so one positive view flags the
+    study. 'mean' averages the views.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    if method == 'max':
+        deciding = int(np.argmax(1.0 - probabilities[:, normal_index]))
+        return probabilities[deciding], deciding
+    if method == 'mean':
+        return probabilities.mean(axis=0), None
+    raise ValueError(f"Unknown study aggregation '{method}'. Choose from: {', '.join(AGGREGATIONS)}")
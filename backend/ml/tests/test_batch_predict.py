@@ -0,0 +1,61 @@
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from batch_predict import ParquetResultWriter, collect_inputs
+
+CLASS_NAMES = ['Normal', 'Crack', 'Fracture', 'Hemorrhage']
+
+
+def _write_dicom(path):
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.Modality = 'DX'
+    ds.Rows = ds.Columns = 8
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = np.zeros((8, 8), dtype=np.uint16).tobytes()
+    ds.save_as(path, enforce_file_format=True)
+
+
+def test_globs_and_directories_find_the_same_extensionless_dicoms(tmp_path):
+    _write_dicom(tmp_path / 'IM0001')
+    (tmp_path / 'scan.png').write_bytes(b'')
+    (tmp_path / 'notes').write_text('not an image')
+
+    expected = [str(tmp_path / 'IM0001'), str(tmp_path / 'scan.png')]
+    assert collect_inputs(str(tmp_path)) == expected
+    assert collect_inputs(str(tmp_path / '*')) == expected
+
+
+def test_parquet_parts_share_one_schema(tmp_path):
+    writer = ParquetResultWriter(tmp_path, CLASS_NAMES, rows_per_part=1)
+    writer.write([{'image_path': 'bad.png', 'success': False, 'error': 'Image decoding failed'}])
+    writer.write([{'image_path': 'good.png', 'success': True, 'predicted_class': 'Crack',
+                   'confidence': 0.8, 'model_version': '2.0.0', 'decided_by': 'full',
+                   'probabilities': {'Normal': 0.1, 'Crack': 0.8, 'Fracture': 0.05, 'Hemorrhage': 0.05}}])
+    writer.close()
+
+    parts = sorted(tmp_path.glob('part-*.parquet'))
+    assert len(parts) == 2
+    schemas = [pq.read_schema(part) for part in parts]
+    assert schemas[0].equals(schemas[1])
+    assert schemas[0].equals(writer.schema)
+
+    df = pd.read_parquet(tmp_path)
+    assert list(df['success']) == [False, True]
+    assert df.loc[1, 'prob_Crack'] == 0.8
+
+    # Resuming drops the failed part and keeps the rest readable as one dataset
+    resumed = ParquetResultWriter(tmp_path, CLASS_NAMES)
+    assert resumed.completed_inputs() == {'good.png'}
+    assert [pq.read_schema(part).equals(writer.schema) for part in tmp_path.glob('part-*.parquet')] == [True]
@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from dicom_io import _native_pixels, is_dicom, read_dicom
+
+
+def _dicom_bytes(pixels, bits_stored, signed=False):
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.Modality = 'DX'
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = pixels.dtype.itemsize * 8
+    ds.BitsStored = bits_stored
+    ds.HighBit = bits_stored - 1
+    ds.PixelRepresentation = int(signed)
+    ds.PixelData = pixels.tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('dtype, bits_stored', [(np.uint16, 12), (np.int16, 12), (np.uint8, 8)])
+def test_strided_read_matches_decoded_pixels(dtype, bits_stored):
+    info = np.iinfo(dtype)
+    pixels = np.random.default_rng(0).integers(info.min, info.max, (600, 500), endpoint=True).astype(dtype)
+    ds = pydicom.dcmread(io.BytesIO(_dicom_bytes(pixels, bits_stored, signed=info.min < 0)))
+
+    strided = _native_pixels(ds, 3)
+    expected = ds.pixel_array[::3, ::3]
+    assert strided.dtype == expected.dtype
+    np.testing.assert_array_equal(strided, expected)
+
+
+def test_downsampled_read_keeps_the_short_side():
+    pixels = np.random.default_rng(1).integers(0, 4096, (1200, 1000)).astype(np.uint16)
+    image = read_dicom(_dicom_bytes(pixels, 12), max_size=300)
+    assert image.dtype == np.uint8
+    assert image.shape == (400, 334)
+
+
+def test_extensionless_files_are_recognised_by_their_preamble(tmp_path):
+    pixels = np.zeros((64, 64), dtype=np.uint16)
+    (tmp_path / 'IM0001').write_bytes(_dicom_bytes(pixels, 12))
+    (tmp_path / 'notes').write_text('not a DICOM file')
+    assert is_dicom(tmp_path / 'IM0001')
+    assert not is_dicom(tmp_path / 'notes')
@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ML_DIR = Path(__file__).resolve().parent.parent
+
+
+def _register_keras_model(registry, tmp_path):
+    from tensorflow import keras
+
+    inputs = keras.Input(shape=(224, 224, 3))
+    x = keras.layers.Conv2D(4, 3, strides=8, activation='relu')(inputs)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(4, activation='softmax')(x)
+    model_path = tmp_path / 'fracture_detection_model.h5'
+    keras.Model(inputs, outputs).save(str(model_path))
+    return registry.register([model_path], metadata={'model_version': '2.0.0'}, activate=True)
+
+
+def test_exported_tflite_is_served_from_the_registry(tmp_path):
+    from export_models import ModelExporter
+    from model_registry import ModelRegistry
+    from predict_fracture import FracturePredictionService
+
+    registry = ModelRegistry(tmp_path / 'registry')
+    trained = _register_keras_model(registry, tmp_path)
+
+    predictor = FracturePredictionService(backend='keras', registry=registry, warmup=False)
+    assert predictor.registry_version == trained
+    exporter = ModelExporter(predictor, models_dir=tmp_path)
+    exported = registry.extend(trained, [exporter.export_tflite_fp16()], activate=True)
+
+    assert registry.active_version() == exported
+    assert registry.get(exported)['derived_from'] == trained
+    assert registry.artifact_path(exported, 'keras').exists()
+
+    image_path = tmp_path / 'xray.png'
+    cv2.imwrite(str(image_path), np.random.default_rng(0).integers(0, 256, (256, 256), dtype=np.uint8))
+    completed = subprocess.run(
+        [sys.executable, str(ML_DIR / 'predict_fracture.py'), str(image_path),
+         '--backend', 'tflite-fp16', '--registry', str(registry.root)],
+        capture_output=True, text=True, cwd=ML_DIR, timeout=300
+    )
+    assert completed.returncode == 0, completed.stderr
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert result['predicted_class'] in predictor.class_names
+    assert result['model_version'] == exported
+    assert str(registry.artifact_path(exported, 'tflite-fp16')) in completed.stderr
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+
+from inference_server import FractureInferenceServer
+from predict_fracture import FracturePredictionService
+
+
+async def _request(port, method, path, body=b'', content_type='application/octet-stream'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+                  f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(payload)
+
+
+@pytest.fixture
+def server():
+    """A server on the mock model; run(make_request) serves one request on an ephemeral port"""
+    predictor = FracturePredictionService(model_path='models/missing_model.h5')
+    server = FractureInferenceServer(predictor, port=0, workers=1)
+
+    def run(make_request):
+        async def main():
+            await server.start()
+            try:
+                return await make_request(server.port)
+            finally:
+                await server.stop()
+        return asyncio.run(main())
+
+    return server, run
+
+
+def test_undecodable_upload_is_a_bad_request(server):
+    _, run = server
+    status, payload = run(lambda port: _request(port, 'POST', '/predict', b'not an image'))
+    assert status == 400
+    assert payload['success'] is False
+    assert 'decoding failed' in payload['error']
+
+
+def test_handler_errors_are_answered_with_500(server):
+    instance, run = server
+
+    async def broken(request):
+        raise KeyError('boom')
+
+    instance.routes[('GET', '/health')] = broken
+    status, payload = run(lambda port: _request(port, 'GET', '/health'))
+    assert status == 500
+    assert payload == {'success': False, 'error': 'Internal server error'}
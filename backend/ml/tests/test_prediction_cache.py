@@ -0,0 +1,55 @@
+import json
+import os
+
+from prediction_cache import PredictionCache
+
+
+def _model(tmp_path, name, version='2.0.0'):
+    model_path = tmp_path / f'{name}.h5'
+    model_path.write_bytes(b'weights')
+    metadata_path = tmp_path / f'{name}_metadata.json'
+    metadata_path.write_text(json.dumps({'model_version': version}))
+    return metadata_path, model_path
+
+
+def test_namespaces_sharing_a_database_keep_each_others_rows(tmp_path):
+    db_path = tmp_path / 'cache.sqlite'
+    keras_model = _model(tmp_path, 'keras')
+    keras = PredictionCache(*keras_model, namespace='keras', db_path=db_path)
+    keras.put('digest', {'predicted_class': 'Normal'})
+    keras.close()
+
+    # A different model in another namespace must not wipe the keras rows
+    PredictionCache(*_model(tmp_path, 'tflite', '3.0.0'), namespace='tflite-int8', db_path=db_path).close()
+
+    keras = PredictionCache(*keras_model, namespace='keras', db_path=db_path, max_entries=0)
+    assert keras.get('digest') == {'predicted_class': 'Normal'}
+    keras.close()
+
+
+def test_retraining_under_the_same_version_invalidates(tmp_path):
+    metadata_path, model_path = _model(tmp_path, 'model')
+    cache = PredictionCache(metadata_path, model_path, db_path=tmp_path / 'cache.sqlite', check_interval=0)
+    cache.put('digest', {'predicted_class': 'Normal'})
+    assert cache.get('digest') is not None
+
+    model_path.write_bytes(b'retrained weights')
+    stat = model_path.stat()
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get('digest') is None
+    assert cache.get_stats()['disk_entries'] == 0
+    cache.close()
+
+
+def test_puts_are_buffered_and_committed_on_flush(tmp_path):
+    cache = PredictionCache(*_model(tmp_path, 'model'), db_path=tmp_path / 'cache.sqlite',
+                            max_entries=0, write_interval=3600)
+    cache.put('digest', {'predicted_class': 'Crack'})
+    stats = cache.get_stats()
+    assert (stats['pending_writes'], stats['disk_entries']) == (1, 0)
+    assert cache.get('digest') == {'predicted_class': 'Crack'}
+
+    cache.flush()
+    stats = cache.get_stats()
+    assert (stats['pending_writes'], stats['disk_entries']) == (0, 1)
+    cache.close()
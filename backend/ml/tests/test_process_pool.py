@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ML_DIR = Path(__file__).resolve().parents[1]
+
+# Workers are forked, so the pool runs in a fresh interpreter that has not
+# imported TensorFlow (other tests in this session do).
+SCRIPT = textwrap.dedent('''
+    import cv2
+    import numpy as np
+    from process_pool import ProcessPool
+
+    image = np.random.default_rng(0).integers(0, 256, (256, 256), dtype=np.uint8)
+    body = cv2.imencode('.png', image)[1].tobytes()
+
+    pool = ProcessPool({'model_path': 'models/missing_model.h5'}, processes=2, pin=False)
+    try:
+        for raw in (body, bytearray(body), memoryview(body)):
+            result = pool.predict(raw)
+            assert 'predicted_class' in result, result
+        outstanding = [worker['outstanding'] for worker in pool.get_pool_metrics()['workers']]
+        assert not any(outstanding), outstanding
+    finally:
+        pool.close()
+''')
+
+
+def test_raw_request_bodies_reach_the_workers(tmp_path):
+    completed = subprocess.run([sys.executable, '-c', SCRIPT], cwd=tmp_path, capture_output=True,
+                               text=True, timeout=600, env={**os.environ, 'PYTHONPATH': str(ML_DIR)})
+    assert completed.returncode == 0, completed.stderr
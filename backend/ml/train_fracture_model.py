@@ -11,13 +11,16 @@ import pandas as pd
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
-import cv2
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 import json
+from data_pipeline import class_indices, image_paths, make_dataset
+from feature_cache import cache_features, head_model
+from image_store import store_key, store_parameters
+from preprocessing import read_image, preprocess_xray
 
 # Set random seeds for reproducibility
 np.random.seed(42)
@@ -61,9 +64,9 @@ class FractureDetectionModel:
         self.model = model
         return model
     
-    def compile_model(self, learning_rate=0.001):
-        """Compile model with appropriate loss and metrics"""
-        self.model.compile(
+    def compile_model(self, learning_rate=0.001, model=None):
+        """Compile model (or a model sharing its layers) with appropriate loss and metrics"""
+        (model or self.model).compile(
             optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
             loss='categorical_crossentropy',
             metrics=['accuracy', 'precision', 'recall']
@@ -72,68 +75,62 @@ class FractureDetectionModel:
     def preprocess_image(self, image_path):
         """Preprocess X-ray image for training"""
         # Read image
-        img = cv2.imread(str(image_path))
-        if img is None:
+        try:
+            img = read_image(image_path)
+        except ValueError:
             return None
-            
-        # Convert BGR to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Resize to target size
-        img = cv2.resize(img, self.img_size)
-        
-        # Apply CLAHE for better contrast
-        lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        lab[:,:,0] = clahe.apply(lab[:,:,0])
-        img = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
         
-        # Normalize pixel values
-        img = img.astype(np.float32) / 255.0
-        
-        return img
+        # Resize, apply CLAHE for better contrast and normalize pixel values
+        return preprocess_xray(img, self.img_size)
     
-    def create_data_generators(self, train_df, val_df, batch_size=32):
-        """Create data generators with augmentation"""
-        train_datagen = keras.preprocessing.image.ImageDataGenerator(
-            rotation_range=15,
-            width_shift_range=0.1,
-            height_shift_range=0.1,
-            shear_range=0.1,
-            zoom_range=0.1,
-            horizontal_flip=True,
-            brightness_range=[0.8, 1.2],
-            preprocessing_function=keras.applications.efficientnet.preprocess_input
-        )
-        
-        val_datagen = keras.preprocessing.image.ImageDataGenerator(
-            preprocessing_function=keras.applications.efficientnet.preprocess_input
-        )
-        
-        train_generator = train_datagen.flow_from_dataframe(
+    def create_data_generators(self, train_df, val_df, batch_size=32, cache=None):
+        """Create tf.data pipelines with augmentation (see data_pipeline.py)"""
+        # EfficientNet rescales internally, so images stay in [0, 255] as before
+        common = dict(classes=self.class_names, img_size=self.img_size, batch_size=batch_size,
+                      clahe=False, scale=1.0, cache=cache)
+        train_dataset = make_dataset(
             train_df,
-            x_col='image_path',
-            y_col='class',
-            target_size=self.img_size,
-            batch_size=batch_size,
-            class_mode='categorical',
-            shuffle=True
+            training=True,
+            augmentation={
+                'rotation_degrees': 15,
+                'shift': 0.1,
+                'zoom': 0.1,
+                'brightness': 0.2,
+                'horizontal_flip': True
+            },
+            **common
         )
+        val_dataset = make_dataset(val_df, **common)
+        return train_dataset, val_dataset
+    
+    def cache_head_features(self, train_df, val_df, batch_size=32, augmented_copies=0, root=None):
+        """Embed the training and validation images once with the frozen backbone (see feature_cache.py).
+
+        Returns (train, val) feature datasets for Phase 1. augmented_copies > 0
+        embeds that many augmented passes over the training set instead of
+        the plain images.
+        """
+        augmented_train, val_images = self.create_data_generators(train_df, val_df, batch_size)
+        if augmented_copies:
+            train_passes = [(augmented_train, len(train_df))] * augmented_copies
+        else:
+            train_passes = [(self.create_data_generators(train_df, train_df, batch_size)[1], len(train_df))]
         
-        val_generator = val_datagen.flow_from_dataframe(
-            val_df,
-            x_col='image_path',
-            y_col='class',
-            target_size=self.img_size,
-            batch_size=batch_size,
-            class_mode='categorical',
-            shuffle=False
-        )
+        def describe(df, copies):
+            paths = image_paths(df)
+            return {'images': store_key(paths, store_parameters(self.img_size, False)), 'copies': copies}
         
-        return train_generator, val_generator
+        root = Path(root or 'data/features')
+        train = cache_features(self.model, train_passes, root, describe(train_df, augmented_copies))
+        val = cache_features(self.model, [(val_images, len(val_df))], root, describe(val_df, 0))
+        return train.dataset(batch_size, training=True), val.dataset(batch_size)
     
-    def train_model(self, train_generator, val_generator, epochs=50):
-        """Train the model with callbacks"""
+    def train_model(self, train_generator, val_generator, epochs=50, head_features=None):
+        """Train the model with callbacks.
+
+        head_features, from cache_head_features(), trains Phase 1 on cached
+        backbone embeddings instead of images.
+        """
         callbacks = [
             keras.callbacks.EarlyStopping(
                 monitor='val_accuracy',
@@ -156,13 +153,26 @@ class FractureDetectionModel:
         
         # Initial training with frozen base
         print("Phase 1: Training with frozen base model...")
-        self.history = self.model.fit(
-            train_generator,
-            epochs=epochs//2,
-            validation_data=val_generator,
-            callbacks=callbacks,
-            verbose=1
-        )
+        if head_features is None:
+            self.history = self.model.fit(
+                train_generator,
+                epochs=epochs//2,
+                validation_data=val_generator,
+                callbacks=callbacks,
+                verbose=1
+            )
+        else:
+            # Only the head trains, on cached embeddings; checkpointing the full model resumes in Phase 2
+            head = head_model(self.model)
+            self.compile_model(model=head)
+            self.history = head.fit(
+                head_features[0],
+                epochs=epochs//2,
+                validation_data=head_features[1],
+                callbacks=[callback for callback in callbacks
+                           if not isinstance(callback, keras.callbacks.ModelCheckpoint)],
+                verbose=1
+            )
         
         # Fine-tuning phase
         print("Phase 2: Fine-tuning with unfrozen layers...")
@@ -187,14 +197,14 @@ class FractureDetectionModel:
         for key in self.history.history:
             self.history.history[key].extend(history_fine.history[key])
     
-    def evaluate_model(self, test_generator):
+    def evaluate_model(self, test_dataset, test_df):
         """Evaluate model performance"""
         # Get predictions
-        predictions = self.model.predict(test_generator)
+        predictions = self.model.predict(test_dataset)
         predicted_classes = np.argmax(predictions, axis=1)
         
-        # Get true labels
-        true_classes = test_generator.classes
+        # Get true labels (the test pipeline is not shuffled)
+        true_classes = class_indices(test_df, self.class_names)
         
         # Classification report
         report = classification_report(
@@ -289,12 +299,15 @@ def main():
     train_gen, val_gen = model.create_data_generators(train_df, val_df, batch_size=32)
     test_gen = model.create_data_generators(test_df, test_df, batch_size=32)[1]
     
+    # Run the frozen backbone once; Phase 1 trains the head on the cached embeddings
+    head_features = model.cache_head_features(train_df, val_df, batch_size=32)
+    
     # Train model
-    model.train_model(train_gen, val_gen, epochs=50)
+    model.train_model(train_gen, val_gen, epochs=50, head_features=head_features)
     
     # Evaluate model
     print("Evaluating model on test set...")
-    report, cm, predictions = model.evaluate_model(test_gen)
+    report, cm, predictions = model.evaluate_model(test_gen, test_df)
     
     # Print results
     print("\nClassification Report:")
@@ -5,12 +5,12 @@ Trains EfficientNetB3 model on actual medical data for 99%+ accuracy
 """
 
 import os
+import argparse
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
-import cv2
 from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_class_weight
@@ -18,6 +18,14 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 import json
+from cascade import (CASCADE_CONFIG, DEFAULT_TARGET_SENSITIVITY, SCREENING_ARTIFACT,
+                     create_screening_model, save_cascade_config, tune_threshold)
+from model_registry import ModelRegistry
+from data_pipeline import MEDICAL_AUGMENTATION, class_indices, image_paths, make_dataset, steps_per_epoch
+from feature_cache import cache_features, head_model, split_at_pooling
+from image_store import materialize, store_key, store_parameters
+from manifest import validate_manifest
+from training_state import TrainingState, checkpoint_weights, load_checkpoint, resume_point
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -31,8 +39,11 @@ class EnhancedFractureModel:
         self.num_classes = num_classes
         self.class_names = ['Normal', 'Crack', 'Fracture', 'Hemorrhage']
         self.model = None
+        self.screening_model = None
+        self.cascade_tuning = None
         self.history = None
         self.data_dir = Path('data')
+        self.image_store = None
         
     def create_advanced_model(self):
         """Create state-of-the-art model for medical imaging"""
@@ -85,8 +96,8 @@ class EnhancedFractureModel:
         self.model = keras.Model(inputs, outputs)
         return self.model
     
-    def compile_model(self, learning_rate=0.001):
-        """Compile model with medical-optimized settings"""
+    def compile_model(self, learning_rate=0.001, model=None):
+        """Compile model (or a model sharing its layers) with medical-optimized settings"""
         # Use Adam with medical imaging learning rate schedule
         optimizer = keras.optimizers.Adam(
             learning_rate=learning_rate,
@@ -96,7 +107,7 @@ class EnhancedFractureModel:
         )
         
         # Focal loss for medical imbalanced data
-        self.model.compile(
+        (model or self.model).compile(
             optimizer=optimizer,
             loss='categorical_crossentropy',  # Can switch to focal loss if needed
             metrics=[
@@ -116,100 +127,167 @@ class EnhancedFractureModel:
         if not csv_path.exists():
             raise FileNotFoundError("train.csv not found. Run setup_dataset.py first.")
         
-        df = pd.read_csv(csv_path)
-        print(f"Loaded {len(df)} samples")
+        # Existence and header checks, reused while the image directories are unchanged
+        df_valid, stats = validate_manifest(csv_path, self.data_dir)
+        print(f"Loaded {stats['total']} samples" + (" (validated manifest reused)" if stats['cached'] else ""))
         
         # Check class distribution
-        class_counts = df['class'].value_counts()
+        class_counts = df_valid['class'].value_counts()
         print("Class distribution:")
         for class_name, count in class_counts.items():
-            print(f"  {class_name}: {count} ({count/len(df)*100:.1f}%)")
+            print(f"  {class_name}: {count} ({count/len(df_valid)*100:.1f}%)")
         
-        # Verify image files exist
-        valid_samples = []
-        for idx, row in df.iterrows():
-            img_path = self.data_dir / row['image_path']
-            if img_path.exists():
-                valid_samples.append(row)
-        
-        df_valid = pd.DataFrame(valid_samples)
-        print(f"Valid samples with existing images: {len(df_valid)}")
+        print(f"Valid samples with existing images: {len(df_valid)} "
+              f"(missing: {stats['missing']}, unreadable: {stats['unreadable']})")
         
         return df_valid
     
-    def create_data_generators(self, train_df, val_df, batch_size=16):
-        """Create optimized data generators for medical imaging"""
-        
-        # Medical imaging augmentation
-        train_datagen = keras.preprocessing.image.ImageDataGenerator(
-            rescale=1./255,
-            rotation_range=10,  # Reduced for medical accuracy
-            width_shift_range=0.05,
-            height_shift_range=0.05,
-            shear_range=0.05,
-            zoom_range=0.05,
-            horizontal_flip=True,
-            brightness_range=[0.9, 1.1],  # Subtle brightness changes
-            preprocessing_function=self.medical_preprocessing
+    def materialize_images(self, df, root=None):
+        """Preprocess every image once into the memory-mapped store (see image_store.py)"""
+        self.image_store = materialize(
+            image_paths(df, self.data_dir), self.img_size,
+            root=root or self.data_dir / 'preprocessed', clahe=True
         )
-        
-        val_datagen = keras.preprocessing.image.ImageDataGenerator(
-            rescale=1./255,
-            preprocessing_function=self.medical_preprocessing
+        return self.image_store
+    
+    def create_data_generators(self, train_df, val_df, batch_size=16, y_col='class',
+                               class_mode='categorical', classes=None, cache=None, start_epoch=None):
+        """Create parallel tf.data pipelines for medical imaging (see data_pipeline.py).
+
+        Images are CLAHE-enhanced and scaled to [0, 1] once, exactly as the
+        predictor does. After materialize_images() they are read from the
+        memory-mapped store; otherwise cache ('memory' or a file prefix) keeps
+        them decoded across epochs. Either way only augmentation is repeated.
+        start_epoch makes the training set an endless, resumable stream of
+        epochs (see make_dataset).
+        """
+        common = dict(classes=classes or self.class_names, img_size=self.img_size,
+                      data_dir=self.data_dir, y_col=y_col, label_mode=class_mode,
+                      batch_size=batch_size, cache=cache, store=self.image_store)
+        train_dataset = make_dataset(train_df, training=True, augmentation=MEDICAL_AUGMENTATION,
+                                     start_epoch=start_epoch, **common)
+        val_dataset = make_dataset(val_df, **common)
+        return train_dataset, val_dataset
+    
+    def cache_head_features(self, train_df, val_df, batch_size=16, augmented_copies=0, root=None):
+        """Embed the training and validation images once with the frozen backbone (see feature_cache.py).
+
+        Returns (train, val, steps) for Phase 1: train is a function
+        start_epoch -> endless training stream of steps batches per epoch, in
+        an order fixed by the epoch number, and val the validation features.
+        augmented_copies > 0 embeds that many augmented passes over the
+        training set instead of the plain images.
+        """
+        augmented_train, val_images = self.create_data_generators(train_df, val_df, batch_size)
+        if augmented_copies:
+            train_passes = [(augmented_train, len(train_df))] * augmented_copies
+        else:
+            train_passes = [(self.create_data_generators(train_df, train_df, batch_size)[1], len(train_df))]
+        
+        def describe(df, copies):
+            paths = image_paths(df, self.data_dir)
+            return {'images': store_key(paths, store_parameters(self.img_size, True)), 'copies': copies}
+        
+        root = Path(root or self.data_dir / 'features')
+        train = cache_features(self.model, train_passes, root, describe(train_df, augmented_copies))
+        val = cache_features(self.model, [(val_images, len(val_df))], root, describe(val_df, 0))
+        
+        def train_stream(start_epoch):
+            return train.dataset(batch_size, training=True, start_epoch=start_epoch)
+        return train_stream, val.dataset(batch_size), steps_per_epoch(len(train), batch_size)
+    
+    def train_screening_model(self, train_df, val_df, epochs=20, batch_size=32):
+        """Train the small Normal-vs-abnormal model that fronts the cascade"""
+        print("Training screening model...")
+        train_gen, val_gen = self.create_screening_generators(train_df, val_df, batch_size)
+        
+        self.screening_model = create_screening_model(self.img_size)
+        self.screening_model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=0.001),
+            loss='binary_crossentropy',
+            metrics=[keras.metrics.AUC(name='auc'), keras.metrics.Recall(name='recall')]
         )
         
-        # Create generators
-        train_generator = train_datagen.flow_from_dataframe(
-            train_df,
-            directory=str(self.data_dir),
-            x_col='image_path',
-            y_col='class',
-            target_size=self.img_size,
-            batch_size=batch_size,
-            class_mode='categorical',
-            shuffle=True,
-            seed=42
+        # Balanced weights so abnormal cases are not cheaply screened out
+        is_abnormal = (train_df['class'] != 'Normal').to_numpy(dtype=int)
+        weights = compute_class_weight('balanced', classes=np.array([0, 1]), y=is_abnormal)
+        self.screening_model.fit(
+            train_gen,
+            epochs=epochs,
+            validation_data=val_gen,
+            class_weight=dict(enumerate(weights)),
+            callbacks=[
+                keras.callbacks.EarlyStopping(
+                    monitor='val_auc',
+                    patience=5,
+                    restore_best_weights=True,
+                    mode='max'
+                )
+            ],
+            verbose=1
         )
+        return self.screening_model
+    
+    def create_screening_generators(self, train_df, val_df, batch_size=32):
+        """Binary normal/abnormal generators (abnormal = 1) for the screening model"""
+        def with_screen_label(df):
+            return df.assign(screen_label=np.where(df['class'] == 'Normal', 'normal', 'abnormal'))
         
-        val_generator = val_datagen.flow_from_dataframe(
-            val_df,
-            directory=str(self.data_dir),
-            x_col='image_path',
-            y_col='class',
-            target_size=self.img_size,
-            batch_size=batch_size,
-            class_mode='categorical',
-            shuffle=False,
-            seed=42
+        return self.create_data_generators(
+            with_screen_label(train_df), with_screen_label(val_df), batch_size=batch_size,
+            y_col='screen_label', class_mode='binary', classes=['normal', 'abnormal']
         )
-        
-        return train_generator, val_generator
     
-    def medical_preprocessing(self, img):
-        """Medical-specific image preprocessing"""
-        # Apply CLAHE for better contrast in medical images
-        img_lab = cv2.cvtColor((img * 255).astype(np.uint8), cv2.COLOR_RGB2LAB)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        img_lab[:,:,0] = clahe.apply(img_lab[:,:,0])
-        img_enhanced = cv2.cvtColor(img_lab, cv2.COLOR_LAB2RGB)
-        return img_enhanced.astype(np.float32) / 255.0
+    def tune_cascade_threshold(self, val_df, target_sensitivity=DEFAULT_TARGET_SENSITIVITY):
+        """Pick the screening threshold on the validation split for a target sensitivity"""
+        _, val_gen = self.create_screening_generators(val_df, val_df)
+        p_abnormal = self.screening_model.predict(val_gen, verbose=0).ravel()
+        self.cascade_tuning = tune_threshold(p_abnormal, (val_df['class'] != 'Normal').to_numpy(), target_sensitivity)
+        return self.cascade_tuning
     
     def calculate_class_weights(self, train_df):
         """Calculate class weights for imbalanced medical data"""
-        class_counts = train_df['class'].value_counts()
-        classes = list(class_counts.index)
+        # Keyed by label index, in the class_names order the input pipeline uses
+        classes = [name for name in self.class_names if name in set(train_df['class'])]
         weights = compute_class_weight(
             'balanced',
-            classes=classes,
+            classes=np.array(classes),
             y=train_df['class']
         )
         
-        class_weight_dict = dict(zip(range(len(classes)), weights))
+        class_weight_dict = {self.class_names.index(name): weight for name, weight in zip(classes, weights)}
         print("Class weights:", class_weight_dict)
         return class_weight_dict
     
-    def train_model(self, train_generator, val_generator, class_weights=None, epochs=100):
-        """Train model with medical-optimized callbacks"""
+    def _enter_phase(self, phase, head_features=None):
+        """Set trainable layers and compile for a training phase; returns the model to fit"""
+        if phase == 0 and head_features is not None:
+            # Only the head trains, on cached embeddings
+            model = head_model(self.model)
+            self.compile_model(model=model)
+            return model
+        if phase >= 1:
+            # Unfreeze the EfficientNet base for fine-tuning
+            backbone, _ = split_at_pooling(self.model)
+            backbone[-2].trainable = True
+        # Lower learning rate with every phase
+        self.compile_model(learning_rate=(0.001, 0.0001, 0.00001)[phase])
+        return self.model
+    
+    def train_model(self, train_generator, val_generator, class_weights=None, epochs=100, head_features=None,
+                    steps_per_epoch=None, checkpoint_dir=None, resume=False):
+        """Train model with medical-optimized callbacks.
+
+        head_features, from cache_head_features(), trains Phase 1 on cached
+        backbone embeddings instead of images; it may also be a function
+        returning them, called only if Phase 1 runs, so a resume past Phase 1
+        skips the backbone pass. train_generator may also be a
+        function start_epoch -> endless training stream (make_dataset with
+        start_epoch) with steps_per_epoch batches per epoch, so every epoch's
+        data order is fixed. checkpoint_dir writes the full training state
+        after every epoch (see training_state.py) and resume continues from
+        its newest checkpoint.
+        """
         
         # Create models directory
         models_dir = Path('models')
@@ -250,67 +328,84 @@ class EnhancedFractureModel:
             )
         ]
         
-        print("Phase 1: Training with frozen base model...")
-        # Initial training phase
-        history1 = self.model.fit(
-            train_generator,
-            epochs=epochs//3,
-            validation_data=val_generator,
-            callbacks=callbacks,
-            class_weight=class_weights,
-            verbose=1
-        )
-        
-        print("Phase 2: Fine-tuning with unfrozen layers...")
-        # Unfreeze base model for fine-tuning
-        self.model.layers[1].trainable = True  # Unfreeze EfficientNet
-        
-        # Recompile with lower learning rate
-        self.compile_model(learning_rate=0.0001)
-        
-        # Fine-tuning phase
-        history2 = self.model.fit(
-            train_generator,
-            epochs=epochs//3,
-            validation_data=val_generator,
-            callbacks=callbacks,
-            class_weight=class_weights,
-            verbose=1
-        )
-        
-        print("Phase 3: Final optimization...")
-        # Final optimization with very low learning rate
-        self.compile_model(learning_rate=0.00001)
+        phase_epochs = epochs // 3
+        checkpoint = load_checkpoint(checkpoint_dir) if resume and checkpoint_dir else None
+        start_phase, start_epoch = resume_point(checkpoint and checkpoint[0], phase_epochs)
+        training_state = None
+        if checkpoint_dir:
+            # Last, so a restore follows the other callbacks' reset at the start of fit()
+            training_state = TrainingState(checkpoint_dir, self.model, callbacks,
+                                           history=checkpoint and checkpoint[0]['history'])
+        if checkpoint:
+            print(f"Resuming at phase {start_phase + 1}, epoch {start_epoch + 1}")
+        
+        titles = ("Phase 1: Training with frozen base model...",
+                  "Phase 2: Fine-tuning with unfrozen layers...",
+                  "Phase 3: Final optimization...")
+        histories = []
+        for phase in range(len(titles)):
+            if phase < start_phase:
+                if phase >= 1:
+                    # Completed phases are skipped, but their base unfreezing still applies
+                    split_at_pooling(self.model)[0][-2].trainable = True
+                histories.append(training_state.history[phase])
+                continue
+            initial_epoch = start_epoch if phase == start_phase else 0
+            print(titles[phase])
+            if phase == 0 and callable(head_features):
+                head_features = head_features()
+            model = self._enter_phase(phase, head_features)
+            
+            phase_callbacks = callbacks
+            if model is not self.model:
+                # The head model is not the deployable model; checkpointing it resumes in Phase 2
+                phase_callbacks = [callback for callback in callbacks
+                                   if not isinstance(callback, keras.callbacks.ModelCheckpoint)]
+            if training_state is not None:
+                training_state.begin_phase(phase, checkpoint if phase == start_phase else None)
+                phase_callbacks = phase_callbacks + [training_state]
+            
+            if model is not self.model:
+                train_features, validation, steps = head_features
+                data = train_features(initial_epoch)
+            elif callable(train_generator):
+                data = train_generator(phase * phase_epochs + initial_epoch)
+                validation, steps = val_generator, steps_per_epoch
+            else:
+                data, validation, steps = train_generator, val_generator, None
+            
+            history = model.fit(
+                data,
+                epochs=phase_epochs,
+                initial_epoch=initial_epoch,
+                steps_per_epoch=steps,
+                validation_data=validation,
+                callbacks=phase_callbacks,
+                class_weight=class_weights,
+                verbose=1
+            )
+            histories.append(training_state.history[phase] if training_state is not None else history.history)
         
-        history3 = self.model.fit(
-            train_generator,
-            epochs=epochs//3,
-            validation_data=val_generator,
-            callbacks=callbacks,
-            class_weight=class_weights,
-            verbose=1
-        )
+        if checkpoint and start_phase == len(titles):
+            # Training had already finished
+            self.model.set_weights(checkpoint_weights(checkpoint[1]))
         
         # Combine histories
         self.history = {
-            'accuracy': history1.history['accuracy'] + history2.history['accuracy'] + history3.history['accuracy'],
-            'val_accuracy': history1.history['val_accuracy'] + history2.history['val_accuracy'] + history3.history['val_accuracy'],
-            'loss': history1.history['loss'] + history2.history['loss'] + history3.history['loss'],
-            'val_loss': history1.history['val_loss'] + history2.history['val_loss'] + history3.history['val_loss'],
-            'f1_score': history1.history['f1_score'] + history2.history['f1_score'] + history3.history['f1_score'],
-            'val_f1_score': history1.history['val_f1_score'] + history2.history['val_f1_score'] + history3.history['val_f1_score']
+            key: [value for history in histories for value in history.get(key, [])]
+            for key in ('accuracy', 'val_accuracy', 'loss', 'val_loss', 'f1_score', 'val_f1_score')
         }
     
-    def evaluate_model(self, test_generator):
+    def evaluate_model(self, test_dataset, test_df):
         """Comprehensive model evaluation for medical use"""
         print("Evaluating model...")
         
         # Get predictions
-        predictions = self.model.predict(test_generator, verbose=1)
+        predictions = self.model.predict(test_dataset, verbose=1)
         predicted_classes = np.argmax(predictions, axis=1)
         
-        # Get true labels
-        true_classes = test_generator.classes
+        # Get true labels (the test pipeline is not shuffled)
+        true_classes = class_indices(test_df, self.class_names)
         
         # Classification report
         report = classification_report(
@@ -379,7 +474,8 @@ class EnhancedFractureModel:
             'training_date': pd.Timestamp.now().isoformat(),
             'model_version': '2.0.0',
             'dataset': 'RSNA Fracture Detection',
-            'preprocessing': 'CLAHE + Medical Augmentation'
+            'preprocessing': 'CLAHE + Medical Augmentation',
+            'cascade': self.cascade_tuning
         }
         
         with open(models_dir / 'fracture_detection_model_metadata.json', 'w') as f:
@@ -387,9 +483,38 @@ class EnhancedFractureModel:
         
         print(f"✓ Model saved: {model_path}")
         print(f"✓ Metadata saved: {models_dir / 'fracture_detection_model_metadata.json'}")
+        
+        artifacts = [model_path]
+        if self.screening_model is not None and self.cascade_tuning is not None:
+            screening_path = models_dir / SCREENING_ARTIFACT
+            self.screening_model.save(str(screening_path))
+            save_cascade_config(models_dir, self.cascade_tuning)
+            artifacts += [screening_path, models_dir / CASCADE_CONFIG]
+            print(f"✓ Screening model saved: {screening_path}")
+        
+        # Publish as a new registry version; running predictors watching the registry swap to it
+        version = ModelRegistry().register(artifacts, metadata=metadata, activate=True)
+        print(f"✓ Registered and activated model version {version}")
+
+def split_dataset(df, random_state=42):
+    """Stratified 70/15/15 train/validation/test split shared by training and export"""
+    train_df, temp_df = train_test_split(
+        df, test_size=0.3, stratify=df['class'], random_state=random_state
+    )
+    val_df, test_df = train_test_split(
+        temp_df, test_size=0.5, stratify=temp_df['class'], random_state=random_state
+    )
+    return train_df, val_df, test_df
 
 def main():
     """Main training pipeline for real RSNA data"""
+    parser = argparse.ArgumentParser(description='Train the fracture model on the RSNA dataset')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the newest checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', default='models/training_state',
+                        help='Directory for full training-state checkpoints')
+    args = parser.parse_args()
+    
     print("=== Enhanced Fracture Detection Training ===")
     
     # Initialize model
@@ -404,12 +529,7 @@ def main():
         return
     
     # Split data with stratification
-    train_df, temp_df = train_test_split(
-        df, test_size=0.3, stratify=df['class'], random_state=42
-    )
-    val_df, test_df = train_test_split(
-        temp_df, test_size=0.5, stratify=temp_df['class'], random_state=42
-    )
+    train_df, val_df, test_df = split_dataset(df)
     
     print(f"Training samples: {len(train_df)}")
     print(f"Validation samples: {len(val_df)}")
@@ -424,16 +544,29 @@ def main():
     # Calculate class weights
     class_weights = model.calculate_class_weights(train_df)
     
-    # Create data generators
-    train_gen, val_gen = model.create_data_generators(train_df, val_df, batch_size=16)
+    # Decode, resize and CLAHE every image once; epochs then only augment
+    store = model.materialize_images(df)
+    print(f"Preprocessed image store: {store.directory} ({len(store)} images)")
+    
+    # Create data generators; training epochs stream in an order fixed by the epoch number
+    def train_stream(start_epoch):
+        return model.create_data_generators(train_df, val_df, batch_size=16, start_epoch=start_epoch)[0]
+    
+    val_gen = model.create_data_generators(val_df, val_df, batch_size=16)[1]
     test_gen = model.create_data_generators(test_df, test_df, batch_size=16)[1]
     
+    # Run the frozen backbone once; Phase 1 trains the head on the cached embeddings
+    def head_features():
+        return model.cache_head_features(train_df, val_df, batch_size=16)
+    
     # Train model
     print("Starting training...")
-    model.train_model(train_gen, val_gen, class_weights, epochs=90)
+    model.train_model(train_stream, val_gen, class_weights, epochs=90, head_features=head_features,
+                      steps_per_epoch=steps_per_epoch(len(train_df), 16),
+                      checkpoint_dir=args.checkpoint_dir, resume=args.resume)
     
     # Evaluate model
-    report, cm, predictions, medical_metrics = model.evaluate_model(test_gen)
+    report, cm, predictions, medical_metrics = model.evaluate_model(test_gen, test_df)
     
     # Print results
     print("\n=== MEDICAL EVALUATION RESULTS ===")
@@ -451,6 +584,15 @@ def main():
             metrics = report[class_name.lower()]
             print(f"{class_name}: P={metrics['precision']:.3f}, R={metrics['recall']:.3f}, F1={metrics['f1-score']:.3f}")
     
+    # Screening model for the cascade, tuned on validation for the target sensitivity
+    model.train_screening_model(train_df, val_df)
+    tuning = model.tune_cascade_threshold(val_df)
+    print("\n=== CASCADE SCREENING (validation) ===")
+    print(f"Threshold: P(abnormal) >= {tuning['threshold']:.4f} escalates to EfficientNetB3")
+    print(f"Abnormal cases escalated: {tuning['sensitivity']:.4f} (target {tuning['target_sensitivity']:.2f})")
+    print(f"Normal cases answered by the screening model: {tuning['normal_screened_out']:.4f}")
+    print(f"Overall escalation rate: {tuning['escalation_rate']:.4f}")
+    
     # Save model
     model.save_model_with_metadata(medical_metrics)
     
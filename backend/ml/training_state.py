@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Resumable Training State
+Full-state checkpoints for multi-phase training, so an interrupted run
+continues where it stopped instead of starting again from Phase 1.
+
+A checkpoint is taken after every epoch and at the end of every phase. It
+records the phase and the next epoch, the model weights, the optimizer
+variables (step count and moments), the learning rate, the state of the
+early-stopping / LR-plateau / best-model callbacks, the history so far and
+the Python, NumPy and TensorFlow RNG states. The data position needs no extra
+state: training streams derive each epoch's order from the epoch number (see
+data_pipeline.epoch_batches).
+
+Layout:
+    <root>/latest.json                       name of the newest complete checkpoint
+    <root>/phase<P>-epoch<E>/state.json      everything except arrays
+    <root>/phase<P>-epoch<E>/arrays.npz      weights, optimizer variables, callback best weights
+
+Weights are copied to host memory at the epoch boundary and written on a
+background thread; checkpoints appear atomically (written under a temporary
+name and renamed) and only the newest few are kept.
+"""
+
+import os
+import json
+import random
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+LATEST_FILE = 'latest.json'
+STATE_FILE = 'state.json'
+ARRAYS_FILE = 'arrays.npz'
+KEEP_CHECKPOINTS = 3
+# Callback attributes that carry state from one epoch to the next
+CALLBACK_ATTRIBUTES = ('wait', 'best', 'best_epoch', 'stopped_epoch', 'cooldown_counter')
+
+def _json_value(value):
+    """Plain Python value for metrics and callback attributes"""
+    value = np.asarray(value)
+    return value.item() if value.ndim == 0 else value.tolist()
+
+def capture_rng():
+    """(JSON state, arrays) of the Python, NumPy and TensorFlow global RNGs"""
+    name, keys, position, has_gauss, cached_gauss = np.random.get_state()
+    python_version, python_state, python_gauss = random.getstate()
+    state = {
+        'numpy': [name, int(position), int(has_gauss), float(cached_gauss)],
+        'python': [python_version, list(python_state), python_gauss]
+    }
+    arrays = {
+        'rng_numpy_keys': keys,
+        'rng_tensorflow': tf.random.get_global_generator().state.numpy()
+    }
+    return state, arrays
+
+def restore_rng(state, arrays):
+    name, position, has_gauss, cached_gauss = state['numpy']
+    np.random.set_state((name, arrays['rng_numpy_keys'], position, has_gauss, cached_gauss))
+    python_version, python_state, python_gauss = state['python']
+    random.setstate((python_version, tuple(python_state), python_gauss))
+    tf.random.get_global_generator().reset(arrays['rng_tensorflow'])
+
+def _write_json_atomic(path, data):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_checkpoint(root):
+    """(state, arrays) of the newest checkpoint under root, or None if there is none"""
+    root = Path(root)
+    try:
+        with open(root / LATEST_FILE) as f:
+            name = json.load(f)['checkpoint']
+    except FileNotFoundError:
+        return None
+    with open(root / name / STATE_FILE) as f:
+        state = json.load(f)
+    with np.load(root / name / ARRAYS_FILE) as data:
+        arrays = {key: data[key] for key in data.files}
+    return state, arrays
+
+def _array_list(arrays, prefix):
+    count = sum(1 for key in arrays if key.startswith(f'{prefix}_'))
+    return [arrays[f'{prefix}_{index}'] for index in range(count)]
+
+def checkpoint_weights(arrays):
+    """Model weights stored in a checkpoint, in get_weights() order"""
+    return _array_list(arrays, 'weight')
+
+def resume_point(state, phase_epochs):
+    """(phase, epoch within it) at which training continues after a checkpoint"""
+    if state is None:
+        return 0, 0
+    if state['phase_complete'] or state['next_epoch'] >= phase_epochs:
+        return state['phase'] + 1, 0
+    return state['phase'], state['next_epoch']
+
+class TrainingState(keras.callbacks.Callback):
+    """Checkpoints full training state after every epoch and restores it on resume.
+
+    weights_model is the model whose weights are saved (the full model, also
+    while a head model sharing its layers is being fitted). tracked are the
+    callbacks whose state is saved; this callback must come after them in the
+    fit() callback list so a restore happens after their on_train_begin reset.
+    """
+    def __init__(self, root, weights_model, tracked, history=None, keep=KEEP_CHECKPOINTS):
+        super().__init__()
+        self.root = Path(root)
+        self.weights_model = weights_model
+        self.tracked = list(tracked)
+        self.history = history or []
+        self.keep = keep
+        self.phase = 0
+        self._restore = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+        self._pending = None
+
+    def begin_phase(self, phase, restore=None):
+        """Track a phase; restore is a loaded (state, arrays) to apply once fit() starts.
+
+        Weights and RNG state are always restored. Optimizer and callback
+        state only carry over within the same phase: a new phase starts
+        them afresh, exactly as an uninterrupted run does.
+        """
+        self.phase = phase
+        self._restore = restore
+        while len(self.history) <= phase:
+            self.history.append({})
+
+    def on_train_begin(self, logs=None):
+        if self._restore is None:
+            return
+        state, arrays = self._restore
+        self._restore = None
+        self.weights_model.set_weights(checkpoint_weights(arrays))
+        restore_rng(state['rng'], arrays)
+        if state['phase'] != self.phase or state['phase_complete']:
+            return
+
+        optimizer = self.model.optimizer
+        optimizer.build(self.model.trainable_variables)
+        for variable, value in zip(optimizer.variables, _array_list(arrays, 'optimizer')):
+            variable.assign(value)
+        optimizer.learning_rate = state['learning_rate']
+
+        for index, (callback, attributes) in enumerate(zip(self.tracked, state['callbacks'])):
+            for name, value in attributes.items():
+                setattr(callback, name, value)
+            best_weights = _array_list(arrays, f'callback{index}_weight')
+            if best_weights:
+                callback.best_weights = best_weights
+
+    def on_epoch_end(self, epoch, logs=None):
+        for key, value in (logs or {}).items():
+            self.history[self.phase].setdefault(key, []).append(_json_value(value))
+        self.save(next_epoch=epoch + 1)
+
+    def on_train_end(self, logs=None):
+        # Captures early stopping and restored best weights; the next run starts the next phase
+        self.save(next_epoch=None)
+        self.wait()
+
+    def snapshot(self, next_epoch):
+        """(state, arrays) copied to host memory, safe to write from another thread"""
+        optimizer = self.model.optimizer
+        arrays = {f'weight_{index}': value for index, value in enumerate(self.weights_model.get_weights())}
+        arrays.update({f'optimizer_{index}': np.array(variable.numpy())
+                       for index, variable in enumerate(optimizer.variables)})
+        callbacks = []
+        for index, callback in enumerate(self.tracked):
+            callbacks.append({name: _json_value(getattr(callback, name))
+                              for name in CALLBACK_ATTRIBUTES if hasattr(callback, name)})
+            for weight_index, value in enumerate(getattr(callback, 'best_weights', None) or []):
+                arrays[f'callback{index}_weight_{weight_index}'] = np.array(value)
+        rng_state, rng_arrays = capture_rng()
+        arrays.update(rng_arrays)
+        state = {
+            'phase': self.phase,
+            'next_epoch': next_epoch if next_epoch is not None else 0,
+            'phase_complete': next_epoch is None,
+            'learning_rate': float(np.asarray(optimizer.learning_rate)),
+            'callbacks': callbacks,
+            'history': self.history,
+            'rng': rng_state
+        }
+        return json.loads(json.dumps(state)), arrays
+
+    def save(self, next_epoch):
+        """Snapshot now and write in the background after any previous write finishes"""
+        state, arrays = self.snapshot(next_epoch)
+        name = f"phase{self.phase}-" + ('done' if next_epoch is None else f"epoch{next_epoch:04d}")
+        self.wait()
+        self._pending = self._writer.submit(self._write, name, state, arrays)
+
+    def wait(self):
+        """Block until the last checkpoint is on disk, re-raising a write error"""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def _write(self, name, state, arrays):
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = self.root / f".{name}.{os.getpid()}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        try:
+            np.savez(staging / ARRAYS_FILE, **arrays)
+            _write_json_atomic(staging / STATE_FILE, state)
+            shutil.rmtree(self.root / name, ignore_errors=True)
+            os.replace(staging, self.root / name)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        _write_json_atomic(self.root / LATEST_FILE, {'checkpoint': name})
+        self._rotate(keep=name)
+
+    def _rotate(self, keep):
+        checkpoints = sorted((path for path in self.root.iterdir()
+                              if path.is_dir() and path.name.startswith('phase')),
+                             key=lambda path: path.stat().st_mtime_ns)
+        for path in checkpoints[:-self.keep]:
+            if path.name != keep:
+                shutil.rmtree(path, ignore_errors=True)
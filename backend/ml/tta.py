@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Batched Test-Time Augmentation
+Builds every augmented view of an image into one preallocated model batch so a
+TTA prediction costs a single forward pass. The mean probability is the
+answer and the spread across views is reported as an uncertainty estimate.
+
+The image is resized once; each view is then a flip, a small rotation and/or
+a different CLAHE clip limit applied at model resolution.
+"""
+
+import numpy as np
+
+# (horizontal flip, rotation in degrees, CLAHE clip limit) per view; the first is the
+# plain image. None is the standard clip limit. Importable without OpenCV for CLI choices.
+TTA_LEVELS = {
+    'flip': (
+        (False, 0, None),
+        (True, 0, None),
+    ),
+    'standard': (
+        (False, 0, None),
+        (True, 0, None),
+        (False, -5, None),
+        (False, 5, None),
+    ),
+    'full': (
+        (False, 0, None),
+        (True, 0, None),
+        (False, -10, None),
+        (False, -5, None),
+        (False, 5, None),
+        (False, 10, None),
+        (False, 0, 1.0),
+        (False, 0, 3.0),
+    ),
+}
+TTA_CHOICES = ('none', *TTA_LEVELS)
+
+def _rotated(img, angle):
+    """Rotate about the centre, filling the corners by reflection instead of black"""
+    import cv2
+
+    height, width = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REFLECT_101)
+
+def build_views(img, level, size, out=None):
+    """(N, H, W, 3) float32 batch of img's augmented views for a TTA level"""
+    import cv2
+    from preprocessing import CLAHE_CLIP_LIMIT, allocate_batch, preprocess_xray
+
+    views = TTA_LEVELS[level]
+    if out is None:
+        out = allocate_batch(len(views), size)
+    if (img.shape[1], img.shape[0]) != tuple(size):
+        img = cv2.resize(img, tuple(size))
+    for index, (flip, angle, clip_limit) in enumerate(views):
+        view = _rotated(img, angle) if angle else img
+        if flip:
+            view = np.ascontiguousarray(view[:, ::-1])
+        preprocess_xray(view, size, out=out[index], clip_limit=clip_limit or CLAHE_CLIP_LIMIT)
+    return out[:len(views)]
+
+def summarize_views(probabilities):
+    """Mean class probabilities and their standard deviation across views"""
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    return probabilities.mean(axis=0), probabilities.std(axis=0)
@@ -33,6 +33,79 @@ const MODEL_INFO = {
   dataset: 'RSNA Fracture Detection'
 };
 
+// Persistent Python predictor: the model is loaded once and requests are
+// exchanged as JSON lines, matched back to their callers by request id
+let predictorProcess = null;
+let nextRequestId = 1;
+const pendingPredictions = new Map();
+
+function getPredictorProcess() {
+  if (predictorProcess) {
+    return predictorProcess;
+  }
+
+  const pythonScript = path.join(__dirname, '../ml/predict_fracture.py');
+  const child = spawn('python', [pythonScript, '--serve'], {
+    cwd: path.join(__dirname, '../ml')
+  });
+
+  let buffered = '';
+  child.stdout.on('data', (data) => {
+    buffered += data.toString();
+    let newlineIndex;
+    while ((newlineIndex = buffered.indexOf('\\n')) >= 0) {
+      const line = buffered.slice(0, newlineIndex).trim();
+      buffered = buffered.slice(newlineIndex + 1);
+      if (!line) {
+        continue;
+      }
+
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch (parseError) {
+        console.warn('Unparseable predictor output:', line);
+        continue;
+      }
+
+      const pending = pendingPredictions.get(message.id);
+      if (!pending) {
+        continue;
+      }
+      pendingPredictions.delete(message.id);
+      if (message.success) {
+        pending.resolve(message.result);
+      } else {
+        pending.reject(new Error(message.error));
+      }
+    }
+  });
+
+  child.stderr.on('data', (data) => {
+    console.warn('Predictor:', data.toString().trim());
+  });
+
+  child.on('exit', (code) => {
+    predictorProcess = null;
+    for (const pending of pendingPredictions.values()) {
+      pending.reject(new Error(`Prediction worker exited with code ${code}`));
+    }
+    pendingPredictions.clear();
+  });
+
+  predictorProcess = child;
+  return child;
+}
+
+function requestPrediction(payload) {
+  const child = getPredictorProcess();
+  const id = nextRequestId++;
+  return new Promise((resolve, reject) => {
+    pendingPredictions.set(id, { resolve, reject });
+    child.stdin.write(JSON.stringify({ id, ...payload }) + '\\n');
+  });
+}
+
 /**
  * Predict fracture using real trained model
  */
@@ -49,88 +122,33 @@ const predictFracture = async (req, res) => {
 
     const imageName = filename || 'uploaded-image.jpg';
     
-    // Save uploaded image temporarily
-    const tempDir = path.join(__dirname, '../ml/temp');
-    if (!fs.existsSync(tempDir)) {
-      fs.mkdirSync(tempDir, { recursive: true });
-    }
-    
-    const tempImagePath = path.join(tempDir, `temp_${Date.now()}_${imageName}`);
-    
-    // Convert base64 to image file
-    const base64Data = imageData.replace(/^data:image\/[a-z]+;base64,/, '');
-    const imageBuffer = Buffer.from(base64Data, 'base64');
-    fs.writeFileSync(tempImagePath, imageBuffer);
-    
-    // Call Python prediction script
-    const pythonScript = path.join(__dirname, '../ml/predict_fracture.py');
-    const pythonProcess = spawn('python', [pythonScript, tempImagePath]);
-    
-    let result = '';
-    let error = '';
-    
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
+    // Hand the base64 payload straight to the predictor, which decodes it in memory
+    const prediction = await requestPrediction({ image_base64: imageData });
     
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString();
-    });
+    // Format response for frontend
+    const response = {
+      success: true,
+      prediction: {
+        class: prediction.predicted_class,
+        confidence: prediction.confidence,
+        probabilities: prediction.probabilities,
+        riskLevel: getRiskLevel(prediction.predicted_class, prediction.confidence),
+        recommendations: getRecommendations(prediction.predicted_class)
+      },
+      imageAnalysis: {
+        filename: imageName,
+        dataSize: imageData.length,
+        analysisMethod: 'Real EfficientNetB3 Model with RSNA Dataset',
+        processingTime: prediction.processing_time
+      },
+      modelInfo: {
+        ...MODEL_INFO,
+        modelVersion: prediction.model_version || MODEL_INFO.modelVersion
+      },
+      timestamp: new Date().toISOString()
+    };
     
-    pythonProcess.on('close', (code) => {
-      // Clean up temp file
-      try {
-        fs.unlinkSync(tempImagePath);
-      } catch (e) {
-        console.warn('Could not delete temp file:', e.message);
-      }
-      
-      if (code === 0) {
-        try {
-          const prediction = JSON.parse(result);
-          
-          // Format response for frontend
-          const response = {
-            success: true,
-            prediction: {
-              class: prediction.predicted_class,
-              confidence: prediction.confidence,
-              probabilities: prediction.probabilities,
-              riskLevel: getRiskLevel(prediction.predicted_class, prediction.confidence),
-              recommendations: getRecommendations(prediction.predicted_class)
-            },
-            imageAnalysis: {
-              filename: imageName,
-              dataSize: imageData.length,
-              analysisMethod: 'Real EfficientNetB3 Model with RSNA Dataset',
-              processingTime: prediction.processing_time
-            },
-            modelInfo: {
-              ...MODEL_INFO,
-              modelVersion: prediction.model_version || MODEL_INFO.modelVersion
-            },
-            timestamp: new Date().toISOString()
-          };
-          
-          res.json(response);
-          
-        } catch (parseError) {
-          console.error('Error parsing Python output:', parseError);
-          res.status(500).json({
-            success: false,
-            message: 'Error processing prediction results',
-            error: process.env.NODE_ENV === 'development' ? parseError.message : 'Internal server error'
-          });
-        }
-      } else {
-        console.error('Python script error:', error);
-        res.status(500).json({
-          success: false,
-          message: 'Model prediction failed',
-          error: process.env.NODE_ENV === 'development' ? error : 'Internal server error'
-        });
-      }
-    });
+    res.json(response);
 
   } catch (error) {
     console.error('Fracture prediction error:', error);